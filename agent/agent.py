@@ -1,9 +1,13 @@
 
+from functools import lru_cache
 from typing import TypedDict, Sequence, List, Any
 from langgraph.graph import END, Graph
 from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
+from pydantic import Field, create_model
 
+from agent.models import scoped_structured_output
+from agent.prompt import fit_prompt
 from game.core.area import Area
 
 
@@ -19,27 +23,44 @@ class AgentState(TypedDict):
     map: str
     known_stuff: str
     command: Any # this is lazy!
+    succeeded: bool # whether the last command did what it was meant to
+    plan_steps: int # the commands sent since the last plan was made
+    scope: tuple # the names of the objects in scope and the directions of the exits
 
 
+# How an agent gets from its state to a command:
+#   chain: reasons, plans and acts, in three calls
+#   fused: does all three in one structured output call
+#   adaptive: chains, but goes straight to acting while the last plan is still working
+AGENT_MODES = ('chain', 'fused', 'adaptive')
+
+# The most commands sent on one plan before the adaptive agent plans again
+MAX_PLAN_STEPS = 5
+
+
+# Providers cache the longest prefix prompts share with earlier ones, so every prompt starts with what never
+# changes during an episode (the framing and the instructions), followed by what changes least often (the map
+# and what is known about each area), and ends with what changes every step (the last action and its result).
+
 reason_prompt = ChatPromptTemplate.from_messages([
     ("system", "You are playing a text adventure. The objective of this text adventure is {purpose}."
                "You are the reasoning component of an agent designed to complete this text adventure. "
-               "Consider the current situation and make a strategic decision about how to complete the adventure."),
+               "Consider the current situation and make a strategic decision about how to complete the adventure. "
+               "Given all of the following, write a short statement assessing what the best goal to pursue is."),
+    ("system", "This is a map of the areas in the adventure that you have explored: {map}"
+               "This is what you know about each area: {known_stuff}"),
+    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"),
     ("system", "Your previous plan was {last_plan} based on the last rationale which was: {last_rationale}. "
-              "The most recently taken action by you is {last_action}. The result of that last action was {result}."),
-    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"
-               "This is a map of the areas in the adventure that you have explored: {map}"
-                "This is what you know about each area: {known_stuff}"),
-    ("system", "Given all of the preceding, write a short statement assessing what the best goal to pursue is.")])
+              "The most recently taken action by you is {last_action}. The result of that last action was {result}.")])
 
 
 plan_prompt = ChatPromptTemplate.from_messages([
     ("system", "You are playing a text adventure. The objective of this text adventure is {purpose}."
                "You are the planning component of an agent designed to complete this text adventure. "
                "Based on the reasoning made by the preceding step, write a plan on how to accomplish the rationale."),
-    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"
-               "The most recently taken action by you is {last_action}. The result of that last action was {result}."),
-    ("system", "Current reasoning: {reasoning}. Write a plan.")
+    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"),
+    ("system", "The most recently taken action by you is {last_action}. The result of that last action was {result}. "
+               "Current reasoning: {reasoning}. Write a plan.")
 ])
 
 
@@ -47,26 +68,170 @@ act_prompt = ChatPromptTemplate.from_messages([
     ("system", "You are playing a text adventure. The objective of this text adventure is {purpose}."
                "You are the acting component of an agent designed to complete this text adventure. "
                "Based on the plan made by the preceding step, write a text adventure command to further the plan."),
-    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"
-               "The most recently taken action by you is {last_action}. The result of that last action was {result}."),
-    ("system", "Given the following {plan}, make the text adventure command that will best further it.")
+    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"),
+    ("system", "The most recently taken action by you is {last_action}. The result of that last action was {result}. "
+               "Given the following {plan}, make the text adventure command that will best further it.")
 ])
 
 
+step_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are playing a text adventure. The objective of this text adventure is {purpose}."
+               "You are an agent designed to complete this text adventure. "
+               "Given all of the following, write a short statement assessing what the best goal to pursue is, "
+               "then a plan on how to accomplish it, then the text adventure command that will best further the plan."),
+    ("system", "This is a map of the areas in the adventure that you have explored: {map}"
+               "This is what you know about each area: {known_stuff}"),
+    ("system", "The name of the location you are currently in is {location_name}. This is its description: {description}"),
+    ("system", "Your previous plan was {last_plan} based on the last rationale which was: {last_rationale}. "
+              "The most recently taken action by you is {last_action}. The result of that last action was {result}.")])
+
+
+@lru_cache(maxsize=1024)
+def define_step_output(response_format: type) -> type:
+    """
+    Defines the structured output of the fused agent: a rationale, a plan and the command, in one response.
+
+    Args:
+        response_format (type): The structured output schema of a command, as made by `define_structured_output`.
+
+    Returns:
+        type: The pydantic model of a step.
+    """
+    return create_model(
+        'AgentStep',
+        rationale=(str, Field(description='A short statement assessing what the best goal to pursue is.')),
+        plan=(str, Field(description='A plan on how to accomplish the rationale.')),
+        command=(response_format, Field(description='The text adventure command that will best further the plan.')),
+    )
+
+
+@lru_cache(maxsize=1024)
+def define_command_list_output(response_format: type, max_commands: int) -> type:
+    """
+    Defines a structured output of several commands, for acting on a plan in one call rather than one per command.
+
+    The commands are run in order until one fails or moves to another area, so the ones after a move or a
+    command that might not work are often not run.
+
+    Args:
+        response_format (type): The structured output schema of a command, as made by `define_structured_output`.
+        max_commands (int): The most commands in one response.
+
+    Returns:
+        type: The pydantic model of the commands.
+    """
+    return create_model(
+        'AdventureCommands',
+        commands=(List[response_format], Field(
+            min_length=1,
+            max_length=max_commands,
+            description='The text adventure commands that will best further the plan, in the order to run them. '
+                        'They are run until one fails or moves to another area.',
+        )),
+    )
+
+
+def agent_commands(command) -> list:
+    """ The commands in an agent's `command`, whether it is a single command or a command list. """
+    return list(command.commands) if hasattr(command, 'commands') else [command]
+
+
+def format_reason_prompt(state: AgentState):
+    return fit_prompt(reason_prompt, 'reason', dict(
+        purpose=state['purpose'],
+        location_name=state['location_name'],
+        description=state['description'],
+        last_action=state['actions'][-1],
+        result=state['result'],
+        map=state['map'],
+        known_stuff=state['known_stuff'],
+        last_plan=state['plans'][-1],
+        last_rationale=state['reasonings'][-1],
+    ))
+
+
+def format_plan_prompt(state: AgentState):
+    return fit_prompt(plan_prompt, 'plan', dict(
+        purpose=state['purpose'],
+        location_name=state['location_name'],
+        description=state['description'],
+        last_action=state['actions'][-1],
+        result=state['result'],
+        reasoning=state['reasonings'][-1],
+    ))
+
+
+def format_act_prompt(state: AgentState):
+    return fit_prompt(act_prompt, 'act', dict(
+        purpose=state['purpose'],
+        location_name=state['location_name'],
+        description=state['description'],
+        last_action=state['actions'][-1],
+        result=state['result'],
+        plan=state['plans'][-1],
+    ))
+
+
+def format_step_prompt(state: AgentState):
+    return fit_prompt(step_prompt, 'step', dict(
+        purpose=state['purpose'],
+        location_name=state['location_name'],
+        description=state['description'],
+        last_action=state['actions'][-1],
+        result=state['result'],
+        map=state['map'],
+        known_stuff=state['known_stuff'],
+        last_plan=state['plans'][-1],
+        last_rationale=state['reasonings'][-1],
+    ))
+
+
+def should_replan(state: AgentState, max_plan_steps: int = MAX_PLAN_STEPS) -> bool:
+    """ Whether the adaptive agent reasons and plans again, rather than acting on its last plan. """
+    return (
+        len(state['plans']) < 2  # only the placeholder, nothing has been planned yet
+        or not state.get('succeeded', True)
+        or state.get('plan_steps', 0) >= max_plan_steps
+    )
+
+
+class ScopedOutputModel:
+    """
+    A model whose structured output at each step only allows the objects in scope, i.e. those in `state['scope']`.
+
+    The schemas are memoized by what is in scope (see `scoped_structured_output`), and so is the model bound
+    to each of them.
+
+    Attributes:
+        model: The model, without a structured output.
+        response_format (type): The schema of a command naming any object, for states without a scope.
+        wrap (Callable): Makes the structured output from a command schema, e.g. a list of commands.
+    """
+
+    def __init__(self, model, response_format: type, wrap=None):
+        self.model = model
+        self.response_format = response_format
+        self.wrap = wrap or (lambda schema: schema)
+        self._bound = {}
+
+    def for_state(self, state: AgentState):
+        """ The model with the structured output of the state's scope. """
+        scope = state.get('scope')
+        schema = self.response_format if scope is None else scoped_structured_output(scope, self.response_format)
+        bound = self._bound.get(schema)
+        if bound is None:
+            bound = self._bound[schema] = self.model.with_structured_output(self.wrap(schema))
+        return bound
+
+
+def for_state(model, state: AgentState):
+    """ The model to call in the given state: the model itself, unless its structured output depends on the state. """
+    return model.for_state(state) if isinstance(model, ScopedOutputModel) else model
+
+
 def make_reason(model):
     def reason(state: AgentState) -> AgentState:
-        prompt = reason_prompt.format_prompt(
-            purpose=state['purpose'],
-            location_name=state['location_name'],
-            description=state['description'],
-            last_action=state['actions'][-1],
-            result=state['result'],
-            map=state['map'],
-            known_stuff=state['known_stuff'],
-            last_plan=state['plans'][-1],
-            last_rationale=state['reasonings'][-1],
-        )
-        response = model.invoke(prompt)
+        response = model.invoke(format_reason_prompt(state))
         return {
             **state,
             "reasonings": state['reasonings'] + [response.content],
@@ -77,18 +242,11 @@ def make_reason(model):
 def make_plan(model):
 
     def plan(state: AgentState) -> AgentState:
-        prompt = plan_prompt.format_prompt(
-            purpose=state['purpose'],
-            location_name=state['location_name'],
-            description=state['description'],
-            last_action=state['actions'][-1],
-            result=state['result'],
-            reasoning=state['reasonings'][-1],
-        )
-        response = model.invoke(prompt)
+        response = model.invoke(format_plan_prompt(state))
         return {
             **state,
             "plans": state['plans'] + [response.content],
+            "plan_steps": 0,
         }
 
     return plan
@@ -98,30 +256,80 @@ def make_act(model):
 
     def act(state: AgentState) -> AgentState:
 
-        prompt = act_prompt.format_prompt(
-            purpose=state['purpose'],
-            location_name=state['location_name'],
-            description=state['description'],
-            last_action=state['actions'][-1],
-            result=state['result'],
-            plan=state['plans'][-1]
-        )
+        response = for_state(model, state).invoke(format_act_prompt(state))
+
+        return {
+            **state,
+            "command": response,
+            "plan_steps": state.get('plan_steps', 0) + 1,
+        }
+
+    return act
+
+
+def make_step(model):
+
+    def step(state: AgentState) -> AgentState:
+        response = for_state(model, state).invoke(format_step_prompt(state))
+        return _step_state(state, response)
+
+    return step
+
+
+def _step_state(state: AgentState, response) -> AgentState:
+    return {
+        **state,
+        "reasonings": state['reasonings'] + [response.rationale],
+        "plans": state['plans'] + [response.plan],
+        "command": response.command,
+        "plan_steps": 1,
+    }
+
+
+# The async nodes make the same calls as the ones above, but await the models, so that many agents can
+# run on one event loop while their calls are in flight.
+
+def make_async_reason(model):
+    async def reason(state: AgentState) -> AgentState:
+        response = await model.ainvoke(format_reason_prompt(state))
+        return {
+            **state,
+            "reasonings": state['reasonings'] + [response.content],
+        }
+    return reason
 
-        response = model.invoke(prompt)
 
+def make_async_plan(model):
+    async def plan(state: AgentState) -> AgentState:
+        response = await model.ainvoke(format_plan_prompt(state))
         return {
             **state,
-            "command": response
+            "plans": state['plans'] + [response.content],
+            "plan_steps": 0,
         }
+    return plan
 
+
+def make_async_act(model):
+    async def act(state: AgentState) -> AgentState:
+        response = await for_state(model, state).ainvoke(format_act_prompt(state))
+        return {
+            **state,
+            "command": response,
+            "plan_steps": state.get('plan_steps', 0) + 1,
+        }
     return act
 
 
-def make_agent(reason_model, plan_model, act_model):
+def make_async_step(model):
+    async def step(state: AgentState) -> AgentState:
+        response = await for_state(model, state).ainvoke(format_step_prompt(state))
+        return _step_state(state, response)
+    return step
+
+
+def build_graph(reason, plan, act):
 
-    reason = make_reason(reason_model)
-    plan = make_plan(plan_model)
-    act = make_act(act_model)
     workflow = Graph()
 
     workflow.add_node("reason", reason)
@@ -136,3 +344,110 @@ def make_agent(reason_model, plan_model, act_model):
     graph = workflow.compile()
     return graph
 
+
+def build_adaptive_graph(reason, plan, act, max_plan_steps=MAX_PLAN_STEPS):
+    """ Like `build_graph`, but skips reasoning and planning while `should_replan` says the last plan still holds. """
+
+    workflow = Graph()
+
+    workflow.add_node("reason", reason)
+    workflow.add_node("plan", plan)
+    workflow.add_node("act", act)
+
+    workflow.add_edge("reason", "plan")
+    workflow.add_edge("plan", "act")
+    workflow.add_edge("act", END)
+
+    workflow.set_conditional_entry_point(
+        lambda state: "reason" if should_replan(state, max_plan_steps) else "act",
+        {"reason": "reason", "act": "act"},
+    )
+    return workflow.compile()
+
+
+def build_fused_graph(step):
+
+    workflow = Graph()
+    workflow.add_node("step", step)
+    workflow.add_edge("step", END)
+    workflow.set_entry_point("step")
+    return workflow.compile()
+
+
+def make_agent(reason_model, plan_model, act_model):
+
+    reason = make_reason(reason_model)
+    plan = make_plan(plan_model)
+    act = make_act(act_model)
+    return build_graph(reason, plan, act)
+
+
+def make_adaptive_agent(reason_model, plan_model, act_model, max_plan_steps=MAX_PLAN_STEPS):
+    return build_adaptive_graph(make_reason(reason_model), make_plan(plan_model), make_act(act_model), max_plan_steps)
+
+
+def make_fused_agent(step_model):
+    """ Makes an agent that reasons, plans and acts in one call; the model's structured output is a `define_step_output`. """
+    return build_fused_graph(make_step(step_model))
+
+
+def make_async_agent(reason_model, plan_model, act_model):
+    """ Makes an agent that is run with `await agent.ainvoke(state)`; the models need an `ainvoke`. """
+
+    reason = make_async_reason(reason_model)
+    plan = make_async_plan(plan_model)
+    act = make_async_act(act_model)
+    return build_graph(reason, plan, act)
+
+
+def make_async_adaptive_agent(reason_model, plan_model, act_model, max_plan_steps=MAX_PLAN_STEPS):
+    return build_adaptive_graph(
+        make_async_reason(reason_model), make_async_plan(plan_model), make_async_act(act_model), max_plan_steps
+    )
+
+
+def make_async_fused_agent(step_model):
+    return build_fused_graph(make_async_step(step_model))
+
+
+def make_agent_for_mode(reason_model, plan_model, act_model, response_format, mode='chain', asynchronous=False,
+                        max_commands=1, scoped=False):
+    """
+    Makes an agent in one of the `AGENT_MODES`, giving the models the structured output they need.
+
+    Args:
+        reason_model: The reasoning model.
+        plan_model: The planning model.
+        act_model: The acting model, without a structured output; the fused agent makes all of its calls with it.
+        response_format (type): The structured output schema of a command.
+        mode (str): One of `AGENT_MODES`.
+        asynchronous (bool): Whether to make an agent that is run with `await agent.ainvoke(state)`.
+        max_commands (int): The most commands the agent may send at once; see `define_command_list_output`.
+        scoped (bool): Whether the commands may only name the objects in scope at each step, rather than any in
+            the adventure; see `ScopedOutputModel`.
+
+    Returns:
+        The compiled agent graph.
+    """
+    if mode not in AGENT_MODES:
+        raise ValueError(f'Unknown agent mode: {mode}')
+
+    def output_format(schema):
+        if max_commands > 1:
+            schema = define_command_list_output(schema, max_commands)
+        if mode == 'fused':
+            schema = define_step_output(schema)
+        return schema
+
+    if scoped:
+        act_model = ScopedOutputModel(act_model, response_format, output_format)
+    else:
+        act_model = act_model.with_structured_output(output_format(response_format))
+
+    if mode == 'fused':
+        return make_async_fused_agent(act_model) if asynchronous else make_fused_agent(act_model)
+    if mode == 'adaptive':
+        make = make_async_adaptive_agent if asynchronous else make_adaptive_agent
+    else:
+        make = make_async_agent if asynchronous else make_agent
+    return make(reason_model, plan_model, act_model)
@@ -0,0 +1,230 @@
+"""
+A disk-backed cache of model responses.
+
+Re-running the same episodes, e.g. after changing the engine, sends mostly the same prompts to the models
+again. Wrapping the models in `CachedModel` answers every prompt that has been seen before from a SQLite
+database instead, which makes re-runs fast, free and reproducible.
+
+Responses are keyed by the model, its parameters (temperature, structured output schema etc.) and a hash of
+the formatted prompt. Responses that aren't messages or structured outputs are pickled, so only use cache
+files you made yourself.
+"""
+import hashlib
+import json
+import pickle
+import threading
+import time
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from game import database
+from game.logger import logger
+
+
+class ResponseCache:
+    """
+    A SQLite store of model responses that evicts the least recently used ones once it grows past a size.
+
+    The database can be shared by worker processes.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+        max_bytes (int): The most bytes of responses kept.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that had to call the model.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = database.connect(
+            path,
+            'CREATE TABLE IF NOT EXISTS responses '
+            '(key TEXT PRIMARY KEY, model TEXT, response BLOB, size INTEGER, used REAL)',
+            'CREATE INDEX IF NOT EXISTS responses_used ON responses (used)',
+        )
+        self._size = self._total_size()
+        logger.info(f'Using response cache database at {path}')
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f'{model}\n{prompt}'.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """ Looks up a response, returning it serialized, or None if it isn't cached. """
+        with self._lock:
+            row = self._db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE responses SET used = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key: str, model: str, response: bytes):
+        """ Stores a serialized response, evicting the least recently used ones if the cache is full. """
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (key, model, response, len(response), time.time()),
+            )
+            self._size += len(response)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # other processes may have added or evicted responses since
+        self._size = self._total_size()
+        excess = self._size - self.max_bytes
+        evicted = []
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY used').fetchall():
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+            self._size -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+        logger.debug(f'Evicted {len(evicted)} responses, down to {self._size} bytes')
+
+    def _total_size(self) -> int:
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def clear(self):
+        """ Deletes every response and resets the counters. """
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+            self._size = 0
+            self.hits = self.misses = 0
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': self._size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def _schema_default(value: Any):
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return value.model_json_schema()
+    return str(value)
+
+
+def model_identity(model: Any) -> str:
+    """
+    Describes a model and its parameters, e.g. its name, temperature and any bound tools or response format.
+
+    Wrappers (`RateLimitedModel`, langchain bindings and sequences) are looked through to the chat model.
+    """
+    parts = []
+    while model is not None:
+        params = getattr(model, '_identifying_params', None)
+        if params is not None:
+            parts.append(params)
+            break
+        bound_kwargs = getattr(model, 'kwargs', None)
+        if isinstance(bound_kwargs, dict) and bound_kwargs:
+            parts.append(bound_kwargs)
+        model = getattr(model, 'bound', None) or getattr(model, 'first', None) or getattr(model, 'model', None)
+    return json.dumps(parts, sort_keys=True, default=_schema_default)
+
+
+def prompt_text(prompt: Any) -> str:
+    if hasattr(prompt, 'to_messages'):
+        return '\n'.join(f'{message.type}: {message.content}' for message in prompt.to_messages())
+    if hasattr(prompt, 'to_string'):
+        return prompt.to_string()
+    return str(prompt)
+
+
+class CachedModel:
+    """
+    Wraps a chat model so that responses to prompts it has seen before come from a `ResponseCache`.
+
+    Wrap the chat model itself and call `with_structured_output` on the wrapper, so that cached structured
+    outputs can be turned back into the schema. Both `invoke` and `ainvoke` are cached.
+
+    Attributes:
+        model: The wrapped model.
+        cache (ResponseCache): The cache.
+        schema (type): The structured output schema, if any.
+        identity (str): What responses are keyed by besides the prompt.
+    """
+
+    def __init__(self, model, cache: ResponseCache, namespace: str = '', schema: Optional[type] = None,
+                 identity: Optional[str] = None):
+        """
+        Args:
+            model: The model to wrap.
+            cache (ResponseCache): The cache.
+            namespace (str): Keeps these responses apart from other ones to the same prompts, e.g. the episode seed.
+        """
+        self.model = model
+        self.cache = cache
+        self.schema = schema
+        self.identity = identity or f'{namespace}\n{model_identity(model)}'
+
+    def with_structured_output(self, schema, **kwargs) -> 'CachedModel':
+        identity = json.dumps([self.identity, schema, kwargs], sort_keys=True, default=_schema_default)
+        return CachedModel(self.model.with_structured_output(schema, **kwargs), self.cache, schema=schema, identity=identity)
+
+    def invoke(self, prompt, **kwargs):
+        key = self._key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._loads(cached)
+        response = self.model.invoke(prompt, **kwargs)
+        self.cache.put(key, self.identity, self._dumps(response))
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        key = self._key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return self._loads(cached)
+        response = await self.model.ainvoke(prompt, **kwargs)
+        self.cache.put(key, self.identity, self._dumps(response))
+        return response
+
+    def _key(self, prompt, kwargs) -> str:
+        text = prompt_text(prompt)
+        if kwargs:
+            text += '\n' + json.dumps(kwargs, sort_keys=True, default=str)
+        return self.cache.key(self.identity, text)
+
+    def _dumps(self, response) -> bytes:
+        # structured outputs are usually built from classes made on the fly, which can't be pickled
+        if self.schema is not None and isinstance(response, self.schema):
+            return b'S' + response.model_dump_json().encode()
+        if hasattr(response, 'content') and hasattr(response, 'type'):
+            return b'M' + json.dumps({'content': response.content, 'usage_metadata': getattr(response, 'usage_metadata', None)}).encode()
+        return b'P' + pickle.dumps(response)
+
+    def _loads(self, data: bytes):
+        kind, body = data[:1], data[1:]
+        if kind == b'S':
+            return self.schema.model_validate_json(body)
+        if kind == b'M':
+            from langchain_core.messages import AIMessage
+            message = json.loads(body)
+            return AIMessage(content=message['content'], usage_metadata=message['usage_metadata'])
+        return pickle.loads(body)
@@ -0,0 +1,180 @@
+"""
+Rate limiting and retries for concurrent LLM calls.
+
+Every model call made by the async agent goes through one shared `RateLimiter`, so however many episodes run at
+once on the event loop, together they stay under the provider's requests and tokens per minute. Calls that fail
+because of rate limits or transient errors are retried with exponential backoff, and a rate limit error makes
+every caller sharing the limiter back off, not just the one that hit it.
+"""
+import asyncio
+import random
+import time
+import weakref
+from typing import Any, Optional
+
+from game.logger import logger
+
+# The fewest tokens a call is assumed to use, on top of its prompt, if the model doesn't cap its output
+DEFAULT_COMPLETION_TOKENS = 256
+
+RETRYABLE_ERRORS = ('RateLimitError', 'APITimeoutError', 'APIConnectionError', 'InternalServerError')
+
+
+class RateLimiter:
+    """
+    A token bucket for requests per minute and one for tokens per minute, shared by every model it is given to.
+
+    Attributes:
+        requests_per_minute (float): The most requests allowed per minute, or None for no limit.
+        tokens_per_minute (float): The most tokens allowed per minute, or None for no limit.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 clock=time.monotonic):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._clock = clock
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = clock()
+        self._paused_until = 0.0
+        # asyncio locks belong to an event loop, and the limiter may outlive one
+        self._locks = weakref.WeakKeyDictionary()
+
+    async def acquire(self, tokens: int = 0):
+        """
+        Waits until a request using the given number of tokens is allowed, and counts it.
+
+        Callers are let through in the order they arrive.
+
+        Args:
+            tokens (int): How many tokens the request is expected to use.
+        """
+        async with self._lock():
+            while True:
+                wait = self._wait(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self._requests is not None:
+                self._requests -= 1
+            if self._tokens is not None:
+                self._tokens -= tokens
+
+    def record(self, tokens: int):
+        """ Counts tokens a request used beyond what it acquired, e.g. once its actual usage is known. """
+        if self._tokens is not None:
+            self._refill()
+            self._tokens -= tokens
+
+    def pause(self, seconds: float):
+        """ Lets no requests through for the given time, e.g. after being told the rate limit was hit. """
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = self._locks.get(loop)
+        if lock is None:
+            lock = self._locks[loop] = asyncio.Lock()
+        return lock
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        if self._requests is not None:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self._tokens is not None:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait(self, tokens: int) -> float:
+        """ How long to wait until the request is allowed. """
+        self._refill()
+        wait = self._paused_until - self._clock()
+        if self._requests is not None and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self._tokens is not None:
+            # a request bigger than the whole bucket only has to wait for a full one
+            tokens = min(tokens, self.tokens_per_minute)
+            if self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+
+def estimate_tokens(prompt: Any, completion_tokens: Optional[int] = None) -> int:
+    """ Roughly estimates the tokens a call will use, at four characters a token for the prompt. """
+    text = prompt.to_string() if hasattr(prompt, 'to_string') else str(prompt)
+    return len(text) // 4 + (completion_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def is_retryable(error: Exception) -> bool:
+    """ Whether an error from a model call is worth retrying: rate limits, timeouts and server errors. """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+class RateLimitedModel:
+    """
+    Wraps a chat model so that its async calls go through a shared rate limiter and are retried with backoff.
+
+    Synchronous calls are passed straight through to the model.
+
+    Attributes:
+        model: The wrapped model, e.g. a `ChatOpenAI`, or the runnable returned by its `with_structured_output`.
+        limiter (RateLimiter): The limiter shared with the other models.
+        max_retries (int): How many times a failed call is retried.
+        base_delay (float): The delay before the first retry, in seconds; it doubles with every retry.
+        max_delay (float): The longest delay between retries, in seconds.
+    """
+
+    def __init__(self, model, limiter: RateLimiter, max_retries: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 60.0, completion_tokens: Optional[int] = None):
+        self.model = model
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens or getattr(model, 'max_tokens', None)
+
+    def with_structured_output(self, schema, **kwargs) -> 'RateLimitedModel':
+        return RateLimitedModel(
+            self.model.with_structured_output(schema, **kwargs),
+            self.limiter,
+            self.max_retries,
+            self.base_delay,
+            self.max_delay,
+            self.completion_tokens,
+        )
+
+    def invoke(self, prompt, **kwargs):
+        return self.model.invoke(prompt, **kwargs)
+
+    async def ainvoke(self, prompt, **kwargs):
+        tokens = estimate_tokens(prompt, self.completion_tokens)
+        attempt = 0
+        while True:
+            await self.limiter.acquire(tokens)
+            try:
+                response = await self.model.ainvoke(prompt, **kwargs)
+            except Exception as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    raise
+                # full jitter, so that callers that failed together don't retry together
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError':
+                    # everyone sharing the limiter is about to hit the same limit
+                    self.limiter.pause(delay)
+                logger.warning(f'Model call failed ({type(error).__name__}); retrying in {delay:.2f}s')
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            usage = getattr(response, 'usage_metadata', None)
+            if usage and usage.get('total_tokens'):
+                self.limiter.record(usage['total_tokens'] - tokens)
+            return response
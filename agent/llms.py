@@ -7,27 +7,31 @@ load_dotenv()
 
 from langchain_openai import ChatOpenAI
 
-reason_llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0.7,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
+def chat_model(max_retries: int = 2) -> ChatOpenAI:
+    """ Builds the chat model the agent's nodes use. """
+    return ChatOpenAI(
+        model="gpt-4o",
+        temperature=0.7,
+        max_tokens=None,
+        timeout=None,
+        max_retries=max_retries,
+    )
 
-plan_llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0.7,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
 
-act_llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0.7,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
+reason_llm = chat_model()
+plan_llm = chat_model()
+act_llm = chat_model()
+
+# All of the models share one rate limit, so their async calls share one limiter.
+# Set these to the limits of your OpenAI tier.
+from agent.limiter import RateLimiter, RateLimitedModel
+
+limiter = RateLimiter(
+    requests_per_minute=float(os.environ.get('OPENAI_RPM', 500)),
+    tokens_per_minute=float(os.environ.get('OPENAI_TPM', 30000)),
 )
 
+# The limiter does all of the retrying, so the clients it wraps don't retry on their own as well
+async_reason_llm = RateLimitedModel(chat_model(max_retries=0), limiter)
+async_plan_llm = RateLimitedModel(chat_model(max_retries=0), limiter)
+async_act_llm = RateLimitedModel(chat_model(max_retries=0), limiter)
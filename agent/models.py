@@ -1,6 +1,11 @@
 from enum import Enum
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from pydantic import BaseModel
 
 from game.actions.action_enums import FixtureVerbs, ItemVerbs, GameVerbs, AreaVerbs
+from game.core.area import EXIT_DIRECTIONS, Area
 
 def merge_enums(name, *enums):
     members = {}
@@ -10,3 +15,66 @@ def merge_enums(name, *enums):
 
 Actions = merge_enums("Actions", FixtureVerbs, ItemVerbs, GameVerbs, AreaVerbs)
 
+
+def define_structured_output(objects):
+    """
+    Defines the structured output of a command in an adventure: an action and up to two of its objects.
+
+    The schema is made once for each set of object names, so every game of an adventure shares it.
+
+    Args:
+        objects (dict): The adventure's artifacts, by ID; areas aren't objects.
+
+    Returns:
+        type: The pydantic model of a command.
+    """
+    # directions are objects too, as in "go n"
+    object_names = [x.name for x in objects.values() if not isinstance(x, Area)] + list(EXIT_DIRECTIONS)
+    return response_format_for(tuple(object_names))
+
+
+def scoped_structured_output(names: Iterable[str], response_format: Optional[type] = None):
+    """
+    Defines the structured output of a command that can only name the given objects, e.g. those in scope.
+
+    Schemas are memoized by the set of names, so a step with the same objects in scope as an earlier one
+    reuses its schema.
+
+    Args:
+        names (Iterable[str]): The objects the command may name.
+        response_format (type): The schema to fall back on if there are no names at all.
+
+    Returns:
+        type: The pydantic model of a command.
+    """
+    names = tuple(sorted(set(names)))
+    if not names and response_format is not None:
+        return response_format
+    return response_format_for(names)
+
+
+@lru_cache(maxsize=1024)
+def response_format_for(object_names: tuple) -> type:
+    Object = Enum("Object", {s.upper(): s for s in object_names})
+
+    class AdventureResponse(BaseModel):
+        action: Actions
+        object: Optional[Object]
+        iobject: Optional[Object]
+
+        def as_str(self):
+            object = ""
+            try:
+                object = self.object.value
+            except:
+                pass
+
+            iobject = ""
+            try:
+                iobject = self.iobject.value
+            except:
+                pass
+
+            return f"{self.action.value} {object} {iobject}".strip()
+
+    return AdventureResponse
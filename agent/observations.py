@@ -0,0 +1,152 @@
+"""
+Incrementally maintained observations of the game for the agent: the map, what is known about each visited
+area and the description of the current area.
+
+Rebuilding all of them after every command costs more the longer an episode runs. `ObservationBuilder`
+instead watches the game for the changes that affect them and only redoes what they invalidated, so the cost
+of a step stays flat however many areas have been visited.
+"""
+import os
+import weakref
+from typing import Optional
+
+from agent.prompt import TileMap, areas_to_known_stuff
+from game.core.area import EXIT_DIRECTIONS
+
+# How the map is shown to the agent: 'grid' draws it, 'adjacency' lists where each area's exits lead
+MAP_FORMAT = os.environ.get('MAP_FORMAT', 'grid')
+
+# Setting any of these can change how an area is described
+WATCHED_PROPERTIES = ('items', 'fixtures', 'is_visible', 'is_lit', 'is_open', 'is_accessible', 'is_dark')
+
+
+class ObservationBuilder:
+    """
+    Keeps the agent's observations of a game up to date as it is played.
+
+    The observations are the same as `areas_to_known_stuff` and `Area.get_description` would produce from
+    scratch. The map is laid out from the first area visited and grows as more are, rather than being laid out
+    again from the current area after every move.
+
+    Attributes:
+        adventure (TextAdventure): The game being observed.
+        map_format (str): 'grid' or 'adjacency', see `TileMap.render` and `TileMap.adjacency`.
+    """
+
+    def __init__(self, adventure: 'TextAdventure', map_format: Optional[str] = None):
+        # the game holds on to the builder through its watchers, so the builder mustn't hold on to the game
+        self._adventure = weakref.ref(adventure)
+        game_state = adventure.game_state
+
+        # bumped whenever anything a description depends on changes
+        self._version = 0
+        # the areas whose known stuff may be out of date
+        self._dirty_areas = set()
+        # area ID -> (the state it was built from, its known stuff)
+        self._known = {}
+        # area name -> known stuff, in the order the areas were visited
+        self._by_name = {}
+        # how many of the visited areas have been seen
+        self._seen = 0
+        self._known_stuff = None
+        self.map_format = map_format or MAP_FORMAT
+        self._tile_map = TileMap()
+        # how many of the visited areas are on the map
+        self._mapped = 0
+        self._description = None
+        self._description_key = None
+        self._scope = None
+        self._scope_key = None
+
+        game_state.watch_events(self._events_changed)
+        for artifact in game_state.artifacts.values():
+            for property_name in WATCHED_PROPERTIES:
+                artifact.watch(property_name, self._artifact_changed)
+
+    @property
+    def adventure(self) -> 'TextAdventure':
+        return self._adventure()
+
+    def _events_changed(self, events):
+        # triggers can change any description
+        self._version += 1
+        self._dirty_areas.update(self._known)
+
+    def _artifact_changed(self, artifact_id, property_name):
+        self._version += 1
+        if artifact_id in self._known:
+            self._dirty_areas.add(artifact_id)
+
+    def map(self) -> str:
+        """ The map of the visited areas; only newly visited areas are laid out, and it is redrawn only after those. """
+        visited = self.adventure.game_state.visited_tiles
+        # exits don't change and areas are never unvisited, so only the new areas need placing
+        if len(visited) > self._mapped:
+            self._tile_map.extend(visited[self._mapped:])
+            self._mapped = len(visited)
+        if self.map_format == 'adjacency':
+            return self._tile_map.adjacency()
+        return self._tile_map.render()
+
+    def known_stuff(self) -> str:
+        """ What is known about each visited area, as `areas_to_known_stuff` puts it; only changed areas are redone. """
+        game_state = self.adventure.game_state
+        visited = game_state.visited_tiles
+
+        # rendering the current area's description renames it, which shows in its known stuff
+        self._dirty_areas.add(self.adventure.current_state.id)
+        areas = [game_state.artifacts[area_id] for area_id in self._dirty_areas if area_id in self._known]
+        areas.extend(visited[self._seen:])
+        self._seen = len(visited)
+        self._dirty_areas.clear()
+
+        for area in areas:
+            description = area.description_
+            state = (tuple(area.fixtures), tuple(area.items), description.start, description.end, description.name)
+            known = self._known.get(area.id)
+            if known is None or known[0] != state:
+                text = areas_to_known_stuff(game_state, [area])
+                self._known[area.id] = (state, text)
+                # later areas with the same name replace earlier ones in place, as in `areas_to_known_stuff`
+                self._by_name[area.name] = text
+                self._known_stuff = None
+
+        if self._known_stuff is None:
+            self._known_stuff = "\n".join(self._by_name.values())
+        return self._known_stuff
+
+    def description(self) -> str:
+        """ The description of the current area; rendered again only if something it depends on changed. """
+        adventure = self.adventure
+        key = (adventure.current_state.id, self._version, tuple(adventure.game_state.inventory))
+        if key != self._description_key:
+            self._description = adventure.current_state.get_description(adventure.game_state)
+            self._description_key = key
+        return self._description
+
+    def scope(self) -> tuple:
+        """
+        The names of the objects in scope and the directions of the current area's exits, sorted; found again
+        only if something they depend on changed.
+        """
+        adventure = self.adventure
+        area = adventure.current_state
+        # the same changes that can change the description can change what is in scope
+        key = (area.id, self._version, tuple(adventure.game_state.inventory))
+        if key != self._scope_key:
+            names = {artifact.name for artifact in adventure.scope.in_scope(area)}
+            names.update(direction for direction, exit in zip(EXIT_DIRECTIONS, area.exits) if exit is not None)
+            self._scope = tuple(sorted(names))
+            self._scope_key = key
+        return self._scope
+
+
+_builders = weakref.WeakKeyDictionary()
+
+
+def observations_for(adventure: 'TextAdventure') -> ObservationBuilder:
+    """ The observation builder of a game, made the first time it is asked for. """
+    builder = _builders.get(adventure)
+    if builder is None:
+        builder = _builders[adventure] = ObservationBuilder(adventure)
+    return builder
@@ -0,0 +1,213 @@
+"""
+Local stand-ins for the reason, plan and act models.
+
+They have the same interface as the chat models the agent is made with (`invoke`, `ainvoke` and
+`with_structured_output`), but never touch the network, so the agent loop can be run, tested and benchmarked
+on its own. Each agent config below returns (reason, plan, act) models, like `simulate.openai_models`.
+"""
+import asyncio
+import enum
+import random
+import time
+import typing
+from functools import partial
+from typing import Iterable, List, Optional
+
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel
+
+
+# The first words of commands that move to another area
+MOVES = {'n', 's', 'e', 'w', 'north', 'south', 'east', 'west', 'go'}
+
+
+class Command:
+    """ A command that isn't an instance of the structured output schema, but quacks like one. """
+
+    def __init__(self, command: str):
+        self.command = command
+
+    def as_str(self) -> str:
+        return self.command
+
+
+class Step:
+    """ A fused agent step that isn't an instance of `agent.agent.define_step_output`, but quacks like one. """
+
+    def __init__(self, rationale: str, plan: str, command):
+        self.rationale = rationale
+        self.plan = plan
+        self.command = command
+
+
+class Commands:
+    """ A list of commands that isn't an instance of `agent.agent.define_command_list_output`, but quacks like one. """
+
+    def __init__(self, commands: Iterable[Command]):
+        self.commands = list(commands)
+
+
+def _command_list_length(schema: type) -> int:
+    """ The most commands a command list schema allows, or 0 if the schema isn't one. """
+    field = schema.model_fields.get('commands') if hasattr(schema, 'model_fields') else None
+    if field is None or typing.get_origin(field.annotation) is not list:
+        return 0
+    return next((rule.max_length for rule in field.metadata if hasattr(rule, 'max_length')), 1)
+
+
+def _command_schema(schema: type) -> Optional[type]:
+    """ The command schema nested in a fused step schema, or None if the schema isn't one. """
+    field = schema.model_fields.get('command') if hasattr(schema, 'model_fields') else None
+    annotation = field.annotation if field is not None else None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    return None
+
+
+class StubModel:
+    """
+    Answers every prompt with the same text after a fixed delay, standing in for the reason and plan models.
+
+    Attributes:
+        content (str): The response.
+        latency (float): How long every call takes, in seconds.
+    """
+
+    def __init__(self, content: str = 'Get ye flask.', latency: float = 0.0):
+        self.content = content
+        self.latency = latency
+
+    def with_structured_output(self, schema, **kwargs):
+        return RandomCommandModel(latency=self.latency).with_structured_output(schema)
+
+    def invoke(self, prompt, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(prompt)
+
+    def _respond(self, prompt):
+        return AIMessage(content=self.content)
+
+
+class TranscriptModel(StubModel):
+    """
+    Acts by replaying a transcript of commands, in order, then looking around once it runs out.
+
+    Attributes:
+        commands (list): The commands still to be replayed.
+    """
+
+    def __init__(self, commands: Iterable[str], latency: float = 0.0, fused: bool = False, batch: int = 0):
+        super().__init__(latency=latency)
+        self.commands = list(commands)
+        self.fused = fused
+        self.batch = batch
+
+    def with_structured_output(self, schema, **kwargs):
+        # commands are replayed as they were written, whether or not the schema could express them
+        command_schema = _command_schema(schema)
+        self.fused = command_schema is not None
+        # command lists are filled with as many of the next commands as they can hold
+        self.batch = _command_list_length(command_schema or schema)
+        return self
+
+    def _respond(self, prompt):
+        if self.batch:
+            # the commands after a move wouldn't be run, so a batch ends with one
+            size = 0
+            while size < min(self.batch, len(self.commands)):
+                size += 1
+                if self.commands[size - 1].split()[0] in MOVES:
+                    break
+            command = Commands([Command(command) for command in self.commands[:size]] or [Command('look')])
+            del self.commands[:size]
+        else:
+            command = Command(self.commands.pop(0) if self.commands else 'look')
+        return Step(self.content, self.content, command) if self.fused else command
+
+
+class RandomCommandModel(StubModel):
+    """
+    Acts by picking a random command the structured output schema allows, i.e. any action with any objects.
+
+    Attributes:
+        schema (type): The structured output schema, as made by `agent.models.define_structured_output`, or a fused
+            step schema or a command list schema around one, as made by `agent.agent.define_step_output` and
+            `agent.agent.define_command_list_output`.
+        rng (random.Random): The random number generator.
+    """
+
+    def __init__(self, schema: Optional[type] = None, seed: Optional[int] = None, latency: float = 0.0):
+        super().__init__(latency=latency)
+        self.schema = schema
+        self.rng = random.Random(seed)
+        self._choices = _field_choices(schema) if schema is not None else {}
+
+    def with_structured_output(self, schema, **kwargs):
+        return RandomCommandModel(schema, self.rng.random(), self.latency)
+
+    def _respond(self, prompt):
+        if self.schema is None:
+            return super()._respond(prompt)
+        length = _command_list_length(self.schema)
+        if length:
+            command_schema = typing.get_args(self.schema.model_fields['commands'].annotation)[0]
+            model = RandomCommandModel(command_schema, self.rng.random())
+            return self.schema(commands=[model._respond(prompt) for _ in range(self.rng.randint(1, length))])
+        command_schema = _command_schema(self.schema)
+        if command_schema is not None:
+            # a fused step: the command is picked like any other, around stub reasoning and planning
+            command = RandomCommandModel(command_schema, self.rng.random())._respond(prompt)
+            return self.schema(rationale=self.content, plan=self.content, command=command)
+        return self.schema(**{name: self.rng.choice(choices) for name, choices in self._choices.items()})
+
+
+def _field_choices(schema: type) -> dict:
+    """ The values each enum field of the schema can take, including None if the field is optional. """
+    choices = {}
+    for name, field in schema.model_fields.items():
+        annotation = field.annotation
+        values: List = []
+        if typing.get_origin(annotation) is typing.Union:
+            values.append(None)
+            annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+        if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+            choices[name] = values + list(annotation)
+    return choices
+
+
+def read_transcript(path: str) -> List[str]:
+    """ Reads a transcript: one command per line, skipping blank lines and lines starting with #. """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+# Agent configs, for `simulate.Episode.agent`
+
+def stub_models(seed=None, latency: float = 0.0):
+    """ Reasons and plans instantly (or after `latency`), and acts at random. """
+    return StubModel(latency=latency), StubModel(latency=latency), RandomCommandModel(seed=seed, latency=latency)
+
+
+def random_models(seed=None):
+    return stub_models(seed)
+
+
+def transcript_models(path: str, seed=None, latency: float = 0.0):
+    """ Replays the transcript at `path`; use with `functools.partial`, e.g. via `transcript_policy`. """
+    return StubModel(latency=latency), StubModel(latency=latency), TranscriptModel(read_transcript(path), latency)
+
+
+def transcript_policy(path: str, latency: float = 0.0):
+    """ The agent config replaying the transcript at `path`. """
+    return partial(transcript_models, path, latency=latency)
+
+
+def latency_policy(latency: float):
+    """ The agent config that acts at random after waiting `latency` seconds on every call, like a remote model. """
+    return partial(stub_models, latency=latency)
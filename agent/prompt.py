@@ -1,106 +1,173 @@
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Optional
 
-def create_tile_map(start_tile, valid_tiles):
-    """
-    So, I let Claude write this one. If it's buggy, not my fault!
+from game.core.area import EXIT_DIRECTIONS
+from game.logger import logger
 
-    Creates an ASCII map of connected tiles starting from a given tile.
-    Each tile is represented by its name attribute.
+# Where each of the directions of `Area.exits` leads on the map
+DIRECTION_OFFSETS = {'n': (0, -1), 's': (0, 1), 'e': (1, 0), 'w': (-1, 0)}
 
-    Args:
-        start_tile: The starting Area instance
 
-    Returns:
-        str: ASCII representation of the tile map
+class TileMap:
     """
-    # Track visited tiles to handle cycles
-    visited = []
+    Lays out connected areas on a grid, for drawing maps of the areas the player has visited.
+
+    Areas are placed breadth first from the first one, one step away from the area they are reached from in
+    the direction of the exit. Once placed an area keeps its position, so visiting another area only places
+    that one (and anything it connects that was waiting for it) rather than laying the whole map out again.
+    An area whose position is already taken by another, which can happen in maps that don't fit on a grid,
+    is left off the grid, though it still shows in the adjacency list.
 
-    # Track boundaries of the map
-    min_x = max_x = min_y = max_y = 0
+    Attributes:
+        positions (dict): The (x, y) position of each placed area, by ID.
+        tiles (dict): The areas that can be shown, by ID.
+    """
 
-    # Dictionary to store tile coordinates
-    tile_positions = {}
+    def __init__(self, start_tile=None):
+        self.positions = {}
+        self.tiles = {}
+        self._occupied = {}
+        # area ID -> the placed areas with an exit to it, and in which direction, for when it can be shown
+        self._incoming = {}
+        self._rendered = None
+        self._listed = None
+        if start_tile is not None:
+            self.extend([start_tile])
 
-    def explore_tiles(tile, x, y):
+    def extend(self, tiles):
         """
-        Recursively explores tiles and records their positions.
+        Adds areas that can be shown, e.g. one that was just visited, placing them and whatever they connect to.
 
         Args:
-            tile: Current Area instance
-            x, y: Current coordinates
+            tiles (Iterable[Area]): The areas to add.
         """
-        nonlocal min_x, max_x, min_y, max_y
-
-        if tile is None or tile not in valid_tiles or tile in visited:
-            return
-
-        visited.append(tile)
-        tile_positions[(x, y)] = tile.name
-
-        # Update boundaries
-        min_x = min(min_x, x)
-        max_x = max(max_x, x)
-        min_y = min(min_y, y)
-        max_y = max(max_y, y)
-
-        # Explore in each cardinal direction
-        # North
-        if tile.exits[0] and (x, y - 1) not in tile_positions:
-            explore_tiles(tile.exits[0], x, y - 1)
-
-        # East
-        if tile.exits[1] and (x + 1, y) not in tile_positions:
-            explore_tiles(tile.exits[1], x + 1, y)
-
-        # South
-        if tile.exits[2] and (x, y + 1) not in tile_positions:
-            explore_tiles(tile.exits[2], x, y + 1)
-
-        # West
-        if tile.exits[3] and (x - 1, y) not in tile_positions:
-            explore_tiles(tile.exits[3], x - 1, y)
-
-    # Start exploration from the first tile at (0,0)
-    explore_tiles(start_tile, 0, 0)
-
-    # Create the map string
-    map_lines = []
-
-    # Add tiles and connections
-    for y in range(min_y, max_y + 1):
-        # First line: north connections
-        north_line = ""
-        for x in range(min_x, max_x + 1):
-            if (x, y) in tile_positions:
-                tile_char = "│" if (x, y - 1) in tile_positions else " "
-            else:
-                tile_char = " "
-            north_line += f" {tile_char} "
-        map_lines.append(north_line)
-
-        # Second line: west/east connections and tile names
-        tile_line = ""
-        for x in range(min_x, max_x + 1):
-            if (x, y) in tile_positions:
-                west_char = "─" if (x - 1, y) in tile_positions else " "
-                east_char = "─" if (x + 1, y) in tile_positions else " "
-                tile_char = tile_positions[(x, y)]
-                tile_line += f"{west_char}{tile_char}{east_char}"
-            else:
-                tile_line += "   "
-        map_lines.append(tile_line)
-
-        # Third line: south connections
-        south_line = ""
-        for x in range(min_x, max_x + 1):
-            if (x, y) in tile_positions:
-                tile_char = "│" if (x, y + 1) in tile_positions else " "
-            else:
-                tile_char = " "
-            south_line += f" {tile_char} "
-        map_lines.append(south_line)
+        queue = deque()
+        for tile in tiles:
+            if tile is None or tile.id in self.tiles:
+                continue
+            self.tiles[tile.id] = tile
+            self._rendered = self._listed = None
+            if not self.positions:
+                # the first area anchors the map
+                self._place(tile, (0, 0), queue)
+                continue
+            for neighbour, direction in self._incoming.pop(tile.id, ()):
+                dx, dy = DIRECTION_OFFSETS[direction]
+                x, y = self.positions[neighbour.id]
+                if tile.id not in self.positions and (x + dx, y + dy) not in self._occupied:
+                    self._place(tile, (x + dx, y + dy), queue)
+
+        while queue:
+            tile = queue.popleft()
+            x, y = self.positions[tile.id]
+            for direction, neighbour in _exits(tile):
+                if neighbour.id in self.positions:
+                    continue
+                dx, dy = DIRECTION_OFFSETS[direction]
+                position = (x + dx, y + dy)
+                if neighbour.id in self.tiles and position not in self._occupied:
+                    self._place(neighbour, position, queue)
+                elif neighbour.id not in self.tiles:
+                    self._incoming.setdefault(neighbour.id, []).append((tile, direction))
+
+    def _place(self, tile, position, queue):
+        self.positions[tile.id] = position
+        self._occupied[position] = tile
+        queue.append(tile)
+
+    def render(self) -> str:
+        """
+        Draws the placed areas as an ASCII grid of their names, joined where they have exits to each other.
+
+        Returns:
+            str: The map.
+        """
+        if self._rendered is not None:
+            return self._rendered
+        if not self.positions:
+            return ''
+
+        xs = [x for x, _ in self._occupied]
+        ys = [y for _, y in self._occupied]
+        width = max(len(tile.name) for tile in self._occupied.values())
+        blank = ' ' * (width + 2)
+
+        lines = []
+        for y in range(min(ys), max(ys) + 1):
+            north_line, tile_line, south_line = [], [], []
+            for x in range(min(xs), max(xs) + 1):
+                tile = self._occupied.get((x, y))
+                if tile is None:
+                    north_line.append(blank)
+                    tile_line.append(blank)
+                    south_line.append(blank)
+                    continue
+                joined = self._joined(tile, x, y)
+                north_line.append(' ' + ('│' if 'n' in joined else ' ').center(width) + ' ')
+                tile_line.append(('─' if 'w' in joined else ' ') + tile.name.center(width) + ('─' if 'e' in joined else ' '))
+                south_line.append(' ' + ('│' if 's' in joined else ' ').center(width) + ' ')
+            lines.extend([''.join(north_line).rstrip(), ''.join(tile_line).rstrip(), ''.join(south_line).rstrip()])
 
-    return "\n".join(map_lines)
+        self._rendered = '\n'.join(lines)
+        return self._rendered
+
+    def _joined(self, tile, x, y) -> set:
+        """ The directions in which the area has an exit to the area drawn next to it. """
+        joined = set()
+        for direction, neighbour in _exits(tile):
+            dx, dy = DIRECTION_OFFSETS[direction]
+            drawn = self._occupied.get((x + dx, y + dy))
+            if drawn is not None and drawn.id == neighbour.id:
+                joined.add(direction)
+        return joined
+
+    def adjacency(self) -> str:
+        """
+        Lists each area with where its exits lead, which takes far fewer tokens than the grid for big maps.
+
+        Exits to areas that can't be shown (i.e. haven't been visited) are listed as unexplored.
+
+        Returns:
+            str: One line per area, e.g. "Door Room: n Treasure Room, e Dungeon Room 2".
+        """
+        if self._listed is not None:
+            return self._listed
+        lines = []
+        for tile in self.tiles.values():
+            exits = [
+                f"{direction} {neighbour.name if neighbour.id in self.tiles else 'unexplored'}"
+                for direction, neighbour in _exits(tile)
+            ]
+            lines.append(f"{tile.name}: {', '.join(exits) if exits else 'no exits'}")
+        self._listed = '\n'.join(lines)
+        return self._listed
+
+
+def _exits(tile):
+    """ The (direction, area) pairs of the area's exits. """
+    return [(direction, neighbour) for direction, neighbour in zip(EXIT_DIRECTIONS, tile.exits) if neighbour is not None]
+
+
+def create_tile_map(start_tile, valid_tiles):
+    """
+    Creates an ASCII map of the areas in `valid_tiles` that can be reached from a given area through them.
+    Each area is represented by its name.
+
+    Args:
+        start_tile: The starting Area instance
+        valid_tiles: The areas that can be shown, e.g. the visited ones
+
+    Returns:
+        str: ASCII representation of the tile map
+    """
+    valid_ids = {tile.id for tile in valid_tiles}
+    if start_tile is None or start_tile.id not in valid_ids:
+        return ''
+    tile_map = TileMap(start_tile)
+    tile_map.extend(valid_tiles)
+    return tile_map.render()
 
 def areas_to_known_stuff(game_state, areas):
     known_stuff = {}
@@ -109,3 +176,137 @@ def areas_to_known_stuff(game_state, areas):
         known_stuff[area.name] = f"Area Name: {area.name}. Area Description: {area.description_}. Things of Interest: {visible_things}"
 
     return "\n".join(list(known_stuff.values()))
+
+
+# --- Prompt sizes ---
+
+# The most tokens a prompt may take before the history and what is known about each area are cut down to fit
+PROMPT_BUDGET = int(os.environ['PROMPT_BUDGET']) if os.environ.get('PROMPT_BUDGET') else None
+
+# The tiktoken encoding tokens are counted with; without it (or set to '') they are estimated at four characters a token
+TOKEN_ENCODING = os.environ.get('TOKEN_ENCODING', 'o200k_base')
+
+# The fields holding earlier steps' output, in the order they are cut down when a prompt is over its budget
+HISTORY_FIELDS = ('last_rationale', 'last_plan', 'result', 'reasoning', 'plan')
+HISTORY_CHARS = 400
+
+
+@lru_cache(maxsize=None)
+def _encoding(name: str):
+    if not name:
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as error:
+        # tiktoken isn't installed, or can't download the encoding
+        logger.warning(f'Estimating token counts, as the {name} encoding is unavailable: {error}')
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """ Counts the tokens in a text with tiktoken if it is available, or estimates them. """
+    encoding = _encoding(TOKEN_ENCODING)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class PromptStats:
+    """
+    Counts the prompts each node of the agent sends, and their size in characters and tokens.
+
+    Attributes:
+        nodes (dict): The counts by node: 'calls', 'chars', 'tokens' and 'truncated' (the prompts cut to fit
+            the budget).
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def record(self, node: str, chars: int, tokens: int, truncated: bool = False):
+        counts = self.nodes.get(node)
+        if counts is None:
+            counts = self.nodes[node] = {'calls': 0, 'chars': 0, 'tokens': 0, 'truncated': 0}
+        counts['calls'] += 1
+        counts['chars'] += chars
+        counts['tokens'] += tokens
+        counts['truncated'] += truncated
+
+    def summary(self) -> dict:
+        """ The counts by node, with the mean characters and tokens per prompt. """
+        return {
+            node: {**counts, 'mean_chars': counts['chars'] / counts['calls'], 'mean_tokens': counts['tokens'] / counts['calls']}
+            for node, counts in self.nodes.items()
+        }
+
+    def reset(self):
+        self.nodes.clear()
+
+
+# Every prompt the agent formats in this process is counted here
+prompt_stats = PromptStats()
+
+
+def fit_prompt(template, node: str, fields: dict, budget: Optional[int] = None, stats: Optional[PromptStats] = None):
+    """
+    Formats a prompt, cutting it down if it is over the token budget, and counts it.
+
+    To fit the budget, long history fields (see `HISTORY_FIELDS`) are cut short first, then what is known about
+    the areas visited longest ago is left out (never the current area's). A prompt can still end up over the
+    budget if what is left is too big.
+
+    Args:
+        template (ChatPromptTemplate): The prompt template.
+        node (str): The node the prompt is for, as counted in the stats.
+        fields (dict): The values of the template's fields.
+        budget (int): The most tokens the prompt may take; `PROMPT_BUDGET` by default, which is no limit unless set.
+        stats (PromptStats): Where to count the prompt; `prompt_stats` by default.
+
+    Returns:
+        PromptValue: The formatted prompt.
+    """
+    budget = PROMPT_BUDGET if budget is None else budget
+    stats = prompt_stats if stats is None else stats
+
+    prompt = template.format_prompt(**fields)
+    text = prompt.to_string()
+    tokens = count_tokens(text)
+    truncated = budget is not None and tokens > budget
+    if truncated:
+        prompt = template.format_prompt(**_cut_fields(fields, tokens - budget))
+        text = prompt.to_string()
+        tokens = count_tokens(text)
+        logger.debug(f'Cut the {node} prompt down to {tokens} tokens for a budget of {budget}')
+
+    stats.record(node, len(text), tokens, truncated)
+    return prompt
+
+
+def _cut_fields(fields: dict, excess: int) -> dict:
+    """ Cuts at least `excess` tokens out of the fields, if they have that many to spare. """
+    fields = dict(fields)
+
+    for name in HISTORY_FIELDS:
+        if excess <= 0:
+            return fields
+        value = fields.get(name)
+        if isinstance(value, str) and len(value) > HISTORY_CHARS:
+            excess -= count_tokens(value[HISTORY_CHARS:])
+            fields[name] = value[:HISTORY_CHARS] + '...'
+
+    known_stuff = fields.get('known_stuff')
+    if known_stuff:
+        # one line per area, in the order they were visited
+        lines = known_stuff.split('\n')
+        current = f"Area Name: {fields.get('location_name')}."
+        kept = []
+        for line in lines:
+            if excess > 0 and not line.startswith(current):
+                excess -= count_tokens(line)
+            else:
+                kept.append(line)
+        if len(kept) < len(lines):
+            fields['known_stuff'] = '\n'.join([f'({len(lines) - len(kept)} areas visited longest ago left out)'] + kept)
+
+    return fields
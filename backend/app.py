@@ -1,12 +1,175 @@
-from fastapi import FastAPI
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
 
 from game.engine import TextAdventure
+from backend.sessions import SessionStore
+
+from game.logger import logger
+
+# The adventure is loaded once; every session is forked from it
+template = TextAdventure(config=os.environ.get('ADVENTURE_PATH', './adventures/sample.json'))
 
-adventure = TextAdventure(config='./adventures/sample.json')
+sessions = SessionStore(
+    template,
+    max_memory_mb=float(os.environ.get('SESSION_MEMORY_MB', 512)),
+    max_sessions=int(os.environ['MAX_SESSIONS']) if os.environ.get('MAX_SESSIONS') else None,
+    # Sessions are journaled, and so survive eviction and restarts, if given somewhere to keep the journals
+    journal_dir=os.environ.get('JOURNAL_DIR'),
+    snapshot_interval=int(os.environ.get('SNAPSHOT_INTERVAL', 100)),
+)
+
+# Clients that don't ask for a session of their own all share this one
+DEFAULT_SESSION = 'default'
+
+# Parsing and running commands is CPU bound, so it runs off the event loop, a bounded number at a time
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('COMMAND_WORKERS', os.cpu_count() or 4)))
 
 app = FastAPI()
 
+class BatchCommand(BaseModel):
+    session_id: str = DEFAULT_SESSION
+    command: str
+
+class BatchResponse(BaseModel):
+    session_id: str
+    command: str
+    # the command's response if it ran, otherwise why it didn't
+    response: Optional[str] = None
+    error: Optional[str] = None
+
+@app.post("/sessions")
+def create_session():
+    session = sessions.create()
+    return {"session_id": session.id}
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"No session {session_id}")
+    return {"session_id": session_id}
+
+@contextmanager
+def use_session(session_id: str):
+    """
+    Looks up a session, starting the default one if needed, or responds with a 404. The session is pinned, so
+    it isn't evicted, until the context ends.
+    """
+    with sessions.use(session_id, create=session_id == DEFAULT_SESSION) as session:
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"No session {session_id}")
+        yield session
+
+def check_session(session_id: str):
+    with use_session(session_id):
+        pass
+
+def run_in_session(session_id: str, command: str) -> str:
+    # looking a session up can mean loading or replaying it, so it happens here too, off the event loop
+    with use_session(session_id) as session:
+        # commands against the same game have to take turns
+        with session.lock:
+            return session.adventure.run_command(command)
+
+async def run_off_loop(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
 @app.get("/run_command")
-def run_command(command):
-    return adventure.run_command(command)
+async def run_command(command, session_id: str = DEFAULT_SESSION):
+    return await run_off_loop(run_in_session, session_id, command)
+
+@app.websocket("/ws/{session_id}")
+async def play(websocket: WebSocket, session_id: str):
+    """
+    Keeps a connection open for a session: every text message is a command, answered with its response. The
+    session is looked up again for every command, so it can be parked while the connection is idle.
+
+    The connection is closed with code 4404 if there is no such session, or it ends while connected. A
+    command that fails is answered with an error message, and the connection stays open.
+    """
+    try:
+        await run_off_loop(check_session, session_id)
+    except HTTPException:
+        await websocket.close(code=4404, reason=f"No session {session_id}")
+        return
+
+    await websocket.accept()
+    try:
+        while True:
+            command = await websocket.receive_text()
+            try:
+                response = await run_off_loop(run_in_session, session_id, command)
+            except HTTPException:
+                await websocket.close(code=4404, reason=f"No session {session_id}")
+                return
+            except Exception as error:
+                logger.exception(f'Command {command!r} failed in session {session_id}')
+                response = f"Error: {error}"
+            await websocket.send_text(response)
+    except WebSocketDisconnect:
+        pass
+
+def run_batch_in_session(session_id: str, commands: List[str], parses: dict) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Runs a session's share of a batch, returning a (response, error) pair for each command.
+
+    A command that fails leaves the game as it was partway through, so the session's commands after it are not run.
+    """
+    results = []
+    with use_session(session_id) as session, session.lock:
+        for command in commands:
+            try:
+                results.append((session.adventure.run_commands([command], parses=parses)[0], None))
+            except Exception as error:
+                logger.exception(f'Command {command!r} failed in session {session_id}')
+                results.append((None, f"Error: {error}"))
+                break
+    skipped = (None, "Not run: an earlier command in the session failed")
+    return results + [skipped] * (len(commands) - len(results))
+
+@app.post("/batch", response_model=List[BatchResponse])
+async def batch(commands: List[BatchCommand]):
+    """
+    Runs many commands, across any number of sessions, in one round trip.
+
+    Every command is parsed in a single batch; then each session's commands run in the order they were sent,
+    with different sessions running concurrently. Responses come back in the order the commands were sent, each
+    with either its response or an error: a session that doesn't exist, or a command that failed, only affects
+    that session's commands.
+    """
+    by_session = {}
+    for i, item in enumerate(commands):
+        by_session.setdefault(item.session_id, []).append(i)
+
+    loop = asyncio.get_running_loop()
+    # All sessions are forks of the template, so its parses are good for all of them
+    parses = await loop.run_in_executor(executor, template.parse_commands, [item.command for item in commands])
+
+    session_ids = list(by_session)
+    results = await asyncio.gather(*[
+        loop.run_in_executor(
+            executor,
+            run_batch_in_session,
+            session_id,
+            [commands[i].command for i in by_session[session_id]],
+            parses,
+        )
+        for session_id in session_ids
+    ], return_exceptions=True)
 
+    responses = [None] * len(commands)
+    for session_id, session_results in zip(session_ids, results):
+        indices = by_session[session_id]
+        if isinstance(session_results, HTTPException):
+            session_results = [(None, session_results.detail)] * len(indices)
+        elif isinstance(session_results, BaseException):
+            session_results = [(None, f"Error: {session_results}")] * len(indices)
+        for i, (response, error) in zip(indices, session_results):
+            responses[i] = BatchResponse(session_id=session_id, command=commands[i].command, response=response, error=error)
+    return responses
@@ -0,0 +1,273 @@
+import re
+import threading
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from game.engine import TextAdventure
+from game.journal import CommandJournal
+
+from game.logger import logger
+
+# Session IDs name journal files, so only plain names are allowed, never anything that could be a path
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def valid_session_id(session_id: str) -> bool:
+    return isinstance(session_id, str) and SESSION_ID_PATTERN.fullmatch(session_id) is not None
+
+
+class Session:
+    """
+    A game being played by one client.
+
+    Attributes:
+        id (str): The session ID.
+        adventure (TextAdventure): The session's own copy of the game.
+        lock (threading.Lock): Held while a command runs, since requests are served from a threadpool.
+        pins (int): How many requests and connections are using the session; see `SessionStore.use`.
+    """
+
+    def __init__(self, session_id: str, adventure: TextAdventure):
+        self.id = session_id
+        self.adventure = adventure
+        self.lock = threading.Lock()
+        self.pins = 0
+
+
+class SessionStore:
+    """
+    Keeps a game per session, forked from a template adventure that is loaded once.
+
+    The least recently used idle sessions are evicted once the sessions would take up more than the memory
+    cap. A session is idle if nothing has it pinned through `use` and no command is running in it. How much
+    memory a session takes is measured once, on a fresh fork of the template. Evicted sessions are parked as
+    saves, which take a few hundred bytes each, and loaded again when next used.
+
+    If given a journal directory, every session records its commands in a journal there, and sessions that
+    were evicted, or were running when the server stopped, are restored from their journal when next used.
+
+    Attributes:
+        template (TextAdventure): The adventure new sessions are forked from.
+        max_sessions (int): The most sessions kept at once, derived from the memory cap.
+        session_bytes (int): The measured memory footprint of a fresh session.
+        journal_dir (str): The directory session journals are kept in, if any.
+        snapshot_interval (int): How many commands sessions run between journal snapshots.
+        max_parked (int): The most evicted sessions kept as saves; beyond that the least recently used are dropped.
+    """
+
+    def __init__(self, template: TextAdventure, max_memory_mb: float = 512, max_sessions: Optional[int] = None,
+                 journal_dir: Optional[str] = None, snapshot_interval: int = 100, max_parked: int = 100000):
+        self.template = template
+        self.max_parked = max_parked
+        self.journal_dir = journal_dir
+        self.snapshot_interval = snapshot_interval
+        self.session_bytes = max(self._measure(template), 1)
+        self.max_sessions = max(int(max_memory_mb * 1024 * 1024 // self.session_bytes), 1)
+        if max_sessions is not None:
+            self.max_sessions = min(self.max_sessions, max_sessions)
+        self._sessions = OrderedDict()
+        # evicted sessions, as (save, journal) tuples
+        self._parked = OrderedDict()
+        self._lock = threading.Lock()
+        # held from looking a session up to adding it if it was missing, so two requests can't both create it
+        self._creating = threading.Lock()
+        logger.info(f'Sessions take ~{self.session_bytes} bytes; keeping at most {self.max_sessions}')
+
+    @staticmethod
+    def _measure(template: TextAdventure) -> int:
+        """ Measures how many bytes forking the template allocates. """
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        fork = template.fork()
+        size = tracemalloc.get_traced_memory()[0] - before
+        if not tracing:
+            tracemalloc.stop()
+        del fork
+        return size
+
+    def create(self, session_id: Optional[str] = None) -> Session:
+        """
+        Starts a new game.
+
+        Args:
+            session_id (str): The ID to give the session; a random one by default.
+
+        Returns:
+            Session: The new session.
+
+        Raises:
+            ValueError: If the session ID isn't made of letters, digits, '_' and '-' only.
+        """
+        return self._create(session_id)
+
+    def _create(self, session_id: Optional[str], pin: bool = False) -> Session:
+        if session_id is not None and not valid_session_id(session_id):
+            raise ValueError(f'Invalid session ID: {session_id!r}')
+        session = Session(session_id or uuid.uuid4().hex, self.template.fork())
+        journal = self._journal(session.id)
+        if journal is not None:
+            # a new game starts a new journal
+            journal.delete()
+            session.adventure.attach_journal(journal)
+        self._add(session, pin)
+        logger.info(f'Created session {session.id}')
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """
+        Returns the session with the given ID, marking it as recently used, or None if there is none.
+
+        A session that was evicted is loaded from its save, or else restored from its journal if it has one.
+        There is never a session with an invalid ID. The session can be evicted again as soon as it is idle, so
+        anything that holds on to it while it runs commands should `use` it instead.
+        """
+        return self._get(session_id)
+
+    @contextmanager
+    def use(self, session_id: str, create: bool = False) -> Iterator[Optional[Session]]:
+        """
+        Looks a session up as `get` does, and pins it for as long as the context lasts, so it isn't evicted while
+        a request or connection is using it.
+
+        Args:
+            session_id (str): The ID of the session.
+            create (bool): Whether to start the session if there is none.
+
+        Yields:
+            Session: The session, or None if there is none.
+        """
+        if create:
+            session = self._get_or_create(session_id, pin=True)
+        else:
+            session = self._get(session_id, pin=True)
+        try:
+            yield session
+        finally:
+            if session is not None:
+                with self._lock:
+                    session.pins -= 1
+                    # sessions kept while this one was pinned may be over the cap
+                    self._evict()
+
+    def _get(self, session_id: str, pin: bool = False) -> Optional[Session]:
+        if not valid_session_id(session_id):
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                if pin:
+                    session.pins += 1
+                return session
+
+            parked = self._parked.pop(session_id, None)
+            if parked is not None:
+                save, journal = parked
+                session = Session(session_id, self.template.load(save))
+                if journal is not None:
+                    session.adventure.attach_journal(journal)
+                self._sessions[session_id] = session
+                if pin:
+                    session.pins += 1
+                self._evict(keep=session_id)
+                logger.info(f'Loaded parked session {session_id}')
+                return session
+
+        journal = self._journal(session_id)
+        if journal is None or not journal.exists():
+            return None
+        session = Session(session_id, self.template.restore(journal))
+        with self._lock:
+            # another request may have restored it meanwhile
+            if session_id in self._sessions:
+                session.adventure.journal.close()
+                self._sessions.move_to_end(session_id)
+                session = self._sessions[session_id]
+                if pin:
+                    session.pins += 1
+                return session
+            self._sessions[session_id] = session
+            if pin:
+                session.pins += 1
+            self._evict(keep=session_id)
+        logger.info(f'Restored session {session_id}')
+        return session
+
+    def get_or_create(self, session_id: str) -> Session:
+        """ Returns the session with the given ID as `get` does, starting it if there is none. """
+        return self._get_or_create(session_id)
+
+    def _get_or_create(self, session_id: str, pin: bool = False) -> Session:
+        with self._creating:
+            return self._get(session_id, pin) or self._create(session_id, pin)
+
+    def delete(self, session_id: str) -> bool:
+        """ Ends a game, deleting its journal, returning whether there was one to end. """
+        if not valid_session_id(session_id):
+            return False
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            parked = self._parked.pop(session_id, None)
+        journal = session.adventure.journal if session is not None else self._journal(session_id)
+        existed = session is not None or parked is not None or (journal is not None and journal.exists())
+        if journal is not None:
+            journal.delete()
+        return existed
+
+    def _journal(self, session_id: str) -> Optional[CommandJournal]:
+        if self.journal_dir is None:
+            return None
+        return CommandJournal(self.journal_dir, session_id, self.snapshot_interval)
+
+    def _add(self, session: Session, pin: bool = False):
+        with self._lock:
+            # a new game replaces any parked one
+            self._parked.pop(session.id, None)
+            self._sessions[session.id] = session
+            if pin:
+                session.pins += 1
+            self._evict(keep=session.id)
+
+    def _evict(self, keep: Optional[str] = None):
+        """
+        Parks the least recently used idle sessions until there are no more than allowed. `keep` is the ID of
+        a session that is about to be handed out, and so must stay. Called with the store's lock held.
+        """
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        for session_id, session in list(self._sessions.items()):
+            if excess <= 0:
+                break
+            # pinning takes the store's lock, so a session that isn't pinned now won't be until it is parked
+            if session.pins or session_id == keep:
+                continue
+            # sessions running a command are not idle
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                del self._sessions[session_id]
+                journal = session.adventure.journal
+                if journal is not None:
+                    journal.close()
+                self._parked[session_id] = (self.template.save(session.adventure), journal)
+            finally:
+                session.lock.release()
+            excess -= 1
+            logger.info(f'Parked idle session {session_id}')
+
+        while len(self._parked) > self.max_parked:
+            # a dropped session lives on in its journal, if it has one
+            session_id, _ = self._parked.popitem(last=False)
+            logger.info(f'Dropped parked session {session_id}')
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str):
+        return session_id in self._sessions
@@ -0,0 +1,67 @@
+"""
+Measures the cold start cost of the game engine: how long importing `game.engine` takes and how much
+memory the process holds afterwards, then the same after loading an adventure and after the first
+command that needs spaCy.
+
+Every measurement is taken in a fresh interpreter, since imports are cached.
+
+Usage:
+    python -m benchmarks.startup [--adventure ./adventures/sample.json] [--repeat 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Runs in the child process. ru_maxrss is the peak resident set size, in KiB on Linux.
+PROBE = '''
+import json, logging, resource, sys, time
+logging.disable(logging.CRITICAL)
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+result = {'baseline_rss_mb': rss()}
+
+start = time.perf_counter()
+from game.engine import TextAdventure
+result['import_s'] = time.perf_counter() - start
+result['import_rss_mb'] = rss()
+
+start = time.perf_counter()
+adventure = TextAdventure(config=sys.argv[1])
+result['load_s'] = time.perf_counter() - start
+result['load_rss_mb'] = rss()
+
+from game.parser import parse_command
+start = time.perf_counter()
+parse_command('give troll the key')
+result['first_spacy_parse_s'] = time.perf_counter() - start
+result['spacy_rss_mb'] = rss()
+
+print(json.dumps(result))
+'''
+
+
+def measure(adventure):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, adventure], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--adventure', default='./adventures/sample.json')
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    runs = [measure(args.adventure) for _ in range(args.repeat)]
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        print(f'{key:>22}: median {statistics.median(values):9.3f}  min {min(values):9.3f}  max {max(values):9.3f}')
+
+
+if __name__ == '__main__':
+    main()
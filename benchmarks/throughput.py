@@ -0,0 +1,69 @@
+"""
+Measures how many steps per second the full agent loop runs at with a local policy instead of an LLM, i.e. the
+cost of the engine and of the glue around it (`update_agent_state`, `create_tile_map`, `areas_to_known_stuff`),
+and how that cost splits between the agent, the engine and updating the agent's state. It also reports the size
+of the prompts each node of the agent would have sent, which PROMPT_BUDGET caps.
+
+Episodes run one after another in this process. Episodes that crash the engine count the steps they got through.
+
+Usage:
+    python -m benchmarks.throughput [--adventure ./adventures/sample.json] [--policy random] [--episodes 20]
+        [--max-attempts 100] [--transcript walkthrough.txt] [--latency 0] [--mode chain]
+        [--max-commands 1] [--scoped]
+"""
+import argparse
+import logging
+import time
+
+from agent import policies
+from agent.prompt import prompt_stats
+from agent.agent import AGENT_MODES, make_agent_for_mode
+from simulate import _load_adventure, play_episode
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--adventure', default='./adventures/sample.json')
+    arg_parser.add_argument('--policy', choices=['random', 'stub', 'transcript'], default='random')
+    arg_parser.add_argument('--transcript')
+    arg_parser.add_argument('--latency', type=float, default=0.0)
+    arg_parser.add_argument('--mode', choices=AGENT_MODES, default='chain')
+    arg_parser.add_argument('--max-commands', type=int, default=1)
+    arg_parser.add_argument('--scoped', action='store_true')
+    arg_parser.add_argument('--episodes', type=int, default=20)
+    arg_parser.add_argument('--max-attempts', type=int, default=100)
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    if args.policy == 'transcript':
+        make_models = policies.transcript_policy(args.transcript, args.latency)
+    else:
+        make_models = policies.latency_policy(args.latency)
+
+    timings = {}
+    crashed = 0
+    start = time.perf_counter()
+    for seed in range(args.episodes):
+        adventure, response_format = _load_adventure(args.adventure)
+        reason_model, plan_model, act_model = make_models(seed)
+        agent = make_agent_for_mode(reason_model, plan_model, act_model, response_format, args.mode,
+                                    max_commands=args.max_commands, scoped=args.scoped)
+        try:
+            play_episode(agent, adventure, args.max_attempts, verbose=False, timings=timings)
+        except Exception:
+            crashed += 1
+    seconds = time.perf_counter() - start
+
+    steps = timings.get('steps', 0)
+    print(f'{steps} steps in {args.episodes} episodes ({crashed} crashed) in {seconds:.2f}s: {steps / seconds:.1f} steps/s')
+    for phase in ('agent', 'engine', 'update'):
+        spent = timings.get(phase, 0.0)
+        print(f'{phase:>8}: {spent:7.3f}s  {spent / max(steps, 1) * 1e3:7.3f} ms/step  {spent / seconds:6.1%}')
+    for node, counts in prompt_stats.summary().items():
+        print(f'{node:>8}: {counts["calls"]:6d} prompts  {counts["mean_chars"]:8.0f} chars  '
+              f'{counts["mean_tokens"]:7.0f} tokens  {counts["truncated"]:6d} cut to budget')
+
+
+if __name__ == '__main__':
+    main()
@@ -78,6 +78,9 @@ def use(context:'Artifact', object:'Artifact', iobject:'Artifact', game_state:Ga
         logger.debug(f'{context.id} failed to find {object.id} in inventory')
         return HandleActionResponse(message=f'You don\'t have a {object.name}')
 
+    if iobject is None:
+        return HandleActionResponse(message=f'What do you want to use the {object.name} on?')
+
     iobject_available = any([item == iobject.id for item in game_state.inventory+context.fixtures+context.items])
 
     if not iobject_available:
@@ -11,7 +11,7 @@ def inventory(game_state, **kwargs):
     inv = 'You have:\n'
     for item in game_state.inventory:
         inv += f'{game_state.artifacts[item].name}\n'
-    return HandleActionResponse(message=inv)
+    return HandleActionResponse(message=inv, success=True)
 
 
 @GameActions.register_action('help')
@@ -25,7 +25,7 @@ def help(**kwargs):
     _help += 'use [item] on/with etc. [thing/item]\n'
     _help += 'open [thing/item]\n'
     _help += 'close [thing/item]\n'
-    return HandleActionResponse(message=_help)
+    return HandleActionResponse(message=_help, success=True)
 
 
 @GameActions.register_action('quit')
@@ -0,0 +1,270 @@
+import ast
+from typing import FrozenSet, NamedTuple, Optional
+
+from game.actions.action_enums import ThreePlacePredicates
+from game.actions.area import AreaActions
+from game.actions.fixture import FixtureActions
+from game.actions.game import GameActions
+from game.actions.item import ItemActions
+from game.core.area import EXIT_DIRECTIONS, Area
+from game.core.artifact import Artifact
+from game.core.fixture import Fixture
+from game.core.item import Item
+from game.models import GameState
+from game.scope import ScopeIndex
+
+from game.logger import logger
+
+# Setting any of these can change which commands an artifact's handlers accept
+WATCHED_PROPERTIES = ('container', 'items', 'fixtures', 'is_visible', 'is_open', 'is_locked', 'is_accessible',
+                      'is_lit', 'is_flammable')
+
+# Game actions that are always available but never worth suggesting
+EXCLUDED_GAME_ACTIONS = ('quit',)
+
+
+class Interaction(NamedTuple):
+    """
+    An interaction of the adventure, as keyed `action__object` or `action__object__iobject`.
+
+    Attributes:
+        key (str): The key of the interaction.
+        action (str): The action that fires it.
+        object_id (str): The ID of the object of the action.
+        iobject_id (str): The ID of the indirect object of the action, if any.
+        holder_id (str): The ID of the artifact whose interactions it is in, or None if it is in the game state's.
+        prerequisites (tuple): The (event, value) pairs that have to hold for it to fire.
+    """
+    key: str
+    action: str
+    object_id: str
+    iobject_id: Optional[str]
+    holder_id: Optional[str]
+    prerequisites: tuple
+
+
+class CommandIndex:
+    """
+    Enumerates the commands the current state of a game can meaningfully handle.
+
+    Commands come from three places: the game actions and the exits of the current area; the action handlers
+    registered for each type of artifact in scope, as far as their preconditions can be checked up front (e.g.
+    only closed, unlocked, openable things can be opened); and the adventure's interactions whose objects are
+    in scope and whose prerequisite events hold. Actions without a default effect (e.g. turn) are only
+    available through an interaction.
+
+    The commands of each artifact and each interaction are kept between calls, and only redone when something
+    they depend on changes: an artifact's when one of its `WATCHED_PROPERTIES` is set or it enters or leaves the
+    inventory, an interaction's when its object's are redone, one of its prerequisite events changes or it is
+    removed. Putting the commands of what is in scope together is all that is left to do after a move.
+
+    Attributes:
+        game_state (GameState): The game state whose commands are enumerated.
+        scope (ScopeIndex): The index of what is in scope.
+        interactions (dict): A mapping of object IDs to the interactions naming them, as object or indirect object.
+    """
+
+    def __init__(self, game_state: GameState, scope: ScopeIndex):
+        self.game_state = game_state
+        self.scope = scope
+        self.interactions = {}
+        # event name -> the interactions that have it as a prerequisite
+        self._by_event = {}
+        # artifact ID -> the commands its handlers accept, besides lighting it
+        self._artifact_commands = {}
+        # interaction key -> the command firing it, or None if it can't fire wherever the player is
+        self._interaction_commands = {}
+        self._lit = {artifact_id for artifact_id, artifact in game_state.artifacts.items() if getattr(artifact, 'is_lit', False)}
+        self._inventory = tuple(game_state.inventory)
+        # bumped whenever anything the commands depend on changes
+        self._version = 0
+        self._key = None
+        self._commands = frozenset()
+
+        for artifact in game_state.artifacts.values():
+            for key, interaction in getattr(artifact, 'interactions', {}).items():
+                self._add_interaction(key, interaction, artifact.id)
+            for property_name in WATCHED_PROPERTIES:
+                artifact.watch(property_name, self._artifact_changed)
+        for key, interaction in game_state.interactions.items():
+            self._add_interaction(key, interaction, None)
+        game_state.watch_events(self._events_changed)
+
+    def _add_interaction(self, key: str, interaction: dict, holder_id: Optional[str]):
+        parts = key.split('__')
+        if len(parts) not in (2, 3):
+            logger.warning(f'Interaction {key} is not keyed action__object or action__object__iobject')
+            return
+        prerequisites = []
+        for event in interaction.get('prerequisite_events', []):
+            name, value = event.split('__')
+            prerequisites.append((name, ast.literal_eval(value)))
+        entry = Interaction(key, parts[0], parts[1], parts[2] if len(parts) == 3 else None, holder_id, tuple(prerequisites))
+        self.interactions.setdefault(entry.object_id, []).append(entry)
+        if entry.iobject_id is not None and entry.iobject_id != entry.object_id:
+            self.interactions.setdefault(entry.iobject_id, []).append(entry)
+        for name, _ in entry.prerequisites:
+            self._by_event.setdefault(name, []).append(entry)
+
+    def _artifact_changed(self, artifact_id: str, property_name: str):
+        self._version += 1
+        self._invalidate(artifact_id)
+        if property_name == 'is_lit':
+            if getattr(self.game_state.artifacts[artifact_id], 'is_lit', False):
+                self._lit.add(artifact_id)
+            else:
+                self._lit.discard(artifact_id)
+
+    def _events_changed(self, events):
+        self._version += 1
+        for name in events:
+            for interaction in self._by_event.get(name, ()):
+                self._interaction_commands.pop(interaction.key, None)
+
+    def _invalidate(self, artifact_id: str):
+        self._artifact_commands.pop(artifact_id, None)
+        for interaction in self.interactions.get(artifact_id, ()):
+            self._interaction_commands.pop(interaction.key, None)
+
+    def interactions_changed(self):
+        """ Tells the index that interactions were removed, e.g. by a command that fired one that isn't repeatable. """
+        self._version += 1
+        for key, command in list(self._interaction_commands.items()):
+            if command is not None and not self._exists(self._interaction_of(key)):
+                self._interaction_commands[key] = None
+
+    def available(self, area: Area) -> FrozenSet[str]:
+        """
+        Enumerates the commands the game can meaningfully handle with the player in the given area.
+
+        Args:
+            area (Area): The area the player is currently in.
+
+        Returns:
+            frozenset: The commands, as they would be typed.
+        """
+        # the inventory is changed in place, so it can't be watched
+        inventory = tuple(self.game_state.inventory)
+        if inventory != self._inventory:
+            self._version += 1
+            for artifact_id in set(inventory).symmetric_difference(self._inventory):
+                self._invalidate(artifact_id)
+            self._inventory = inventory
+
+        key = (area.id, self._version)
+        if key != self._key:
+            self._commands = frozenset(self._enumerate(area))
+            self._key = key
+        return self._commands
+
+    def _enumerate(self, area: Area) -> set:
+        commands = {name for name in GameActions._action_handlers if name not in EXCLUDED_GAME_ACTIONS}
+        commands.add('look')
+        commands.update(
+            direction for direction, exit in zip(EXIT_DIRECTIONS, area.exits) if exit is not None and exit.is_accessible
+        )
+
+        in_scope = self.scope.in_scope(area)
+        in_scope_ids = {artifact.id for artifact in in_scope}
+        lit = [artifact for artifact in in_scope if artifact.id in self._lit]
+
+        for artifact in in_scope:
+            artifact_commands = self._artifact_commands.get(artifact.id)
+            if artifact_commands is None:
+                artifact_commands = self._artifact_commands[artifact.id] = self._commands_for(artifact)
+            commands.update(artifact_commands)
+            if lit and 'light' in _handlers(artifact) and getattr(artifact, 'is_flammable', False) and not artifact.is_lit:
+                name = artifact.name.lower()
+                commands.update(f'light {name} with {light.name.lower()}' for light in lit if light is not artifact)
+
+        # the interactions naming something in scope, held by something in scope, the area or the game
+        holders = in_scope_ids | {area.id, None}
+        seen = set()
+        for artifact_id in in_scope_ids:
+            for interaction in self.interactions.get(artifact_id, ()):
+                if interaction.key in seen:
+                    continue
+                seen.add(interaction.key)
+                if (
+                    interaction.holder_id not in holders
+                    or interaction.object_id not in in_scope_ids
+                    or (interaction.iobject_id is not None and interaction.iobject_id not in in_scope_ids)
+                ):
+                    continue
+                if interaction.key not in self._interaction_commands:
+                    self._interaction_commands[interaction.key] = self._interaction_command(interaction)
+                command = self._interaction_commands[interaction.key]
+                if command is not None:
+                    commands.add(command)
+
+        return commands
+
+    def _commands_for(self, artifact: Artifact) -> FrozenSet[str]:
+        """ The commands the artifact's handlers accept, other than lighting it, which depends on what else is lit. """
+        handlers = _handlers(artifact)
+        name = artifact.name.lower()
+        commands = set()
+        if 'look' in handlers:
+            commands.add(f'look {name}')
+        if 'take' in handlers and self._can_take(artifact):
+            commands.add(f'take {name}')
+        if artifact.id in self.game_state.inventory:
+            commands.add(f'drop {name}')
+        if 'open' in handlers and artifact.is_openable and not artifact.is_open and not artifact.is_locked:
+            commands.add(f'open {name}')
+        if 'close' in handlers and artifact.is_openable and artifact.is_open:
+            commands.add(f'close {name}')
+        return frozenset(commands)
+
+    def _can_take(self, artifact: Artifact) -> bool:
+        """ Whether the artifact lies loose somewhere the player can take it from, as the take action requires. """
+        container = artifact.container
+        return (
+            artifact.id not in self.game_state.inventory
+            and artifact.is_accessible
+            and container is not None
+            and artifact.id in container.items
+        )
+
+    def _interaction_of(self, key: str) -> Interaction:
+        object_id = key.split('__')[1]
+        return next(interaction for interaction in self.interactions[object_id] if interaction.key == key)
+
+    def _exists(self, interaction: Interaction) -> bool:
+        """ Whether the interaction is still in the game, i.e. hasn't been removed after firing. """
+        if interaction.holder_id is None:
+            return interaction.key in self.game_state.interactions
+        return interaction.key in self.game_state.artifacts[interaction.holder_id].interactions
+
+    def _interaction_command(self, interaction: Interaction) -> Optional[str]:
+        """ The command that fires the interaction, or None if it can't fire, wherever the player is. """
+        game_state = self.game_state
+        if not self._exists(interaction):
+            return None
+        if any(game_state.events.get(name, 'nope!') != value for name, value in interaction.prerequisites):
+            return None
+
+        artifacts = game_state.artifacts
+        object = artifacts[interaction.object_id]
+        if interaction.action == 'take' and not self._can_take(object):
+            return None
+        if interaction.action == 'use' and object.id not in game_state.inventory:
+            return None
+
+        command = f'{interaction.action} {object.name.lower()}'
+        if interaction.iobject_id is not None and interaction.action in ThreePlacePredicates._value2member_map_:
+            preposition = 'on' if interaction.action == 'use' else 'with'
+            command += f' {preposition} {artifacts[interaction.iobject_id].name.lower()}'
+        return command
+
+
+def _handlers(artifact: Artifact) -> dict:
+    """ The action handlers registered for the artifact's type. """
+    if isinstance(artifact, Item):
+        handlers = ItemActions._action_handlers
+    elif isinstance(artifact, Fixture):
+        handlers = FixtureActions._action_handlers
+    else:
+        return {}
+    # things can also be taken and dropped through the area they are in
+    return {**AreaActions._action_handlers, **handlers}
@@ -0,0 +1,126 @@
+"""
+Precompiled adventures.
+
+Loading an adventure from JSON validates every artifact with pydantic, which is most of the cost of starting
+a game. Compiling an adventure validates it once and pickles the resulting game state, so that every later
+load only has to unpickle it. A compiled adventure records a hash of the model schemas it was built with and
+a digest of the JSON it was built from, and is ignored in favour of the JSON if either no longer matches.
+
+Compiled adventures are pickles, so only load ones you made yourself.
+
+Usage:
+    python -m game.compiler adventures/sample.json [adventures/other.json ...]
+"""
+import hashlib
+import os
+import pickle
+import sys
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import pydantic
+
+from game.models import GameState
+
+from game.logger import logger
+
+COMPILED_SUFFIX = '.compiled'
+
+PICKLE_PROTOCOL = 5
+
+
+@lru_cache(maxsize=None)
+def schema_hash() -> str:
+    """
+    Hashes the fields of every model a compiled adventure contains, so that compiled adventures built
+    against a different version of the models are not loaded.
+    """
+    from game.core.area import Area
+    from game.core.fixture import Fixture
+    from game.core.item import Item
+    from game.core.description import Description
+
+    schema = [pydantic.VERSION]
+    for model in (GameState, Area, Item, Fixture, Description):
+        schema.append(model.__name__)
+        for name, field in model.model_fields.items():
+            schema.append(f'{name}:{field.annotation}:{field.default}')
+        for name, field in getattr(model, '__private_attributes__', {}).items():
+            schema.append(f'{name}:{field.default}')
+        # the property models (ItemProperties etc.) change shape too
+        for field in model.model_fields.values():
+            if isinstance(field.annotation, type) and issubclass(field.annotation, pydantic.BaseModel):
+                schema.extend(f'{name}:{sub.annotation}:{sub.default}' for name, sub in field.annotation.model_fields.items())
+
+    return hashlib.sha256('\n'.join(schema).encode()).hexdigest()
+
+
+def compiled_path(path_to_json: str) -> str:
+    """ The path of the compiled adventure for a JSON adventure. """
+    return os.path.splitext(path_to_json)[0] + COMPILED_SUFFIX
+
+
+def source_digest(source: bytes) -> str:
+    return hashlib.sha256(source).hexdigest()
+
+
+def write_compiled(path: str, game_state: GameState, start_area: str, digest: str):
+    """
+    Writes a compiled adventure.
+
+    Args:
+        path (str): The path to write it to.
+        game_state (GameState): The validated game state, as loaded from the JSON adventure.
+        start_area (str): The ID of the area the adventure starts in.
+        digest (str): The digest of the JSON adventure it was loaded from.
+    """
+    header = {'schema': schema_hash(), 'source': digest, 'start_area': start_area}
+    with open(path, 'wb') as f:
+        # the header is pickled separately so it can be checked without unpickling the game state
+        pickle.dump(header, f, protocol=PICKLE_PROTOCOL)
+        pickle.dump(game_state, f, protocol=PICKLE_PROTOCOL)
+    logger.info(f'Wrote compiled adventure to {path}')
+
+
+def read_compiled(path: str, digest: Optional[str] = None) -> Optional[Tuple[GameState, str]]:
+    """
+    Reads a compiled adventure, if there is an up to date one.
+
+    Args:
+        path (str): The path of the compiled adventure.
+        digest (str): The digest of the JSON adventure it has to have been compiled from, if it matters.
+
+    Returns:
+        tuple: The game state and the ID of the start area, or None if the compiled adventure is missing or stale.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        try:
+            header = pickle.load(f)
+        except Exception:
+            logger.warning(f'Could not read compiled adventure {path}')
+            return None
+
+        if header.get('schema') != schema_hash():
+            logger.info(f'Compiled adventure {path} was built against other models; ignoring it')
+            return None
+        if digest is not None and header.get('source') != digest:
+            logger.info(f'Compiled adventure {path} is out of date; ignoring it')
+            return None
+
+        game_state = pickle.load(f)
+
+    logger.debug(f'Loaded compiled adventure {path}')
+    return game_state, header['start_area']
+
+
+def main(paths):
+    from game.engine import TextAdventure
+    for path in paths:
+        print(TextAdventure.compile(path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -9,6 +9,9 @@ from game.core.artifact import Artifact
 
 from game.logger import logger
 
+# The directions of `Area.exits`, in the order `Area._make_exits` lays them out
+EXIT_DIRECTIONS = ('n', 's', 'e', 'w')
+
 class Area(Artifact):
     """
     Represents an area in the game.
@@ -86,17 +89,20 @@ class Area(Artifact):
         return self.description_.render(self, game_state)
 
     def _make_exits(self, areas):
-        exits = {'n':None, 's':None, 'e':None, 'w':None}
-        for area in areas:
-            direction = self.exits_.get(area.id)
-            if direction:
+        # areas can be a list, but a mapping of IDs to areas saves searching it for every exit
+        if not isinstance(areas, dict):
+            areas = {area.id: area for area in areas}
+        exits = dict.fromkeys(EXIT_DIRECTIONS)
+        for area_id, direction in self.exits_.items():
+            area = areas.get(area_id)
+            if area is not None and direction:
                 exits[direction] = area
-        self.exits_ = [
-            exits.get('n'),
-            exits.get('s'),
-            exits.get('e'),
-            exits.get('w')
-        ]
+        self.exits_ = [exits.get(direction) for direction in EXIT_DIRECTIONS]
+
+    def _relink(self, artifacts: dict):
+        super()._relink(artifacts)
+        if isinstance(self.exits_, list):
+            self.exits_ = [artifacts.get(area.id) if area is not None else None for area in self.exits_]
 
     @property
     def exits(self):
@@ -1,8 +1,23 @@
-from pydantic import BaseModel, Field
-from typing import List, Any
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import List, Any, Callable
 from game.core.description import Description
 from game.logger import logger
 
+def _copy_model(model: BaseModel, state: dict = None) -> BaseModel:
+    """
+    Shallow copies a model without going through validation or `__setattr__`, which is what makes forking cheap.
+    This is what `BaseModel.__copy__` does, minus the overhead.
+    """
+    clone = model.__class__.__new__(model.__class__)
+    object.__setattr__(clone, '__dict__', dict(model.__dict__) if state is None else state)
+    object.__setattr__(clone, '__pydantic_fields_set__', set(model.__pydantic_fields_set__))
+    extra = model.__pydantic_extra__
+    object.__setattr__(clone, '__pydantic_extra__', dict(extra) if extra is not None else None)
+    private = model.__pydantic_private__
+    object.__setattr__(clone, '__pydantic_private__', dict(private) if private is not None else None)
+    return clone
+
+
 class Artifact(BaseModel):
     """
     The central construct of the game. Artifacts are anything that can be interacted with in the game world, principally
@@ -29,6 +44,7 @@ class Artifact(BaseModel):
     display_order: list = Field(default_factory=list)
     container_description: str = ""
     _capacity: int = 100
+    _watchers: dict = PrivateAttr(default_factory=dict)
 
     class Config:
         extra = "allow"
@@ -36,6 +52,59 @@ class Artifact(BaseModel):
     def __str__(self):
         return self.id
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # Setting a property (e.g. `is_open`) goes through here before its setter, so watching the
+        # property name is enough even though the setter writes to another attribute.
+        # (This runs on every assignment, so the private attribute is read directly.)
+        for callback in self.__pydantic_private__['_watchers'].get(name, ()):
+            callback(self.id, name)
+
+    def watch(self, property_name: str, callback: Callable):
+        """
+        Registers a callback that is called with (artifact_id, property_name) whenever the property is set.
+
+        Args:
+            property_name (str): The name of the attribute or property to watch.
+            callback (Callable): The function to call when the property is set.
+        """
+        self.__pydantic_private__['_watchers'].setdefault(property_name, []).append(callback)
+
+    def fork(self) -> 'Artifact':
+        """
+        Makes a copy of this artifact for a forked game.
+
+        Only the state that can change during a game is copied: properties, contents, interactions and the
+        description text (which triggers modify). Names, triggers and other static data are shared with the
+        original. References to other artifacts still point at the original's until `_relink` is called.
+
+        Returns:
+            Artifact: The copy.
+        """
+        state = dict(self.__dict__)
+        state['items_'] = list(self.items_)
+        state['fixtures_'] = list(self.fixtures_)
+        state['description_'] = _copy_model(self.description_)
+        if 'properties' in state:
+            state['properties'] = _copy_model(self.properties)
+        if 'interactions' in state:
+            state['interactions'] = dict(self.interactions)
+
+        clone = _copy_model(self, state)
+        # the watchers belong to the original game's indices
+        clone.__pydantic_private__['_watchers'] = {}
+        return clone
+
+    def _relink(self, artifacts: dict):
+        """
+        Points the references this artifact holds to other artifacts at the ones in `artifacts`, after forking.
+
+        Args:
+            artifacts (dict): The forked artifacts by ID.
+        """
+        if self.container_ is not None:
+            self.container_ = artifacts.get(self.container_.id)
+
     def _assign_container(self, game_state):
         """
         The container property has to be set at runtime so this function post init assigns this artifact
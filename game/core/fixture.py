@@ -42,8 +42,6 @@ class Fixture(Artifact):
             for fxt in self._get_artifacts(self.fixtures, game_state):
                 # If the object ID matches, delegate the action to the contained fixture
                 if fxt.id == action['object'].id:
-                    
-                    action['object'] = None
                     logger.info(f"Dispatching action: {action['action']} onto fixture: {fxt.id} from context: {self.id}")
                     return fxt.handle_action(action, game_state)
 
@@ -0,0 +1,24 @@
+"""
+SQLite databases shared between threads and worker processes, as used by the parse and response caches.
+"""
+import sqlite3
+
+
+def connect(path: str, *schema: str) -> sqlite3.Connection:
+    """
+    Opens a SQLite database that several threads and processes can use at once, creating its tables if needed.
+
+    Args:
+        path (str): The path of the database.
+        *schema (str): The statements creating its tables and indices, which should use IF NOT EXISTS.
+
+    Returns:
+        sqlite3.Connection: The connection, which callers have to guard with a lock of their own.
+    """
+    db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # WAL lets several processes read while one of them writes
+    db.execute('PRAGMA journal_mode=WAL')
+    for statement in schema:
+        db.execute(statement)
+    db.commit()
+    return db
@@ -1,13 +1,21 @@
 import json
-from typing import Tuple, List, Iterable
+import time
+from typing import FrozenSet, Tuple, List, Iterable, Optional
 
-from game.actions.action_enums import InteractiveActions, GameActions
+from game.actions.action_enums import InteractiveActions, GameActions, IntransitiveVerbs
 from game.core.area import Area
 from game.core.fixture import Fixture
 from game.core.item import Item
 
 from game.models import GameState
-from game.parser import parse_command
+from game import parser
+from game.parser import parse_command, parse_commands
+from game.grammar import CommandGrammar
+from game.state_events import StateEventEngine
+from game.scope import ScopeIndex
+from game.commands import CommandIndex
+from game.compiler import compiled_path, read_compiled, source_digest, write_compiled
+from game.saves import SaveLayout, apply_diff, diff_state
 from game.core.artifact import Artifact
 
 from game.logger import logger
@@ -24,9 +32,18 @@ class TextAdventure:
         game_data (list): A list of Area objects representing the game data.
         current_state (Area): The current area in the game.
         game_state (GameState): The current state of the game.
+        state_events (StateEventEngine): The compiled evaluator for the game's state events.
+        scope (ScopeIndex): The index resolving object names to the artifacts in scope.
+        grammar (CommandGrammar): The grammar parsing commands without spaCy where possible.
+        use_spacy (bool): Whether commands the grammar finds ambiguous are parsed with spaCy.
+        journal (CommandJournal): The journal commands are recorded in, if any.
+        succeeded (bool): Whether the last command was understood and did what it was meant to.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, use_spacy:bool=None):
+        self.use_spacy = parser.USE_SPACY if use_spacy is None else use_spacy
+        self.journal = None
+        self.succeeded = True
         # The order is deliberate and necessary.
         self.game_state = self._read_config(config)
         self._initialize()
@@ -44,17 +61,213 @@ class TextAdventure:
         Returns:
             str: The response message after executing the command.
         """
+        return self._run_command(command)
+
+    def run_commands(self, commands:Iterable[str], timed:bool=False, parses:Optional[dict]=None,
+                     stop_early:bool=False) -> list:
+        """
+        Executes many commands in order, e.g. to replay a transcript.
+
+        The commands are all parsed up front in one batch, which is much faster than parsing them one by one,
+        and then executed in order exactly as `run_command` would.
+
+        Args:
+            commands (Iterable[str]): The command strings to execute.
+            timed (bool): Whether to also return how long each command took to execute, in seconds.
+            parses (dict): The commands already parsed with `parse_commands`, e.g. together with other games'.
+            stop_early (bool): Whether to stop after a command that fails, wins the game or moves to another
+                area, e.g. because the commands after it were chosen for the game as it was.
+
+        Returns:
+            list: The response message for each command executed, or (response, seconds) tuples if `timed` is set.
+        """
+        commands = list(commands)
+
+        if parses is None:
+            parses = self.parse_commands(commands)
+
+        responses = []
+        for command in commands:
+            area = self.current_state
+            start = time.perf_counter()
+            response = self._run_command(command, parses.get(command))
+            if timed:
+                response = (response, time.perf_counter() - start)
+            responses.append(response)
+            if stop_early and (not self.succeeded or self.current_state is not area or self.game_state.events.get('game_victory')):
+                break
+
+        return responses
+
+    def parse_commands(self, commands:Iterable[str]) -> dict:
+        """
+        Parses the commands that need parsing in one batch, for `run_commands`.
+
+        Parsing doesn't depend on the state of the game, so the result can be used by any fork of this game.
+
+        Args:
+            commands (Iterable[str]): The command strings to parse.
+
+        Returns:
+            dict: A mapping of each command that needs parsing to its (action, object, iobject) tuple.
+        """
+        to_parse = list(dict.fromkeys(command for command in commands if self._needs_parse(command)))
+        return dict(zip(to_parse, parse_commands(to_parse, self.grammar, self.use_spacy)))
+
+    def available_commands(self) -> FrozenSet[str]:
+        """
+        Enumerates the commands that the game can meaningfully handle in its current state.
+
+        These are the game actions, the exits of the current area that can be taken, what the action handlers
+        can do with the objects in scope as far as can be told without running them, and the interactions
+        of the adventure whose objects are in scope and whose prerequisite events hold. The commands are
+        enumerated again only after something they depend on changed; see `CommandIndex`.
+
+        Returns:
+            frozenset: The commands, as they would be typed.
+        """
+        if self._command_index is None:
+            self._command_index = CommandIndex(self.game_state, self.scope)
+        return self._command_index.available(self.current_state)
+
+    def fork(self) -> 'TextAdventure':
+        """
+        Makes a copy of the game in its current state that can be played independently of it.
+
+        This is much cheaper than loading the adventure again: nothing is read or validated, only the state that
+        can change during a game is copied, and the copy carries on from wherever this game is.
+
+        Returns:
+            TextAdventure: The copy.
+        """
+        return self._with_state(self.game_state.fork(), self.current_state.id, self.state_events.dirty)
+
+    def attach_journal(self, journal:'CommandJournal'):
+        """
+        Records every command run from now on in a journal, from which the game can later be restored.
+
+        Args:
+            journal (CommandJournal): The journal to record in.
+        """
+        journal.attach(self)
+        self.journal = journal
+
+    def restore(self, journal:'CommandJournal') -> 'TextAdventure':
+        """
+        Restores a game from its journal, treating this game as the adventure it was started from.
+
+        The game is restored from the latest snapshot in the journal, or from a fork of this game if there
+        is none, and the commands recorded after the snapshot are replayed. Their parses were recorded too,
+        so replaying them doesn't parse anything. Every replayed command is checked against the response and
+        the changes recorded for it, and any difference is logged. The restored game carries on recording in
+        the journal.
+
+        Args:
+            journal (CommandJournal): The journal to restore the game from.
+
+        Returns:
+            TextAdventure: The restored game.
+        """
+        snapshot, entries = journal.read()
+        if snapshot:
+            # snapshots are taken after a command, when every state event is up to date
+            game = self._with_state(snapshot.game_state, snapshot.current_area, dirty=set())
+        else:
+            game = self.fork()
+
+        for entry in entries:
+            response = game._execute(entry.command, entry.parse)
+            if response != entry.response:
+                logger.warning(f'Replaying command {entry.seq} ({entry.command}) gave a different response')
+            differences = entry.differences(game)
+            if differences:
+                logger.warning(f'Replaying command {entry.seq} ({entry.command}) left a different {", ".join(differences)}')
+
+        journal.seq = entries[-1].seq if entries else (snapshot.seq if snapshot else 0)
+        game.attach_journal(journal)
+        logger.info(f'Restored game from {journal.journal_path} at command {journal.seq}')
+        return game
+
+    def save(self, game:'TextAdventure') -> bytes:
+        """
+        Saves a game started from this one, treating this game as the adventure it was started from.
+
+        Only what differs from this game is saved, so saves are small; see `game.saves`.
+
+        Args:
+            game (TextAdventure): The game to save, e.g. a fork of this game.
+
+        Returns:
+            bytes: The saved game.
+        """
+        return diff_state(self._save_layout(), self.game_state, game.game_state, game.current_state.id)
+
+    def load(self, data:bytes) -> 'TextAdventure':
+        """
+        Loads a game saved with `save` from this game.
+
+        Args:
+            data (bytes): The saved game.
+
+        Returns:
+            TextAdventure: The loaded game.
+        """
+        game_state, area_id = apply_diff(self._save_layout(), self.game_state, data)
+        # games are saved between commands, when every state event is up to date
+        return self._with_state(game_state, area_id, dirty=set())
+
+    def _save_layout(self) -> SaveLayout:
+        # do this lazily, since most games are never saved from
+        layout = getattr(self, '_layout', None)
+        if layout is None:
+            layout = self._layout = SaveLayout(self.game_state)
+        return layout
+
+    def _with_state(self, game_state:GameState, area_id:str, dirty:Optional[set]=None) -> 'TextAdventure':
+        """ Makes a game of this adventure around a copy of its game state, as made by `GameState.fork`. """
+        clone = TextAdventure.__new__(TextAdventure)
+        clone.use_spacy = self.use_spacy
+        clone.journal = None
+        clone.succeeded = True
+        clone.game_state = game_state
+        clone.current_state = game_state.artifacts[area_id]
+        # Names don't change, so the grammar can be shared
+        clone.grammar = self.grammar
+        clone._index(names=self.scope.names)
+        if dirty is not None:
+            # Only what this game has yet to evaluate is out of date in the copy
+            clone.state_events.dirty = set(dirty)
+        return clone
+
+    def _run_command(self, command:str, parsed:Optional[tuple]=None) -> str:
+        """ Executes a command; see `run_command`. `parsed` is the command's parse, if it was parsed already. """
+        if self.journal is None:
+            return self._execute(command, parsed)
+
+        # Parse here rather than in `_execute` so the journal gets the parse
+        if parsed is None and self._needs_parse(command):
+            parsed = parse_command(command, self.grammar, self.use_spacy)
+        response = self._execute(command, parsed)
+        self.journal.record(command, parsed, response, self)
+        return response
+
+    def _execute(self, command:str, parsed:Optional[tuple]=None) -> str:
         # Parse the command
-        command = self._parse_command(command)
+        command = self._parse_command(command, parsed)
         logger.info(f'Parsed command: {command}')
 
         # If the command is not understood
         if isinstance(command, str):
             logger.warning(f'Command not understood: {command}')
+            self.succeeded = False
             return command
 
         # Handle the action
         response = self.current_state.handle_action(command, self.game_state)
+        self.succeeded = response.success
+        if not response.is_repeatable and self._command_index is not None:
+            # the interaction it fired, if any, was removed
+            self._command_index.interactions_changed()
 
         # If this sets any events
         self.game_state.event_log = response.events
@@ -64,7 +277,8 @@ class TextAdventure:
             if response.item in self.game_state.inventory:
                 self.game_state.inventory.remove(response.item)
             elif response.item in self.current_state.items:
-                self.current_state.items.remove(response.item)
+                # do this lazily so that we are calling the setter
+                self.current_state.items = [item for item in self.current_state.items if item != response.item]
             else:
                 logger.warning(f'Item not found in inventory or current state: {response.item}, nothing was removed!')
             logger.debug(f'Consumed item: {response.item}')
@@ -76,47 +290,8 @@ class TextAdventure:
             if response.new_state not in self.game_state.visited_tiles:
                 self.game_state.visited_tiles.append(response.new_state)
 
-        # Calculate state events - we do this every time which is not efficient but it's not a big deal
-        # Data model: { event: { "artifacts": { artifact_id: { property: value } }, "events": { event: True/False }, "event_value": True/False } ...  }
-        for event, conditions in self.game_state.state_events.items():
-            # logger.debug(f'Checking for changes in state event: {event}')
-            event_triggered = True
-            for artifiact_id in conditions['artifacts'].keys():
-                for property_name, value in conditions['artifacts'][artifiact_id].items():
-                    # logger.debug(f"Looking for {property_name} and {artifiact_id}")
-                    property_value = getattr(self.game_state.artifacts[artifiact_id], property_name)
-                    if isinstance(property_value, Iterable):
-                        # corresponds to "at least one of the items in value must be in property_value" logic
-                        if isinstance(value, list) and not set(value).issuperset(set(property_value)):
-                            # logger.debug(f'State event {event} failed trigger: Property value {property_value} is not a subset of {value}')
-                            event_triggered = False
-                            break
-                        # corresponds to "this item must be in the property_value" logic
-                        elif not isinstance(value, list) and value not in property_value:
-                            # logger.debug(f'State event {event} failed trigger: Property value {property_value} does not contain {value}')
-                            event_triggered = False
-                            break
-                    elif property_value != value:
-                        # logger.debug(f'State event {event} failed trigger: Property value {property_value} does not equal {value}')
-                        event_triggered = False
-                        break
-                if not event_triggered:
-                    break
-            if event_triggered and conditions['events']:
-                # logger.debug(f'Checking for events: {conditions["events"]}')
-                for event_name, value in conditions['events'].items():
-                    if self.game_state.events.get(event_name) != value:
-                        # logger.debug(f'State event {event} failed trigger: Event value {self.game_state.events.get(event_name)} does not equal {value}')
-                        event_triggered = False
-                        break
-            if event_triggered:
-                if not self.game_state.event_log.get(event):
-                    logger.info(f'Triggering state event: {event}')
-                self.game_state.event_log = {event:True}
-            else:
-                if self.game_state.event_log.get(event):
-                    logger.info(f'Turning off state event: {event}')
-                self.game_state.event_log = {event:False}
+        # Re-evaluate only the state events whose inputs this command changed
+        self.state_events.evaluate()
 
         # If the game_victory event has been dispatched
         if self.game_state.events.get('game_victory'):
@@ -125,12 +300,18 @@ class TextAdventure:
 
         return response.message
 
-    def _parse_command(self, command:str) -> dict:
+    def _needs_parse(self, command:str) -> bool:
+        """ Whether `_parse_command` would have to run the command through the parser. """
+        tokens = command.split()
+        return bool(tokens) and tokens[0] in InteractiveActions._value2member_map_ and tokens[0] not in GameActions._value2member_map_
+
+    def _parse_command(self, command:str, parsed:Optional[tuple]=None) -> dict:
         """
         Parses a command string and returns a dictionary representing the action.
 
         Args:
             command (str): The command string to parse.
+            parsed (tuple): The (action, object, iobject) the command was already parsed into, if any.
 
         Returns:
             dict: A dictionary containing the parsed action and objects, or an error message if the command is not understood.
@@ -150,7 +331,14 @@ class TextAdventure:
 
         # Otherwise parse the command
         logger.debug(f'Parsing text as command: {command}')
-        action, object_name, iobject_name = parse_command(command)
+        if parsed is None:
+            parsed = parse_command(command, self.grammar, self.use_spacy)
+        action, object_name, iobject_name = parsed
+
+        # Every other action needs something to act on, and its handlers expect one
+        if not object_name and action.lower() not in IntransitiveVerbs._value2member_map_:
+            logger.warning(f'Command attempted without an object: {command}')
+            return f'What do you want to {action.lower()}?'
 
         if action == 'go':
             action = object_name
@@ -179,8 +367,8 @@ class TextAdventure:
         """
         Searches for an object by name within the current game context.
 
-        This method searches through the player's inventory, the current area's items, and fixtures
-        to find an object that matches the given name and is visible.
+        This method looks the name up in the scope index, which finds the object that matches the given name,
+        is visible and is in the player's inventory or the current area, including inside other objects.
 
         Args:
             name (str): The name of the object to search for.
@@ -189,28 +377,22 @@ class TextAdventure:
             object: The object that matches the given name and is visible, or None if no such object is found.
         """
 
-        object = None
         if not name:
             logger.info('No object name provided')
-            return object
+            return None
 
         logger.debug(f'Searching for object by name: {name}')
 
-        context = self.game_state.inventory + self.current_state.items + self.current_state.fixtures
-
-        for artifact_id in context:
-            artifact = self.game_state.artifacts[artifact_id]
-            if artifact.name.lower() == name.lower() and artifact.is_visible:
-                logger.debug(f'Found object: {name}')
-                return artifact
-            context.extend(artifact.items + artifact.fixtures)
+        object = self.scope.resolve(name, self.current_state)
+        if object:
+            logger.debug(f'Found object: {name}')
 
         return object
 
     def _initialize(self):
         # Initializes the map by creating exits between areas.
-        areas = [area for area in self.game_state.artifacts.values() if isinstance(area, Area)]
-        for area in areas:
+        areas = {area.id: area for area in self.game_state.artifacts.values() if isinstance(area, Area)}
+        for area in areas.values():
             area._make_exits(areas)
         
         # Propagates artifact name into descriptions
@@ -218,6 +400,25 @@ class TextAdventure:
             if not artifact.description_.name:
                 artifact.description_.name = artifact.id
 
+        # Builds the command grammar from the artifact names, so most commands don't need spaCy.
+        self.grammar = CommandGrammar(artifact.name for artifact in self.game_state.artifacts.values())
+
+        self._index()
+
+    def _index(self, names:Optional[dict]=None):
+        """ Builds the indices over the game state that commands are run with, reusing the name index if given. """
+        # Indexes which artifacts listen for which events, so events are not broadcast to every artifact.
+        self.game_state.index_triggers()
+
+        # Indexes artifact names and containers for resolving the objects of commands.
+        self.scope = ScopeIndex(self.game_state, names)
+
+        # Compiles the state events into a dependency index so they are evaluated incrementally.
+        self.state_events = StateEventEngine(self.game_state)
+
+        # Indexes the interactions for enumerating the available commands, made when they are first asked for.
+        self._command_index = None
+
     def _read_config(self, config:dict) -> Tuple[List[Area], GameState]:
         """ Deserializes the game configuration from a JSON file or dictionary into Artifact objects. """
         if isinstance(config, dict):
@@ -240,12 +441,15 @@ class TextAdventure:
             for at in [('area', Area), ('item', Item), ('fixture', Fixture)]:
                 if artifact.get('type') == at[0]:
                     artifact = at[1].model_validate(artifact)
-                    artifact._assign_container(game_state)
                     artifacts.append(artifact)
                     break
 
         game_state.artifacts = {artifact.id:artifact for artifact in artifacts}
 
+        # Containers can only be assigned once every artifact can be looked up
+        for artifact in artifacts:
+            artifact._assign_container(game_state)
+
         self.current_state = game_state.artifacts[config.get('start_area')]
         game_state.visited_tiles = [self.current_state]
 
@@ -258,9 +462,41 @@ class TextAdventure:
         return game_state
 
     def _from_json(self, path_to_json):
-        with open(path_to_json, 'r') as f:
-            config = json.load(f)
+        with open(path_to_json, 'rb') as f:
+            source = f.read()
+
+        # Skip validation if the adventure has been compiled since it last changed
+        compiled = read_compiled(compiled_path(path_to_json), source_digest(source))
+        if compiled:
+            game_state, start_area = compiled
+            self.current_state = game_state.artifacts[start_area]
+            return game_state
+
+        config = json.loads(source)
 
         game_state = self._from_dict(config)
 
         return game_state
+
+    @staticmethod
+    def compile(path_to_json:str, output:Optional[str]=None) -> str:
+        """
+        Validates a JSON adventure once and writes it out as a compiled adventure, which later loads of the
+        adventure use instead of validating it again for as long as the JSON doesn't change.
+
+        Args:
+            path_to_json (str): The path of the JSON adventure.
+            output (str): The path to write the compiled adventure to; by default next to the JSON adventure.
+
+        Returns:
+            str: The path of the compiled adventure.
+        """
+        with open(path_to_json, 'rb') as f:
+            source = f.read()
+        config = json.loads(source)
+
+        game_state = TextAdventure.__new__(TextAdventure)._from_dict(config)
+
+        output = output or compiled_path(path_to_json)
+        write_compiled(output, game_state, config.get('start_area'), source_digest(source))
+        return output
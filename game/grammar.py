@@ -0,0 +1,85 @@
+from typing import Iterable, Optional, Tuple
+
+from game.actions.action_enums import InteractiveActions
+
+from game.logger import logger
+
+PREPOSITIONS = frozenset([
+    'about', 'above', 'across', 'against', 'at', 'behind', 'below', 'beneath', 'beside', 'by', 'from', 'in',
+    'inside', 'into', 'near', 'of', 'off', 'on', 'onto', 'over', 'through', 'to', 'toward', 'towards', 'under',
+    'underneath', 'using', 'with', 'within',
+])
+
+
+def tokenize(command:str) -> list:
+    """ Splits a command into lowercase tokens, dropping any sentence punctuation at the end. """
+    return command.lower().rstrip('.!?').split()
+
+
+class CommandGrammar:
+    """
+    A deterministic grammar for the command shapes that make up nearly all input: `verb`, `verb object`
+    and `verb object preposition object`.
+
+    It only needs the verbs, a list of prepositions and the names of the artifacts in the adventure, which
+    it uses to tell a preposition apart from a word inside a name (e.g. "box of rocks"). Commands it cannot
+    parse unambiguously, such as double object constructions ("give troll key"), are left to spaCy unless
+    a best effort parse is asked for.
+
+    Attributes:
+        verbs (set): The verbs a command can start with.
+        names (set): The names of the artifacts in the adventure, as tuples of lowercase tokens.
+    """
+
+    def __init__(self, names:Iterable[str], verbs:Optional[Iterable[str]]=None):
+        self.verbs = set(verbs) if verbs is not None else {action.value for action in InteractiveActions}
+        self.names = {tuple(tokenize(name)) for name in names}
+
+    def parse(self, command:str, best_effort:bool=False) -> Optional[Tuple[str, str, str]]:
+        """
+        Parses a command into an action, object and indirect object.
+
+        Args:
+            command (str): The command string to parse.
+            best_effort (bool): Whether to guess at ambiguous commands rather than giving up on them.
+
+        Returns:
+            tuple: A tuple containing the action, object and indirect object, or None if the command is ambiguous.
+        """
+        tokens = tokenize(command)
+        if not tokens or tokens[0] not in self.verbs:
+            return None
+
+        action, rest = tokens[0], tokens[1:]
+
+        if not rest or tuple(rest) in self.names:
+            return action, " ".join(rest), ''
+
+        prepositions = [i for i, token in enumerate(rest) if token in PREPOSITIONS]
+
+        if not prepositions:
+            # two names in a row is a double object construction, e.g. "give troll key"
+            for i in range(1, len(rest)):
+                if tuple(rest[:i]) in self.names and tuple(rest[i:]) in self.names:
+                    logger.debug(f'Double object construction in command: {command}')
+                    if best_effort:
+                        return action, " ".join(rest[i:]), " ".join(rest[:i])
+                    return None
+            return action, " ".join(rest), ''
+
+        # prepositions with something on either side of them
+        splits = [i for i in prepositions if 0 < i < len(rest) - 1]
+        # ... and of those, the ones with a name on either side of them
+        named_splits = [i for i in splits if tuple(rest[:i]) in self.names and tuple(rest[i+1:]) in self.names]
+
+        if len(named_splits) == 1:
+            split = named_splits[0]
+        elif len(splits) == 1 and len(prepositions) == 1:
+            split = splits[0]
+        elif best_effort and prepositions:
+            split = (named_splits or splits or prepositions)[0]
+        else:
+            logger.debug(f'Ambiguous prepositions in command: {command}')
+            return None
+
+        return action, " ".join(rest[:split]), " ".join(rest[split+1:])
@@ -0,0 +1,218 @@
+"""
+Event-sourced command journals.
+
+A journal records every command run in a game, together with how it was parsed and what it changed, and
+every so often a full snapshot of the game state. A game is restored by loading the latest snapshot and
+replaying only the commands recorded after it; since their parses are recorded, replaying them never needs
+spaCy.
+
+Each game has its own pair of files: `<session_id>.journal`, a sequence of pickled entries, and
+`<session_id>.snapshot`. Writing happens on a background thread so that running commands never waits on disk.
+Like compiled adventures, journals are pickles, so only restore ones you wrote yourself.
+"""
+import os
+import pickle
+import queue
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+
+from game.compiler import PICKLE_PROTOCOL, schema_hash
+from game.models import GameState
+
+from game.logger import logger
+
+
+class JournalEntry(NamedTuple):
+    seq: int # the position of the command in the game, from 1
+    command: str
+    parse: Optional[tuple] # (action, object, iobject), if the command went through the parser
+    response: str
+    delta: dict # what the command changed: the events it set, the inventory if it changed, and the area
+
+    def differences(self, adventure: 'TextAdventure') -> List[str]:
+        """ Lists what of the recorded delta the game doesn't match after replaying the command, if anything. """
+        game_state = adventure.game_state
+        differences = [
+            f'event {name}' for name, value in self.delta['events'].items() if game_state.events.get(name) != value
+        ]
+        if 'inventory' in self.delta and game_state.inventory != self.delta['inventory']:
+            differences.append('inventory')
+        if adventure.current_state.id != self.delta['area']:
+            differences.append('area')
+        return differences
+
+
+class Snapshot(NamedTuple):
+    seq: int # the last command the snapshot includes
+    game_state: GameState
+    current_area: str
+
+
+class CommandJournal:
+    """
+    Records the commands run in one game, writing them behind the game on a background thread.
+
+    Attributes:
+        journal_path (str): The file the entries are appended to.
+        snapshot_path (str): The file the latest snapshot is kept in.
+        snapshot_interval (int): How many commands to record between snapshots.
+        seq (int): The number of commands recorded so far, including before the game was restored.
+    """
+
+    def __init__(self, directory:str, session_id:str, snapshot_interval:int=100):
+        # the session ID names the journal's files, so it mustn't lead out of the directory
+        if not session_id or session_id in ('.', '..') or os.path.basename(session_id) != session_id:
+            raise ValueError(f'Invalid session ID for a journal: {session_id!r}')
+        self.journal_path = os.path.join(directory, f'{session_id}.journal')
+        self.snapshot_path = os.path.join(directory, f'{session_id}.snapshot')
+        self.snapshot_interval = snapshot_interval
+        self.seq = 0
+        self._changed_events = set()
+        self._inventory = None
+        self._queue = queue.Queue()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.journal_path) or os.path.exists(self.snapshot_path)
+
+    def attach(self, adventure: 'TextAdventure'):
+        """ Starts recording the commands run in a game; see `TextAdventure.attach_journal`. """
+        adventure.game_state.watch_events(self._events_changed)
+        self._inventory = list(adventure.game_state.inventory)
+
+    def _events_changed(self, events):
+        self._changed_events.update(events)
+
+    def record(self, command:str, parse:Optional[tuple], response:str, adventure:'TextAdventure'):
+        """
+        Records a command that has just run, and takes a snapshot if one is due.
+
+        Args:
+            command (str): The command string.
+            parse (tuple): The (action, object, iobject) tuple it was parsed into, if it was parsed.
+            response (str): The response message.
+            adventure (TextAdventure): The game the command ran in.
+        """
+        game_state = adventure.game_state
+        self.seq += 1
+
+        delta = {
+            'events': {name: game_state.events[name] for name in self._changed_events},
+            'area': adventure.current_state.id,
+        }
+        self._changed_events = set()
+        if game_state.inventory != self._inventory:
+            self._inventory = list(game_state.inventory)
+            delta['inventory'] = self._inventory
+
+        self._put(('entry', JournalEntry(self.seq, command, parse, response, delta)))
+
+        if self.seq % self.snapshot_interval == 0:
+            # copying the state has to happen now; pickling it can happen on the writer thread
+            self._put(('snapshot', Snapshot(self.seq, game_state.fork(), adventure.current_state.id)))
+
+    def read(self) -> Tuple[Optional[Snapshot], List[JournalEntry]]:
+        """
+        Reads the latest snapshot and the entries recorded after it.
+
+        A journal that ends in a partly written entry, e.g. because the process crashed, is read up to it.
+
+        Returns:
+            tuple: The snapshot, or None if there is no usable one, and the entries to replay on top of it.
+        """
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'rb') as f:
+                    header = pickle.load(f)
+                    if header.get('schema') == schema_hash():
+                        snapshot = pickle.load(f)
+                    else:
+                        logger.warning(f'Snapshot {self.snapshot_path} was taken with other models; ignoring it')
+            except Exception:
+                logger.warning(f'Could not read snapshot {self.snapshot_path}')
+
+        after = snapshot.seq if snapshot else 0
+        entries = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                while True:
+                    try:
+                        entry = pickle.load(f)
+                    except EOFError:
+                        break
+                    except Exception:
+                        logger.warning(f'Journal {self.journal_path} ends in a partial entry; ignoring it')
+                        break
+                    if entry.seq > after:
+                        entries.append(entry)
+
+        # entries only go missing if the snapshot is unusable and the journal was already truncated
+        expected = after + 1
+        for entry in entries:
+            if entry.seq != expected:
+                raise ValueError(f'Journal {self.journal_path} is missing commands {expected} to {entry.seq - 1}')
+            expected += 1
+
+        return snapshot, entries
+
+    def flush(self):
+        """ Waits until everything recorded so far has been written. """
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """ Writes everything recorded so far and stops the writer thread. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def delete(self):
+        """ Closes the journal and deletes its files. """
+        self.close()
+        for path in (self.journal_path, self.snapshot_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _put(self, item):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_behind, daemon=True)
+            self._thread.start()
+        self._queue.put(item)
+
+    def _write_behind(self):
+        journal = open(self.journal_path, 'ab')
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        return
+                    kind, record = item
+                    if kind == 'entry':
+                        pickle.dump(record, journal, protocol=PICKLE_PROTOCOL)
+                    else:
+                        self._write_snapshot(record)
+                        # everything in the journal is in the snapshot now
+                        journal.close()
+                        journal = open(self.journal_path, 'wb')
+                    # batch up writes while commands keep coming
+                    if self._queue.empty():
+                        journal.flush()
+                finally:
+                    self._queue.task_done()
+        finally:
+            journal.close()
+
+    def _write_snapshot(self, snapshot: Snapshot):
+        path = self.snapshot_path + '.tmp'
+        with open(path, 'wb') as f:
+            pickle.dump({'schema': schema_hash(), 'seq': snapshot.seq}, f, protocol=PICKLE_PROTOCOL)
+            pickle.dump(snapshot, f, protocol=PICKLE_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        # replacing it in one go means there is always a complete snapshot on disk
+        os.replace(path, self.snapshot_path)
+        logger.debug(f'Wrote snapshot {self.snapshot_path} at command {snapshot.seq}')
@@ -1,5 +1,5 @@
-from typing import Any, List, Union, Optional, Literal
-from pydantic import BaseModel, Field
+from typing import Any, Callable, List, Union, Optional, Literal
+from pydantic import BaseModel, Field, PrivateAttr
 
 from game.logger import logger
 
@@ -14,6 +14,9 @@ class GameState(BaseModel):
     interactions: dict = Field(default_factory=dict)
     state_events: dict = Field(default_factory=dict)
     visited_tiles: list = Field(default_factory=list)
+    _event_watchers: List[Callable] = PrivateAttr(default_factory=list)
+    _trigger_index: Optional[dict] = PrivateAttr(None)
+    _trigger_applications: int = PrivateAttr(0)
 
     @property
     def event_log(self):
@@ -22,13 +25,76 @@ class GameState(BaseModel):
     @event_log.setter
     def event_log(self, event:dict):
         if event:
+            changed = [name for name, value in event.items() if name not in self.events or self.events[name] != value]
             self.events.update(event)
-            self._trigger_events(event)
+            # events that are set to the value they already have have already been applied
+            if changed:
+                self._trigger_events({name: event[name] for name in changed})
+                for callback in self._event_watchers:
+                    callback(changed)
+
+    def watch_events(self, callback:Callable):
+        """ Registers a callback that is called with the names of the events whose value changed. """
+        self._event_watchers.append(callback)
+
+    def fork(self) -> 'GameState':
+        """
+        Makes a copy of this game state, and of its artifacts, that can be played independently of it.
+
+        Only the mutable state is copied; static data such as the state event definitions and names are
+        shared. The copy is not indexed and has no watchers.
+
+        Returns:
+            GameState: The copy.
+        """
+        artifacts = {artifact_id: artifact.fork() for artifact_id, artifact in self.artifacts.items()}
+        for artifact in artifacts.values():
+            artifact._relink(artifacts)
+
+        clone = self.model_copy(update={
+            'inventory': list(self.inventory),
+            'log': list(self.log),
+            'artifacts': artifacts,
+            'events': dict(self.events),
+            'interactions': dict(self.interactions),
+            'visited_tiles': [artifacts.get(tile.id, tile) for tile in self.visited_tiles],
+        })
+        clone._event_watchers = []
+        clone._trigger_index = None
+        clone._trigger_applications = 0
+        return clone
+
+    @property
+    def trigger_applications(self) -> int:
+        """ The number of times an event has been applied to an artifact listening for it. """
+        return self._trigger_applications
+
+    def index_triggers(self):
+        """
+        Builds the subscription index mapping each trigger key (`event__value`) to the artifacts that
+        listen for it, either through their own triggers or through their description's triggers.
+
+        This has to be called again whenever artifacts are added or their triggers change.
+        """
+        index = {}
+        for artifact in self.artifacts.values():
+            for trigger_name in {**artifact.triggers, **artifact.description_.triggers}:
+                index.setdefault(trigger_name, []).append(artifact)
+        self._trigger_index = index
 
     # this has no toggle support
     def _trigger_events(self, event:dict):
-        for object in self.artifacts.values():
-            object._trigger_events(event)
+        if self._trigger_index is None:
+            # Not indexed yet, so every artifact has to be asked
+            for object in self.artifacts.values():
+                object._trigger_events(event)
+                self._trigger_applications += 1
+            return
+
+        for name, value in event.items():
+            for object in self._trigger_index.get(f"{name}__{value}", ()):
+                object._trigger_events({name: value})
+                self._trigger_applications += 1
 
 
 class HandleActionResponse(BaseModel):
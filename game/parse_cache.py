@@ -0,0 +1,120 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from game import database
+from game.logger import logger
+
+def normalize_command(command:str) -> str:
+    """ Normalizes a command so that trivially different spellings of it share a cache entry. """
+    return " ".join(command.lower().split())
+
+
+class ParseCache:
+    """
+    An LRU cache of parsed commands, optionally backed by a SQLite database.
+
+    Parsing a command with spaCy is by far the most expensive part of running it, and the same commands
+    are sent over and over. The in-memory cache holds the most recently used parses; the database, if
+    given, keeps every parse across restarts and can be shared between worker processes.
+
+    Attributes:
+        maxsize (int): The maximum number of parses held in memory.
+        path (str): The path of the SQLite database backing the cache, if any.
+        hits (int): The number of lookups answered from memory or from the database.
+        misses (int): The number of lookups that had to be parsed.
+        disk_hits (int): The number of hits that were answered from the database.
+    """
+
+    def __init__(self, maxsize:int=4096, path:Optional[str]=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = database.connect(
+                path,
+                'CREATE TABLE IF NOT EXISTS parses '
+                '(command TEXT PRIMARY KEY, action TEXT, object TEXT, iobject TEXT)',
+            )
+            logger.info(f'Using parse cache database at {path}')
+
+    def get(self, command:str) -> Optional[tuple]:
+        """
+        Looks up the parse of a normalized command.
+
+        Args:
+            command (str): The normalized command.
+
+        Returns:
+            tuple: The cached (action, object, iobject) tuple, or None if the command has not been parsed yet.
+        """
+        with self._lock:
+            parse = self._entries.get(command)
+            if parse is not None:
+                self._entries.move_to_end(command)
+                self.hits += 1
+                return parse
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT action, object, iobject FROM parses WHERE command = ?', (command,)
+                ).fetchone()
+                if row is not None:
+                    parse = tuple(row)
+                    self._remember(command, parse)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return parse
+
+            self.misses += 1
+            return None
+
+    def put(self, command:str, parse:tuple):
+        """
+        Stores the parse of a normalized command.
+
+        Args:
+            command (str): The normalized command.
+            parse (tuple): The (action, object, iobject) tuple it was parsed into.
+        """
+        parse = tuple(parse)
+        with self._lock:
+            self._remember(command, parse)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?)', (command, *parse))
+                self._db.commit()
+
+    def clear(self):
+        """ Empties the in-memory cache and resets the counters. The database is left alone. """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.disk_hits = 0
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+    def _remember(self, command:str, parse:tuple):
+        self._entries[command] = parse
+        self._entries.move_to_end(command)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,20 +1,160 @@
-import en_core_web_sm
+import os
+import threading
+from typing import Iterable, List, Optional
 
-nlp = en_core_web_sm.load()
+from game.parse_cache import ParseCache, normalize_command
+from game.grammar import CommandGrammar, tokenize
 
-def parse_command(command:str) -> tuple:
+from game.logger import logger
+
+# parse_command only looks at part of speech tags (tagger + attribute_ruler) and dependencies (parser),
+# so the components it never uses are not loaded at all.
+EXCLUDED_COMPONENTS = ['ner', 'lemmatizer']
+
+_nlp = None
+# commands are run from several threads at once, and the model must still only be loaded once
+_nlp_lock = threading.Lock()
+
+def get_nlp():
+    """
+    Returns the spaCy pipeline, loading it on first use.
+
+    Loading the model is slow and takes a lot of memory, so importing the parser (and the engine) doesn't,
+    and processes that never fall back to spaCy never load it.
+    """
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            # another thread may have loaded it while this one waited
+            if _nlp is None:
+                import en_core_web_sm
+                logger.info(f'Loading spaCy model without {EXCLUDED_COMPONENTS}')
+                _nlp = en_core_web_sm.load(exclude=EXCLUDED_COMPONENTS)
+    return _nlp
+
+# Set USE_SPACY=0 to parse everything with the command grammar and never fall back to spaCy
+USE_SPACY = os.environ.get('USE_SPACY', '1').lower() not in ('0', 'false', 'no')
+
+# Parses commands for games without a grammar of their own when spaCy isn't used
+_default_grammar = CommandGrammar([])
+
+# Set PARSE_CACHE_PATH to keep parses in a SQLite database shared across restarts and processes
+parse_cache = ParseCache(path=os.environ.get('PARSE_CACHE_PATH'))
+
+def configure_parse_cache(maxsize:int=4096, path:Optional[str]=None) -> ParseCache:
+    """
+    Replaces the parse cache used by `parse_command`.
+
+    Args:
+        maxsize (int): The maximum number of parses held in memory.
+        path (str): The path of a SQLite database to back the cache with, if any.
+
+    Returns:
+        ParseCache: The new parse cache.
+    """
+    global parse_cache
+    parse_cache.close()
+    parse_cache = ParseCache(maxsize=maxsize, path=path)
+    return parse_cache
+
+def parse_command(command:str, grammar:Optional[CommandGrammar]=None, use_spacy:bool=True) -> tuple:
     """
     Parses a command string into an action, object, and indirect object.
 
+    If a grammar is given, it is tried first and spaCy is only used for the commands the grammar finds
+    ambiguous. spaCy parses are cached by normalized command, so a command is only run through spaCy
+    the first time it is seen; spaCy itself is given the command as it was typed.
+
     Args:
         command (str): The command string to parse.
+        grammar (CommandGrammar): The grammar of the adventure the command is for, if any.
+        use_spacy (bool): Whether to fall back to spaCy. If not, ambiguous commands get the grammar's best guess.
 
     Returns:
         tuple: A tuple containing the action, object, and indirect object.
     """
+    parsed = _parse_without_spacy(command, grammar, use_spacy)
+    if parsed is not None:
+        return parsed
+
+    key = normalize_command(command)
+
+    parsed = parse_cache.get(key)
+    if parsed is None:
+        parsed = _parse_command(command)
+        parse_cache.put(key, parsed)
+
+    return parsed
+
+def parse_commands(commands:Iterable[str], grammar:Optional[CommandGrammar]=None, use_spacy:bool=True, batch_size:int=256) -> List[tuple]:
+    """
+    Parses many command strings at once; see `parse_command`.
+
+    The commands that have to go through spaCy and aren't cached are parsed together with `nlp.pipe`,
+    which is much faster than parsing them one at a time.
+
+    Args:
+        commands (Iterable[str]): The command strings to parse.
+        grammar (CommandGrammar): The grammar of the adventure the commands are for, if any.
+        use_spacy (bool): Whether to fall back to spaCy.
+        batch_size (int): The number of commands spaCy processes per batch.
+
+    Returns:
+        list: A tuple containing the action, object, and indirect object for each command, in order.
+    """
+    commands = list(commands)
+    parsed = [None] * len(commands)
+
+    # normalized command -> the indices of the commands that normalize to it; the first is the one parsed
+    pending = {}
+    for i, command in enumerate(commands):
+        parsed[i] = _parse_without_spacy(command, grammar, use_spacy)
+        if parsed[i] is not None:
+            continue
+
+        key = normalize_command(command)
+        if key in pending:
+            pending[key].append(i)
+            continue
+
+        parsed[i] = parse_cache.get(key)
+        if parsed[i] is None:
+            pending[key] = [i]
+
+    if pending:
+        logger.debug(f'Parsing {len(pending)} commands with spaCy')
+        texts = [commands[indices[0]] for indices in pending.values()]
+        for key, doc in zip(pending, get_nlp().pipe(texts, batch_size=batch_size)):
+            parse = _parse_doc(doc)
+            parse_cache.put(key, parse)
+            for i in pending[key]:
+                parsed[i] = parse
+
+    return parsed
+
+def _parse_without_spacy(command:str, grammar:Optional[CommandGrammar], use_spacy:bool) -> Optional[tuple]:
+    """ Parses a command with the grammar, returning None if it has to be left to spaCy. """
+    if grammar is not None:
+        parsed = grammar.parse(command, best_effort=not use_spacy)
+        if parsed is not None:
+            return parsed
+
+    if not use_spacy:
+        parsed = _default_grammar.parse(command, best_effort=True)
+        if parsed is None:
+            tokens = tokenize(command)
+            parsed = (tokens[0] if tokens else '', " ".join(tokens[1:]), '')
+        return parsed
+
+    return None
+
+def _parse_command(command:str) -> tuple:
+    """ Parses a command string with spaCy; see `parse_command`. """
     # parse it with spacy
-    parsed_command = nlp(command)
+    return _parse_doc(get_nlp()(command))
 
+def _parse_doc(parsed_command) -> tuple:
+    """ Extracts the action, object and indirect object from a command parsed by spaCy. """
     # all verbs have to be a single token and the first in the command
     action = parsed_command[0].text
 
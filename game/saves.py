@@ -0,0 +1,229 @@
+"""
+Compact saved games.
+
+A saved game only records how a game differs from the adventure it was started from: the property flags,
+contents, interactions used up, description and any other fields or extra attributes of the artifacts that
+changed, and the game's area, visited areas, inventory, events and used up game-wide interactions. Artifacts are referred to by
+their position in the adventure and property flags are packed into a bitmask, so a save is usually a few
+hundred bytes, and loading one only means forking the adventure and patching the differences in.
+
+Saves are marshalled rather than pickled, so loading one never runs any code; a save can only be loaded into
+the adventure it was made from.
+"""
+import hashlib
+import marshal
+from typing import Tuple
+
+from game.models import GameState
+
+from game.logger import logger
+
+MAGIC = b'FZS\x02'
+
+# The artifact fields saved in a form of their own; every other declared field is saved as it is if it changed
+# (containers follow from contents, and exits only link areas together)
+SPECIAL_FIELDS = ('properties', 'items_', 'fixtures_', 'container_', 'interactions', 'description_', 'exits_')
+
+
+class SaveLayout:
+    """
+    The numbering of an adventure's artifacts that saves of it refer to them by.
+
+    Attributes:
+        ids (list): The artifact IDs, by number.
+        numbers (dict): The artifact numbers, by ID.
+        flags (dict): The names of each artifact's property flags, by artifact ID, in bitmask order.
+        fingerprint (bytes): Identifies the adventure, so a save isn't loaded into another one.
+    """
+
+    def __init__(self, game_state: GameState):
+        from game.compiler import schema_hash
+
+        self.ids = list(game_state.artifacts)
+        self.numbers = {artifact_id: number for number, artifact_id in enumerate(self.ids)}
+        self.flags = {
+            artifact_id: list(type(artifact.properties).model_fields)
+            for artifact_id, artifact in game_state.artifacts.items()
+            if 'properties' in artifact.__dict__
+        }
+        self.fingerprint = hashlib.sha256('\n'.join([schema_hash()] + self.ids).encode()).digest()[:8]
+
+    def ref(self, artifact_id: str):
+        # IDs the adventure doesn't know are kept as they are
+        return self.numbers.get(artifact_id, artifact_id)
+
+    def deref(self, ref) -> str:
+        return self.ids[ref] if type(ref) is int else ref
+
+
+def diff_state(layout: SaveLayout, template: GameState, game_state: GameState, area_id: str) -> bytes:
+    """
+    Saves a game as its differences from the adventure it was started from.
+
+    Args:
+        layout (SaveLayout): The layout of the adventure.
+        template (GameState): The state of the adventure as loaded.
+        game_state (GameState): The state of the game to save.
+        area_id (str): The ID of the area the player is in.
+
+    Returns:
+        bytes: The saved game.
+    """
+    ref = layout.ref
+    artifacts = []
+    for artifact_id, artifact in game_state.artifacts.items():
+        original = template.artifacts[artifact_id]
+        state, original_state = artifact.__dict__, original.__dict__
+        changed = False
+
+        flags = None
+        if 'properties' in state and state['properties'].__dict__ != original_state['properties'].__dict__:
+            values = state['properties'].__dict__
+            flags = 0
+            for bit, name in enumerate(layout.flags[artifact_id]):
+                if values[name]:
+                    flags |= 1 << bit
+            changed = True
+
+        items = fixtures = None
+        if state['items_'] != original_state['items_']:
+            items = tuple(ref(item) for item in state['items_'])
+            changed = True
+        if state['fixtures_'] != original_state['fixtures_']:
+            fixtures = tuple(ref(fixture) for fixture in state['fixtures_'])
+            changed = True
+
+        removed = None
+        if 'interactions' in state and len(state['interactions']) != len(original_state['interactions']):
+            # interactions are only ever used up, never added
+            removed = tuple(name for name in original_state['interactions'] if name not in state['interactions'])
+            changed = True
+
+        description, original_description = state['description_'].__dict__, original_state['description_'].__dict__
+        # rendering a description renames it, so its name needn't be saved
+        description = {name: value for name, value in description.items()
+                       if name != 'name' and original_description[name] != value} or None
+        if description:
+            changed = True
+
+        fields = {}
+        for name in type(artifact).model_fields:
+            if name in SPECIAL_FIELDS or state[name] == original_state[name]:
+                continue
+            try:
+                marshal.dumps(state[name])
+            except ValueError:
+                logger.warning(f'Cannot save {artifact_id}.{name}, which changed to {state[name]!r}; it is left out')
+                continue
+            fields[name] = state[name]
+            changed = True
+        fields = fields or None
+
+        if 'exits_' in state and _exit_ids(state['exits_']) != _exit_ids(original_state['exits_']):
+            logger.warning(f'The exits of {artifact_id} changed, which saves leave out')
+
+        extra = None
+        if artifact.__pydantic_extra__ != original.__pydantic_extra__:
+            # triggers can set attributes the artifact didn't start with
+            original_extra = original.__pydantic_extra__ or {}
+            extra = {name: value for name, value in artifact.__pydantic_extra__.items()
+                     if name not in original_extra or original_extra[name] != value}
+            changed = True
+
+        if changed:
+            artifacts.append((ref(artifact_id), flags, items, fixtures, removed, description, fields, extra))
+
+    removed_interactions = tuple(name for name in template.interactions if name not in game_state.interactions)
+    events = {name: value for name, value in game_state.events.items()
+              if name not in template.events or template.events[name] != value}
+
+    save = (
+        ref(area_id),
+        tuple(ref(tile.id) for tile in game_state.visited_tiles),
+        tuple(ref(item) for item in game_state.inventory),
+        events,
+        removed_interactions,
+        tuple(artifacts),
+    )
+    return MAGIC + layout.fingerprint + marshal.dumps(save)
+
+
+def apply_diff(layout: SaveLayout, template: GameState, data: bytes) -> Tuple[GameState, str]:
+    """
+    Loads a saved game made with `diff_state`.
+
+    Args:
+        layout (SaveLayout): The layout of the adventure.
+        template (GameState): The state of the adventure as loaded.
+        data (bytes): The saved game.
+
+    Returns:
+        tuple: The game state, which isn't indexed yet, and the ID of the area the player is in.
+
+    Raises:
+        ValueError: If the data is not a save of this adventure.
+    """
+    if data[:4] != MAGIC:
+        raise ValueError('Not a saved game')
+    if data[4:12] != layout.fingerprint:
+        raise ValueError('The game was saved from a different adventure')
+
+    area, visited, inventory, events, removed_interactions, artifacts = marshal.loads(data[12:])
+    deref = layout.deref
+
+    game_state = template.fork()
+    all_artifacts = game_state.artifacts
+
+    moved = {}
+    for number, flags, items, fixtures, removed, description, fields, extra in artifacts:
+        artifact_id = deref(number)
+        artifact = all_artifacts[artifact_id]
+        # the fork is not indexed yet, so nothing is watching it and the setters can be bypassed
+        state = artifact.__dict__
+
+        if flags is not None:
+            values = state['properties'].__dict__
+            for bit, name in enumerate(layout.flags[artifact_id]):
+                values[name] = bool(flags >> bit & 1)
+
+        if items is not None or fixtures is not None:
+            # whatever was in or is now in the artifact may have changed containers
+            for contained in state['items_'] + state['fixtures_']:
+                moved.setdefault(contained, None)
+            if items is not None:
+                state['items_'] = [deref(item) for item in items]
+            if fixtures is not None:
+                state['fixtures_'] = [deref(fixture) for fixture in fixtures]
+            for contained in state['items_'] + state['fixtures_']:
+                moved[contained] = artifact
+
+        if removed:
+            for name in removed:
+                state['interactions'].pop(name, None)
+
+        if description:
+            state['description_'].__dict__.update(description)
+
+        if fields:
+            state.update(fields)
+
+        if extra:
+            artifact.__pydantic_extra__.update(extra)
+
+    for contained, container in moved.items():
+        if contained in all_artifacts:
+            all_artifacts[contained].__dict__['container_'] = container
+        else:
+            logger.warning(f"Could not get artifact with ID: {contained}")
+
+    game_state.inventory = [deref(item) for item in inventory]
+    game_state.events.update(events)
+    for name in removed_interactions:
+        game_state.interactions.pop(name, None)
+    game_state.visited_tiles = [all_artifacts[deref(tile)] for tile in visited]
+
+    return game_state, deref(area)
+
+
+def _exit_ids(exits) -> list:
+    return [getattr(area, 'id', area) for area in exits] if isinstance(exits, list) else exits
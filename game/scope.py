@@ -0,0 +1,131 @@
+from collections import defaultdict
+from typing import Optional
+
+from game.models import GameState
+from game.core.artifact import Artifact
+
+from game.logger import logger
+
+class ScopeIndex:
+    """
+    Resolves artifact names to the artifacts the player can currently refer to.
+
+    An artifact is in scope if it is in the player's inventory or in the current area, directly or
+    nested inside other artifacts. Rather than walking everything in scope for every name, the index
+    maps each lowercase name to the artifacts carrying it and keeps the `container` back-references
+    up to date as the `items`/`fixtures` setters are called, so checking whether a candidate is in
+    scope only means walking up its containers.
+
+    Attributes:
+        game_state (GameState): The game state whose artifacts are indexed.
+        names (dict): A mapping of lowercase artifact names to artifact IDs.
+        contents (dict): A mapping of artifact IDs to the IDs of the items and fixtures they contain.
+    """
+
+    def __init__(self, game_state: GameState, names: Optional[dict] = None):
+        self.game_state = game_state
+        # names don't change, so a forked game can reuse the index of the game it was forked from
+        self.names = names
+        self.contents = {}
+
+        if self.names is None:
+            self.names = defaultdict(list)
+            for artifact in game_state.artifacts.values():
+                self.names[artifact.name.lower()].append(artifact.id)
+
+        for artifact in game_state.artifacts.values():
+            self.contents[artifact.id] = set(artifact.items + artifact.fixtures)
+            artifact.watch('items', self._contents_changed)
+            artifact.watch('fixtures', self._contents_changed)
+
+    def resolve(self, name: str, area: Artifact) -> Optional[Artifact]:
+        """
+        Finds the visible, in scope artifact with the given name.
+
+        If more than one matches, the one nested least deeply is returned, the inventory coming first.
+
+        Args:
+            name (str): The name of the artifact, in any case.
+            area (Area): The area the player is currently in.
+
+        Returns:
+            Artifact: The matching artifact, or None if there is none in scope.
+        """
+        found, found_depth = None, None
+        for artifact_id in self.names.get(name.lower(), ()):
+            artifact = self.game_state.artifacts[artifact_id]
+            if not artifact.is_visible:
+                continue
+            depth = self._scope_depth(artifact, area)
+            if depth is not None and (found is None or depth < found_depth):
+                found, found_depth = artifact, depth
+        return found
+
+    def in_scope(self, area: Artifact) -> list:
+        """
+        Lists the visible artifacts the player can refer to, i.e. those `resolve` could find: everything in the
+        inventory and in the area, however deeply nested.
+
+        Args:
+            area (Area): The area the player is currently in.
+
+        Returns:
+            list: The artifacts in scope, the inventory's first.
+        """
+        artifacts = self.game_state.artifacts
+        found, seen = [], set()
+        stack = list(reversed(self.game_state.inventory + sorted(self.contents.get(area.id, ()))))
+        while stack:
+            artifact_id = stack.pop()
+            if artifact_id in seen or artifact_id not in artifacts:
+                continue
+            seen.add(artifact_id)
+            artifact = artifacts[artifact_id]
+            if artifact.is_visible:
+                found.append(artifact)
+            stack.extend(sorted(self.contents.get(artifact_id, ()), reverse=True))
+        return found
+
+    def _scope_depth(self, artifact: Artifact, area: Artifact) -> Optional[int]:
+        """
+        Returns how deeply the artifact is nested in the inventory or the area, or None if it is in neither.
+        The area itself is not in scope, only what it contains.
+        """
+        if artifact is area:
+            return None
+        depth = 0
+        while artifact.container is not None:
+            artifact = artifact.container
+            depth += 1
+            # guards against artifacts that (mistakenly) contain each other
+            if depth > len(self.contents):
+                logger.warning(f'Artifact {artifact.id} is contained in itself')
+                return None
+
+        if artifact is area:
+            return depth
+        if artifact.id in self.game_state.inventory:
+            return depth
+        return None
+
+    def _contents_changed(self, artifact_id: str, property_name: str):
+        """
+        Reassigns the containers of whatever moved in or out of an artifact when its items or fixtures are set.
+        """
+        artifacts = self.game_state.artifacts
+        container = artifacts[artifact_id]
+        contents = set(container.items + container.fixtures)
+        previous = self.contents.get(artifact_id, set())
+
+        for moved_id in previous - contents:
+            moved = artifacts.get(moved_id)
+            if moved is not None and moved.container is container:
+                moved.container = None
+        for moved_id in contents - previous:
+            moved = artifacts.get(moved_id)
+            if moved is not None:
+                moved.container = container
+            else:
+                logger.warning(f"Could not get artifact with ID: {moved_id}")
+
+        self.contents[artifact_id] = contents
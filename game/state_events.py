@@ -0,0 +1,117 @@
+from collections import defaultdict
+from typing import Iterable
+
+from game.models import GameState
+
+from game.logger import logger
+
+class StateEventEngine:
+    """
+    Compiled evaluator for the state events of a game.
+
+    State events are derived events whose value depends on artifact properties and on other events.
+    Rather than checking every state event after every command, the engine builds a reverse index at
+    load time from each (artifact_id, property) pair and each event name to the state events that read
+    it, and only re-evaluates the state events whose inputs were actually changed by a command.
+
+    Data model: { event: { "artifacts": { artifact_id: { property: value } }, "events": { event: True/False } } ...  }
+
+    Attributes:
+        game_state (GameState): The game state whose state events are evaluated.
+        conditions (dict): The compiled conditions of each state event.
+        property_index (dict): A mapping of (artifact_id, property) to the state events that depend on it.
+        event_index (dict): A mapping of event names to the state events that depend on them.
+        dirty (set): The state events that need to be re-evaluated on the next call to `evaluate`.
+    """
+
+    def __init__(self, game_state: GameState):
+        self.game_state = game_state
+        self.conditions = {}
+        self.property_index = defaultdict(set)
+        self.event_index = defaultdict(set)
+
+        for event, conditions in game_state.state_events.items():
+            self.conditions[event] = self._compile(event, conditions)
+
+        # Nothing has been evaluated yet, so the first evaluation has to look at everything
+        self.dirty = set(self.conditions)
+
+        for artifact_id, property_name in self.property_index:
+            game_state.artifacts[artifact_id].watch(property_name, self.mark_property)
+        game_state.watch_events(self.mark_events)
+
+    def _compile(self, event: str, conditions: dict) -> tuple:
+        """
+        Flattens the conditions of a state event and registers them in the reverse indices.
+
+        List values are converted to sets once here instead of on every check.
+        """
+        artifact_conditions = []
+        for artifact_id, properties in conditions.get('artifacts', {}).items():
+            for property_name, value in properties.items():
+                if isinstance(value, list):
+                    value = frozenset(value)
+                artifact_conditions.append((artifact_id, property_name, value))
+                self.property_index[(artifact_id, property_name)].add(event)
+
+        event_conditions = list(conditions.get('events', {}).items())
+        for event_name, _ in event_conditions:
+            self.event_index[event_name].add(event)
+
+        return artifact_conditions, event_conditions
+
+    def mark_property(self, artifact_id: str, property_name: str):
+        """ Marks the state events depending on an artifact property as needing re-evaluation. """
+        self.dirty.update(self.property_index.get((artifact_id, property_name), ()))
+
+    def mark_events(self, events: Iterable[str]):
+        """ Marks the state events depending on any of the given events as needing re-evaluation. """
+        for event_name in events:
+            self.dirty.update(self.event_index.get(event_name, ()))
+
+    def evaluate(self):
+        """
+        Re-evaluates the dirty state events and dispatches the ones whose value changed.
+
+        Dispatching a state event can dirty other state events that depend on it, so this keeps going
+        until nothing is left to evaluate. The number of passes is bounded so that state events which
+        depend on each other cyclically cannot loop forever.
+        """
+        passes = 0
+        while self.dirty and passes <= len(self.conditions):
+            passes += 1
+            # Evaluate in declaration order, same as the data model
+            dirty = [event for event in self.conditions if event in self.dirty]
+            self.dirty.clear()
+            for event in dirty:
+                triggered = self._check(*self.conditions[event])
+                if triggered == self.game_state.events.get(event):
+                    continue
+                if triggered:
+                    logger.info(f'Triggering state event: {event}')
+                elif self.game_state.events.get(event):
+                    logger.info(f'Turning off state event: {event}')
+                self.game_state.event_log = {event: triggered}
+
+    def _check(self, artifact_conditions: list, event_conditions: list) -> bool:
+        """ Returns whether all the conditions of a state event currently hold. """
+        artifacts = self.game_state.artifacts
+        for artifact_id, property_name, value in artifact_conditions:
+            property_value = getattr(artifacts[artifact_id], property_name)
+            if isinstance(property_value, Iterable):
+                # corresponds to "at least one of the items in value must be in property_value" logic
+                if isinstance(value, frozenset):
+                    if not value.issuperset(property_value):
+                        return False
+                # corresponds to "this item must be in the property_value" logic
+                elif value not in property_value:
+                    return False
+            elif property_value != value:
+                return False
+
+        events = self.game_state.events
+        for event_name, value in event_conditions:
+            if events.get(event_name) != value:
+                return False
+
+        return True
@@ -1,90 +1,411 @@
-from pydantic import BaseModel, Field
-from typing import Optional
-from enum import Enum
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Iterable, Iterator, NamedTuple, Optional, Union
 
-from agent.models import Actions
+from agent.models import define_structured_output
 from game.engine import TextAdventure
-from game.core.area import Area
-from agent.agent import make_agent
-from agent.prompt import areas_to_known_stuff, create_tile_map
-
-def define_structured_output(objects):
-
-    object_names = [x.name for x in objects.values() if not isinstance(x, Area)] + ['n', 's', 'e', 'w']
-    Object = Enum("Object", {s.upper(): s for s in object_names})
-
-    class AdventureResponse(BaseModel):
-        action: Actions
-        object: Optional[Object]
-        iobject: Optional[Object]
-
-        def as_str(self):
-            object = ""
-            try:
-                object = self.object.value
-            except:
-                pass
-
-            iobject = ""
-            try:
-                iobject = self.iobject.value
-            except:
-                pass
-
-            return f"{self.action.value} {object} {iobject}".strip()
-
-    return AdventureResponse
+from agent import policies
+from agent.agent import AGENT_MODES, agent_commands, make_agent_for_mode
+from agent.cache import CachedModel, ResponseCache
+from agent.observations import observations_for
 
 
 def update_agent_state(agent_state, adventure, command, response):
     agent_state['actions'].append(command)
+    # only what the command changed is rebuilt
+    observations = observations_for(adventure)
     agent_state['visited_tiles'] = adventure.game_state.visited_tiles
-    agent_state['map'] = create_tile_map(adventure.current_state, agent_state['visited_tiles'])
-    agent_state['known_stuff'] = areas_to_known_stuff(adventure.game_state, agent_state['visited_tiles'])
+    agent_state['map'] = observations.map()
+    agent_state['known_stuff'] = observations.known_stuff()
     agent_state['location_name'] = adventure.current_state.name
-    agent_state['description'] = adventure.current_state.get_description(adventure.game_state)
+    agent_state['description'] = observations.description()
+    agent_state['scope'] = observations.scope()
     agent_state['result'] = response
+    agent_state['succeeded'] = adventure.succeeded
     agent_state['command'] = None
     return agent_state
 
 
-def main_loop(reason_model, plan_model, act_model, adventure_config, max_attempts=100):
-
-    adventure = TextAdventure(config=adventure_config)
-    response_format = define_structured_output(adventure.game_state.artifacts)
-    act_model = act_model.with_structured_output(response_format)
-    agent = make_agent(reason_model, plan_model, act_model)
-
-    agent_state = {
+def initial_agent_state(adventure, purpose="to get ye flask."):
+    observations = observations_for(adventure)
+    return {
         "actions":["<no prior actions>"],
         "reasonings":["<no prior reasonings>"],
         "plans":["<no prior plans>"],
         "visited_tiles":[adventure.current_state],
-        "purpose":"to get ye flask.",
+        "purpose":purpose,
         "location_name":adventure.current_state.name,
-        "description":adventure.current_state.get_description(adventure.game_state),
+        "description":observations.description(),
+        "scope":observations.scope(),
         "result":"<game start>",
         "map":adventure.current_state.name,
-        "known_stuff":areas_to_known_stuff(adventure.game_state, [adventure.current_state]),
-        "command":None
+        "known_stuff":observations.known_stuff(),
+        "command":None,
+        "succeeded":True,
+        "plan_steps":0,
     }
 
+
+def play_episode(agent, adventure, max_attempts=100, verbose=True, timings=None):
+    """
+    Lets the agent play the adventure until it wins or runs out of attempts.
+
+    An agent that sends several commands at once has them run in one go, until one of them fails or moves to
+    another area, and is only asked for more after that.
+
+    Args:
+        timings (dict): If given, the seconds spent in the agent, the engine and updating the agent's state are
+            added to its 'agent', 'engine' and 'update' keys, and the commands run to its 'steps' key.
+
+    Returns:
+        tuple: Whether the agent won, how many commands it sent, and its final state.
+    """
+    agent_state = initial_agent_state(adventure)
+    clock = time.perf_counter
+
     attempts = 0
     while True:
 
+        start = clock()
         agent_state = agent.invoke(agent_state)
-        command = agent_state['command'].as_str()
-        print(command)
+        agent_done = clock()
+
+        commands, responses = run_agent_commands(agent_state, adventure, max_attempts - attempts, verbose)
+        engine_done = clock()
+        if timings is not None:
+            timings['agent'] = timings.get('agent', 0.0) + agent_done - start
+            timings['engine'] = timings.get('engine', 0.0) + engine_done - agent_done
+            timings['steps'] = timings.get('steps', 0) + len(responses)
+
+        attempts += len(responses)
+        done, won, agent_state = _after_commands(agent_state, adventure, commands, responses, attempts, max_attempts)
+        if done:
+            return won, attempts, agent_state
+
+        if timings is not None:
+            timings['update'] = timings.get('update', 0.0) + clock() - engine_done
+
+
+async def play_episode_async(agent, adventure, max_attempts=100):
+    """ Like `play_episode`, for an async agent, e.g. one made with `make_async_agent`. """
+    agent_state = initial_agent_state(adventure)
 
-        adventure_response = adventure.run_command(command)
-        if adventure_response == 'You have won the game!':
-            return adventure
+    attempts = 0
+    while True:
+
+        agent_state = await agent.ainvoke(agent_state)
+
+        commands, responses = run_agent_commands(agent_state, adventure, max_attempts - attempts)
+        attempts += len(responses)
+        done, won, agent_state = _after_commands(agent_state, adventure, commands, responses, attempts, max_attempts)
+        if done:
+            return won, attempts, agent_state
+
+
+def run_agent_commands(agent_state, adventure, limit, verbose=False):
+    """
+    Runs the commands the agent chose, stopping early after one that fails, wins or moves to another area.
+
+    Args:
+        limit (int): The most commands to run, i.e. the attempts the agent has left.
+
+    Returns:
+        tuple: The commands that were run and their responses.
+    """
+    commands = agent_commands(agent_state['command'])[:limit]
+    if verbose:
+        for command in commands:
+            print(command.as_str())
+    if len(commands) == 1:
+        responses = [adventure.run_command(commands[0].as_str())]
+    else:
+        responses = adventure.run_commands([command.as_str() for command in commands], stop_early=True)
+    return commands[:len(responses)], responses
+
+
+def _after_commands(agent_state, adventure, commands, responses, attempts, max_attempts):
+    """ Checks whether the episode is over, and if not, updates the agent's state with what the commands did. """
+    agent_state['actions'].extend(command.as_str() for command in commands[:-1])
+    won = responses[-1] == 'You have won the game!'
+    if won or attempts >= max_attempts:
+        # the last command is reported in the final state, as it never makes it into the actions
+        agent_state['command'] = commands[-1]
+        return True, won, agent_state
+
+    result = responses[-1]
+    if len(commands) > 1:
+        result = '\n'.join(f'> {command.as_str()}\n{response}' for command, response in zip(commands, responses))
+    agent_state = update_agent_state(agent_state, adventure, commands[-1].as_str(), result)
+    return False, False, agent_state
 
-        attempts += 1
-        if attempts == max_attempts:
-            break
 
-        agent_state = update_agent_state(agent_state, adventure, command, adventure_response)
+def main_loop(reason_model, plan_model, act_model, adventure_config, max_attempts=100, mode='chain', max_commands=1,
+              scoped=False):
+
+    adventure = TextAdventure(config=adventure_config)
+    response_format = define_structured_output(adventure.game_state.artifacts)
+    agent = make_agent_for_mode(reason_model, plan_model, act_model, response_format, mode, max_commands=max_commands,
+                                scoped=scoped)
+
+    won, _, agent_state = play_episode(agent, adventure, max_attempts)
+    if won:
+        return adventure
 
     return agent_state
 
+
+# --- Running many episodes across processes ---
+
+def openai_models(seed=None):
+    """ The default agent config: the OpenAI models in `agent.llms`. """
+    from agent.llms import reason_llm, plan_llm, act_llm
+    return reason_llm, plan_llm, act_llm
+
+
+def async_openai_models(seed=None):
+    """ The default agent config for `run_episodes_async`: the OpenAI models, sharing a rate limiter. """
+    from agent.llms import async_reason_llm, async_plan_llm, async_act_llm
+    return async_reason_llm, async_plan_llm, async_act_llm
+
+
+class Episode(NamedTuple):
+    """
+    An episode to run.
+
+    Attributes:
+        adventure (str): The path of the adventure to play.
+        agent (str or Callable): The agent config: a function, or the 'module:function' path of one, that is called
+            with the seed and returns the (reason, plan, act) models. Functions have to be picklable.
+        seed (int): The seed for the episode's random number generators.
+        max_attempts (int): The most commands the agent may send.
+        cache (str): The path of a response cache database to answer prompts seen before from, if any.
+        mode (str): How the agent gets to a command, one of `agent.agent.AGENT_MODES`.
+        max_commands (int): The most commands the agent may send at once.
+        scoped (bool): Whether commands may only name the objects in scope at each step.
+    """
+    adventure: str
+    agent: Union[str, Callable] = 'simulate:openai_models'
+    seed: int = 0
+    max_attempts: int = 100
+    cache: Optional[str] = None
+    mode: str = 'chain'
+    max_commands: int = 1
+    scoped: bool = False
+
+
+class EpisodeResult(NamedTuple):
+    episode: Episode
+    won: bool
+    steps: int
+    seconds: float
+    actions: list
+    error: Optional[str] = None
+
+
+# Each worker process keeps what is expensive to set up, so it is only done once per process
+_templates = {}
+_caches = {}
+_response_formats = {}
+
+
+def _init_worker(preload_spacy=True):
+    if preload_spacy:
+        from game import parser
+        if parser.USE_SPACY:
+            parser.get_nlp()
+
+
+def _load_adventure(path):
+    """ Loads an adventure once per process; every episode plays a fork of it. """
+    if path not in _templates:
+        template = TextAdventure(config=path)
+        _templates[path] = template
+        _response_formats[path] = define_structured_output(template.game_state.artifacts)
+    return _templates[path].fork(), _response_formats[path]
+
+
+def _cache(path):
+    if path not in _caches:
+        _caches[path] = ResponseCache(path)
+    return _caches[path]
+
+
+def _make_models(episode):
+    """ Makes the episode's models, answering the prompts they have seen before from its cache if it has one. """
+    models = _resolve_agent(episode.agent)(episode.seed)
+    if episode.cache:
+        # the same prompt can get different responses with different seeds
+        models = [CachedModel(model, _cache(episode.cache), namespace=f'seed={episode.seed}') for model in models]
+    return models
+
+
+def _resolve_agent(agent):
+    if callable(agent):
+        return agent
+    module_name, _, function_name = agent.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _episode_result(episode, start, won, steps, agent_state):
+    actions = agent_state['actions'][1:] + ([agent_state['command'].as_str()] if agent_state.get('command') else [])
+    return EpisodeResult(episode, won, steps, time.perf_counter() - start, actions)
+
+
+def run_episode(episode: Episode) -> EpisodeResult:
+    """ Runs one episode, in whichever process it is called in. Errors are reported in the result. """
+    start = time.perf_counter()
+    random.seed(episode.seed)
+    try:
+        adventure, response_format = _load_adventure(episode.adventure)
+        reason_model, plan_model, act_model = _make_models(episode)
+        agent = make_agent_for_mode(reason_model, plan_model, act_model, response_format, episode.mode,
+                                    max_commands=episode.max_commands, scoped=episode.scoped)
+        won, steps, agent_state = play_episode(agent, adventure, episode.max_attempts, verbose=False)
+        return _episode_result(episode, start, won, steps, agent_state)
+    except Exception:
+        return EpisodeResult(episode, False, 0, time.perf_counter() - start, [], traceback.format_exc())
+
+
+def run_episodes(episodes: Iterable[Episode], workers: Optional[int] = None, preload_spacy: bool = True,
+                 mp_context=None) -> Iterator[EpisodeResult]:
+    """
+    Runs episodes across a pool of worker processes, yielding their results as they complete.
+
+    Each worker loads spaCy and each adventure it is given only once, and plays every episode on a fork of the
+    adventure. An episode that fails doesn't stop the others; its result carries the error.
+
+    Args:
+        episodes (Iterable[Episode]): The episodes to run.
+        workers (int): The number of worker processes; by default one per CPU.
+        preload_spacy (bool): Whether workers load spaCy up front rather than on their first command that needs it.
+        mp_context: The multiprocessing context to start workers with, e.g. `multiprocessing.get_context('spawn')`.
+
+    Yields:
+        EpisodeResult: The result of each episode, in the order they complete.
+    """
+    episodes = list(episodes)
+    workers = min(workers or os.cpu_count() or 1, max(len(episodes), 1))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                             initializer=_init_worker, initargs=(preload_spacy,)) as executor:
+        futures = [executor.submit(run_episode, episode) for episode in episodes]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+async def run_episode_async(episode: Episode) -> EpisodeResult:
+    """ Runs one episode with an async agent. Errors are reported in the result. """
+    start = time.perf_counter()
+    try:
+        adventure, response_format = _load_adventure(episode.adventure)
+        reason_model, plan_model, act_model = _make_models(episode)
+        agent = make_agent_for_mode(reason_model, plan_model, act_model, response_format, episode.mode,
+                                    asynchronous=True, max_commands=episode.max_commands, scoped=episode.scoped)
+        won, steps, agent_state = await play_episode_async(agent, adventure, episode.max_attempts)
+        return _episode_result(episode, start, won, steps, agent_state)
+    except Exception:
+        return EpisodeResult(episode, False, 0, time.perf_counter() - start, [], traceback.format_exc())
+
+
+async def run_episodes_async(episodes: Iterable[Episode], concurrency: int = 32) -> AsyncIterator[EpisodeResult]:
+    """
+    Runs episodes concurrently on the running event loop, yielding their results as they complete.
+
+    Model calls are latency bound, so while one episode waits on a model the others carry on. The agent configs
+    have to return models with an `ainvoke`, e.g. `async_openai_models`, whose calls share a rate limiter.
+
+    Args:
+        episodes (Iterable[Episode]): The episodes to run.
+        concurrency (int): The most episodes in flight at once.
+
+    Yields:
+        EpisodeResult: The result of each episode, in the order they complete.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(episode):
+        async with semaphore:
+            return await run_episode_async(episode)
+
+    tasks = [asyncio.ensure_future(run(episode)) for episode in episodes]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the agent on every combination of adventure and seed, in parallel.')
+    parser.add_argument('adventures', nargs='+', help='the adventure files to play')
+    parser.add_argument('--agent', action='append', help="'module:function' returning the (reason, plan, act) models; may be repeated")
+    parser.add_argument('--policy', choices=['openai', 'random', 'stub', 'transcript'], default='openai',
+                        help='play with a local policy instead of the OpenAI models, e.g. to measure throughput offline')
+    parser.add_argument('--transcript', help='the transcript the transcript policy replays, one command per line')
+    parser.add_argument('--latency', type=float, default=0.0, help='how long every call to the stub policy takes, in seconds')
+    parser.add_argument('--mode', choices=AGENT_MODES, default='chain',
+                        help='chain reason, plan and act calls, fuse them into one call, or only chain them when replanning')
+    parser.add_argument('--max-commands', type=int, default=1,
+                        help='let the agent send up to this many commands at once, run until one fails or moves')
+    parser.add_argument('--scoped', action='store_true',
+                        help='narrow the objects commands may name to those in scope at each step')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--max-attempts', type=int, default=100)
+    parser.add_argument('--cache', default=None, help='a response cache database, so re-runs only pay for new prompts')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--concurrent', type=int, default=None,
+                        help='run this many episodes at once on one event loop instead of across processes')
+    args = parser.parse_args(argv)
+
+    default_agent = 'simulate:async_openai_models' if args.concurrent else Episode._field_defaults['agent']
+    if args.policy == 'random':
+        default_agent = 'agent.policies:random_models'
+    elif args.policy == 'stub':
+        default_agent = policies.latency_policy(args.latency)
+    elif args.policy == 'transcript':
+        if not args.transcript:
+            parser.error('the transcript policy needs --transcript')
+        default_agent = policies.transcript_policy(args.transcript, args.latency)
+
+    episodes = [
+        Episode(adventure, agent, seed, args.max_attempts, args.cache, args.mode, args.max_commands,
+                args.scoped)
+        for adventure in args.adventures
+        for agent in (args.agent or [default_agent])
+        for seed in args.seeds
+    ]
+
+    # one JSON line per episode, as soon as it finishes
+    def report(result):
+        print(json.dumps({
+            **result.episode._asdict(),
+            'won': result.won,
+            'steps': result.steps,
+            'seconds': round(result.seconds, 3),
+            'steps_per_second': round(result.steps / result.seconds, 1) if result.seconds else None,
+            'error': result.error,
+        }, default=str), flush=True)
+
+    if args.concurrent:
+        async def run_all():
+            async for result in run_episodes_async(episodes, args.concurrent):
+                report(result)
+        asyncio.run(run_all())
+        if args.cache:
+            # every episode ran in this process, so its cache saw every lookup
+            print(json.dumps({'cache': _cache(args.cache).stats}), file=sys.stderr)
+    else:
+        for result in run_episodes(episodes, args.workers):
+            report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+from agent.agent import define_command_list_output, define_step_output, should_replan
+from agent.policies import RandomCommandModel, StubModel, TranscriptModel
+from simulate import Episode, define_structured_output, run_episode
+from game.engine import TextAdventure
+
+response_format = define_structured_output(TextAdventure(config='./adventures/sample.json').game_state.artifacts)
+
+WALKTHROUGH = ['n', 'take box', 'open box', 'take key', 'w', 'use key on door', 'n', 'take golden flask']
+
+
+class CountingModel(StubModel):
+    calls = 0
+
+    def _respond(self, prompt):
+        CountingModel.calls += 1
+        return super()._respond(prompt)
+
+
+class CountingTranscriptModel(TranscriptModel):
+    calls = 0
+
+    def _respond(self, prompt):
+        CountingTranscriptModel.calls += 1
+        return super()._respond(prompt)
+
+
+def walkthrough_models(seed=None):
+    return CountingModel(), CountingModel(), TranscriptModel(WALKTHROUGH)
+
+
+def test_step_output():
+    step_format = define_step_output(response_format)
+    assert define_step_output(response_format) is step_format
+    assert set(step_format.model_fields) == {'rationale', 'plan', 'command'}
+
+    step = RandomCommandModel(seed=0).with_structured_output(step_format).invoke('what now?')
+    assert isinstance(step, step_format) and isinstance(step.command, response_format)
+
+
+def test_fused_agent_makes_one_call_per_step():
+    CountingModel.calls = 0
+    result = run_episode(Episode('./adventures/sample.json', walkthrough_models, mode='fused'))
+    assert result.error is None and result.won and result.steps == 8
+    # the reason and plan models are never called
+    assert CountingModel.calls == 0
+
+
+def test_adaptive_agent_replans_only_when_needed():
+    CountingModel.calls = 0
+    result = run_episode(Episode('./adventures/sample.json', walkthrough_models, mode='adaptive'))
+    assert result.error is None and result.won and result.steps == 8
+    # planned for the first step and again after five steps on that plan
+    assert CountingModel.calls == 2 * 2
+
+    state = {'plans': ['<no prior plans>', 'go north'], 'succeeded': True, 'plan_steps': 1}
+    assert not should_replan(state)
+    assert should_replan({**state, 'succeeded': False})
+    assert should_replan({**state, 'plan_steps': 5})
+    assert should_replan({**state, 'plans': ['<no prior plans>']})
+
+
+def test_command_lists():
+    command_list_format = define_command_list_output(response_format, 3)
+    commands = RandomCommandModel(seed=0).with_structured_output(command_list_format).invoke('what now?').commands
+    assert 1 <= len(commands) <= 3 and all(isinstance(command, response_format) for command in commands)
+
+    def models(seed=None):
+        return StubModel(), StubModel(), CountingTranscriptModel(WALKTHROUGH)
+
+    for mode in ('chain', 'fused'):
+        CountingTranscriptModel.calls = 0
+        result = run_episode(Episode('./adventures/sample.json', models, mode=mode, max_commands=3))
+        assert result.error is None and result.won and result.steps == 8
+        assert result.actions == WALKTHROUGH
+        # [n], [take box, open box, take key], [w], [use key on door, n], [take golden flask]
+        assert CountingTranscriptModel.calls == 5
+
+
+def test_scoped_structured_output():
+    from agent.agent import ScopedOutputModel
+    from agent.models import scoped_structured_output
+    from agent.observations import observations_for
+
+    adventure = TextAdventure(config='./adventures/sample.json')
+    # every game of an adventure shares its schema
+    assert define_structured_output(adventure.fork().game_state.artifacts) is response_format
+
+    observations = observations_for(adventure)
+    assert observations.scope() == ('Flask', 'Marking', 'Rune', 'n')
+    adventure.run_commands(['n', 'take box', 'open box'])
+    assert observations.scope() == ('Box', 'Key', 's', 'w')
+
+    narrowed = scoped_structured_output(observations.scope())
+    assert scoped_structured_output(['w', 's', 'Key', 'Box', 'Box']) is narrowed
+    assert {member.value for member in narrowed.model_fields['object'].annotation.__args__[0]} == {'Box', 'Key', 's', 'w'}
+    assert scoped_structured_output([], response_format) is response_format
+
+    model = ScopedOutputModel(RandomCommandModel(seed=0), response_format)
+    bound = model.for_state({'scope': observations.scope()})
+    assert bound is model.for_state({'scope': ('w', 's', 'Key', 'Box')}) and bound.schema is narrowed
+    assert model.for_state({}).schema is response_format
+    commands = [bound.invoke('what now?') for _ in range(50)]
+    objects = {command.object.value for command in commands if command.object} | {command.iobject.value for command in commands if command.iobject}
+    assert objects == {'Box', 'Key', 's', 'w'}
+
+
+def test_scoped_episode():
+    result = run_episode(Episode('./adventures/sample.json', walkthrough_models, scoped=True, max_commands=3))
+    assert result.error is None and result.won
@@ -0,0 +1,66 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from agent.cache import CachedModel, ResponseCache
+from game.engine import TextAdventure
+from simulate import define_structured_output
+
+prompt = ChatPromptTemplate.from_messages([("system", "You are in {place}.")])
+
+response_format = define_structured_output(TextAdventure(config='./adventures/sample.json').game_state.artifacts)
+
+
+class CountingModel:
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        return CountingModel(schema)
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.schema:
+            return self.schema(action='take', object='Box', iobject=None)
+        return AIMessage(content=f'response {self.calls}')
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+def test_cached_responses(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.db'))
+    model = CountingModel()
+    cached = CachedModel(model, cache)
+
+    first = cached.invoke(prompt.format_prompt(place='a dungeon'))
+    assert cached.invoke(prompt.format_prompt(place='a dungeon')).content == first.content
+    assert asyncio.run(cached.ainvoke(prompt.format_prompt(place='a dungeon'))).content == first.content
+    assert cached.invoke(prompt.format_prompt(place='a treasure room')).content != first.content
+    assert model.calls == 2
+    assert cache.stats['hits'] == 2 and cache.stats['misses'] == 2
+
+    # other seeds get their own responses
+    assert CachedModel(model, cache, namespace='seed=1').invoke(prompt.format_prompt(place='a dungeon')).content == 'response 3'
+
+    structured = CachedModel(CountingModel(), cache).with_structured_output(response_format)
+    command = structured.invoke(prompt.format_prompt(place='a dungeon'))
+    # a new process, with a new schema class, gets the cached structured output back
+    cache = ResponseCache(str(tmp_path / 'responses.db'))
+    model = CountingModel()
+    replayed = CachedModel(model, cache).with_structured_output(define_structured_output(TextAdventure(config='./adventures/sample.json').game_state.artifacts)).invoke(prompt.format_prompt(place='a dungeon'))
+    assert model.calls == 0
+    assert replayed.as_str() == command.as_str() == 'take Box'
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'responses.db'), max_bytes=250)
+    for i in range(3):
+        cache.put(f'key{i}', 'model', b'x' * 100)
+        cache.get('key0')
+    assert cache.get('key0') is not None
+    assert cache.get('key1') is None
+    assert cache.get('key2') is not None
+    assert cache.stats['bytes'] <= 250
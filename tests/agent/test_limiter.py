@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from agent.limiter import RateLimiter, RateLimitedModel
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_buckets():
+    clock = Clock()
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600, clock=clock)
+
+    async def acquire(count, tokens):
+        for _ in range(count):
+            await limiter.acquire(tokens)
+
+    asyncio.run(acquire(60, 1))
+    # the request bucket is empty, and refills at one a second
+    assert limiter._wait(1) == pytest.approx(1)
+    clock.now += 1
+    assert limiter._wait(1) <= 0
+    # the token bucket has 600 - 60 + 10 tokens in it
+    assert limiter._wait(600) == pytest.approx(5)
+
+    limiter.pause(30)
+    assert limiter._wait(1) == pytest.approx(30)
+
+
+class Flaky:
+    def __init__(self, failures, status_code=429):
+        self.failures = failures
+        self.status_code = status_code
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        if self.calls <= self.failures:
+            error = RuntimeError('slow down')
+            error.status_code = self.status_code
+            raise error
+        return 'ok'
+
+
+def test_retries_with_backoff():
+    limiter = RateLimiter(requests_per_minute=6000)
+
+    model = Flaky(failures=2)
+    assert asyncio.run(RateLimitedModel(model, limiter, base_delay=0.001).ainvoke('hi')) == 'ok'
+    assert model.calls == 3
+
+    model = Flaky(failures=5)
+    with pytest.raises(RuntimeError):
+        asyncio.run(RateLimitedModel(model, limiter, max_retries=2, base_delay=0.001).ainvoke('hi'))
+    assert model.calls == 3
+
+    # errors that won't go away are not retried
+    model = Flaky(failures=1, status_code=400)
+    with pytest.raises(RuntimeError):
+        asyncio.run(RateLimitedModel(model, limiter, base_delay=0.001).ainvoke('hi'))
+    assert model.calls == 1
+
+
+def test_limited_clients_leave_retrying_to_the_limiter(monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    from agent import llms
+
+    assert llms.reason_llm.max_retries == 2
+    for model in (llms.async_reason_llm, llms.async_plan_llm, llms.async_act_llm):
+        assert model.model.max_retries == 0
+        assert model.max_retries > 0
@@ -0,0 +1,36 @@
+from agent.observations import observations_for
+from agent.prompt import areas_to_known_stuff, create_tile_map
+from game.engine import TextAdventure
+
+template = TextAdventure(config='./adventures/sample.json')
+
+
+def test_observations_match_full_rebuild():
+    adventure = template.fork()
+    observations = observations_for(adventure)
+    assert observations_for(adventure) is observations
+
+    for command in ['n', 'take box', 'open box', 'take key', 'w', 'drop box', 'e', 'w', 'use key on door', 'n']:
+        adventure.run_command(command)
+        expected = (
+            create_tile_map(adventure.game_state.visited_tiles[0], adventure.game_state.visited_tiles),
+            areas_to_known_stuff(adventure.game_state, adventure.game_state.visited_tiles),
+            adventure.current_state.get_description(adventure.game_state),
+        )
+        assert (observations.map(), observations.known_stuff(), observations.description()) == expected
+
+
+def test_observations_only_redo_what_changed():
+    adventure = template.fork()
+    observations = observations_for(adventure)
+    adventure.run_commands(['n', 'w'])
+    known_stuff, description = observations.known_stuff(), observations.description()
+
+    # nothing changed, so nothing is rebuilt
+    adventure.run_command('look')
+    assert observations.known_stuff() is known_stuff
+    assert observations.description() is description
+
+    adventure.run_command('e')
+    adventure.run_command('take box')
+    assert 'Box' not in observations.known_stuff().splitlines()[1]
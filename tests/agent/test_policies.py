@@ -0,0 +1,31 @@
+from agent.policies import RandomCommandModel, latency_policy, read_transcript, transcript_policy
+from simulate import Episode, define_structured_output, run_episode
+from game.engine import TextAdventure
+
+response_format = define_structured_output(TextAdventure(config='./adventures/sample.json').game_state.artifacts)
+
+
+def test_random_commands_fit_the_schema():
+    model = RandomCommandModel(seed=0).with_structured_output(response_format)
+    commands = [model.invoke('what now?') for _ in range(50)]
+    assert all(isinstance(command, response_format) for command in commands)
+    assert len({command.as_str() for command in commands}) > 10
+
+    again = RandomCommandModel(seed=0).with_structured_output(response_format)
+    assert [again.invoke('what now?').as_str() for _ in range(50)] == [command.as_str() for command in commands]
+
+
+def test_transcript_policy(tmp_path):
+    path = tmp_path / 'walkthrough.txt'
+    path.write_text('# the quickest way through\nn\ntake box\nopen box\ntake key\nw\n\nuse key on door\nn\ntake golden flask\n')
+    assert read_transcript(str(path))[:2] == ['n', 'take box']
+
+    result = run_episode(Episode('./adventures/sample.json', transcript_policy(str(path))))
+    assert result.error is None and result.won and result.steps == 8
+
+
+def test_latency_policy():
+    result = run_episode(Episode('./adventures/sample.json', latency_policy(0.001), max_attempts=5))
+    # every step makes three model calls
+    assert result.error is None and result.steps == 5
+    assert result.seconds >= 5 * 3 * 0.001
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+from agent.prompt import TileMap, create_tile_map
+from game.engine import TextAdventure
+
+template = TextAdventure(config='./adventures/sample.json')
+
+
+def make_grid(width, height):
+    """ A grid of areas, each with exits to its neighbours, in the n, s, e, w order of `Area.exits`. """
+    areas = {(x, y): SimpleNamespace(id=f'{x},{y}', name=f'{x},{y}', exits=[]) for x in range(width) for y in range(height)}
+    for (x, y), area in areas.items():
+        area.exits = [areas.get((x, y - 1)), areas.get((x, y + 1)), areas.get((x + 1, y)), areas.get((x - 1, y))]
+    return areas
+
+
+def test_tile_map_follows_exit_directions():
+    adventure = template.fork()
+    adventure.run_commands(['n', 'w'])
+    dungeon_room, dungeon_room_2, door_room = adventure.game_state.visited_tiles
+
+    tile_map = TileMap(dungeon_room)
+    tile_map.extend(adventure.game_state.visited_tiles)
+    assert tile_map.positions == {dungeon_room.id: (0, 0), dungeon_room_2.id: (0, -1), door_room.id: (-1, -1)}
+    lines = tile_map.render().splitlines()
+    assert lines[1].split() == ['Door', 'Room', '──Dungeon', 'Room', '2']
+    assert lines[4].strip() == 'Dungeon Room'
+    assert tile_map.adjacency().splitlines() == [
+        'Dungeon Room: n Dungeon Room 2',
+        'Dungeon Room 2: s Dungeon Room, w Door Room',
+        'Door Room: n unexplored, e Dungeon Room 2',
+    ]
+
+
+def test_tile_map_of_a_large_grid():
+    areas = make_grid(60, 60)
+    rendered = create_tile_map(areas[(0, 0)], list(areas.values()))
+    # three lines per row, every cell padded to the longest name
+    assert len(rendered.split('\n')) == 180
+    assert rendered.splitlines()[1].startswith('  0,0 ── 1,0 ──')
+    assert rendered.split('\n')[-2].rstrip().endswith('─59,59')
+
+
+def test_extending_a_tile_map_matches_building_it_at_once():
+    areas = make_grid(8, 8)
+    # visit the grid snaking along its rows, as a player might
+    visited = [areas[(x if y % 2 == 0 else 7 - x, y)] for y in range(8) for x in range(8)]
+
+    incremental = TileMap()
+    for i in range(len(visited)):
+        incremental.extend(visited[i:i + 1])
+        assert incremental.render() == create_tile_map(visited[0], visited[:i + 1])
+
+
+def test_prompts_start_with_what_never_changes():
+    from agent.agent import format_act_prompt, format_plan_prompt, format_reason_prompt, format_step_prompt
+    from simulate import initial_agent_state, update_agent_state
+
+    adventure = template.fork()
+    first = initial_agent_state(adventure)
+    first.update(reasonings=first['reasonings'] + ['explore'], plans=first['plans'] + ['go north'])
+    adventure.run_command('n')
+    second = update_agent_state(dict(first, actions=list(first['actions'])), adventure, 'n', 'You went north.')
+    second.update(reasonings=second['reasonings'] + ['open things'], plans=second['plans'] + ['take the box'])
+
+    for format_prompt in (format_reason_prompt, format_plan_prompt, format_act_prompt, format_step_prompt):
+        before, after = format_prompt(first).to_messages(), format_prompt(second).to_messages()
+        assert before[0].content == after[0].content
+        # the last action, its result and the latest reasoning and plan all come last
+        for text in ('You went north.', 'open things'):
+            if text in ''.join(message.content for message in after):
+                assert text in after[-1].content
+
+
+def test_fit_prompt_to_budget():
+    from agent.agent import reason_prompt
+    from agent.prompt import PromptStats, count_tokens, fit_prompt
+
+    known_stuff = '\n'.join(f'Area Name: Room {i}. Area Description: {"dusty " * 20}. Things of Interest: []' for i in range(50))
+    fields = dict(purpose='to get ye flask', location_name='Room 3', description='A room.', last_action='look',
+                  result='x' * 2000, map='', known_stuff=known_stuff, last_plan='p' * 2000, last_rationale='r' * 2000)
+    stats = PromptStats()
+
+    full = fit_prompt(reason_prompt, 'reason', fields, budget=None, stats=stats)
+    assert fit_prompt(reason_prompt, 'reason', fields, budget=10 ** 6, stats=stats) == full
+
+    prompt = fit_prompt(reason_prompt, 'reason', fields, budget=1000, stats=stats).to_string()
+    assert count_tokens(prompt) <= 1000
+    # the current area is always kept, the ones visited longest ago go first
+    assert 'Area Name: Room 3.' in prompt and 'Area Name: Room 49.' in prompt and 'Area Name: Room 0.' not in prompt
+    assert 'areas visited longest ago left out' in prompt
+
+    assert stats.nodes['reason']['calls'] == 3 and stats.nodes['reason']['truncated'] == 1
+    assert stats.summary()['reason']['mean_tokens'] > 0
@@ -0,0 +1,67 @@
+import asyncio
+import multiprocessing
+
+from agent.limiter import RateLimiter, RateLimitedModel
+from agent.policies import StubModel, TranscriptModel, random_models
+from simulate import Episode, run_episode, run_episodes, run_episodes_async
+
+WALKTHROUGH = ['n', 'take box', 'open box', 'take key', 'w', 'use key on door', 'n', 'take golden flask']
+
+
+def walkthrough_models(seed, latency=0.0):
+    return StubModel(latency=latency), StubModel(latency=latency), TranscriptModel(WALKTHROUGH, latency)
+
+
+def lost_models(seed):
+    # with nothing to replay, it only ever looks around
+    return StubModel(), StubModel(), TranscriptModel([])
+
+
+def test_run_episode():
+    result = run_episode(Episode('./adventures/sample.json', walkthrough_models))
+    assert result.error is None
+    assert result.won
+    assert result.steps == len(WALKTHROUGH)
+    assert result.actions == WALKTHROUGH
+
+    result = run_episode(Episode('./adventures/sample.json', lost_models, max_attempts=3))
+    assert not result.won
+    assert result.steps == 3
+
+    result = run_episode(Episode('./adventures/missing.json', walkthrough_models))
+    assert result.error is not None
+
+
+def test_run_episode_random_commands():
+    # commands picked at random, e.g. `open` with nothing to open, fail without ending the episode
+    for seed in range(5):
+        result = run_episode(Episode('./adventures/sample.json', random_models, seed, max_attempts=50))
+        assert result.error is None
+        assert result.won or result.steps == 50
+
+
+def test_run_episodes():
+    episodes = [Episode('./adventures/sample.json', agent, seed) for agent in (walkthrough_models, lost_models) for seed in range(2)]
+    results = list(run_episodes(episodes, workers=2, preload_spacy=False, mp_context=multiprocessing.get_context('fork')))
+    assert sorted((result.episode.agent.__name__, result.episode.seed, result.won) for result in results) == [
+        ('lost_models', 0, False), ('lost_models', 1, False),
+        ('walkthrough_models', 0, True), ('walkthrough_models', 1, True),
+    ]
+
+limiter = RateLimiter(requests_per_minute=60000, tokens_per_minute=10 ** 8)
+
+def limited_walkthrough_models(seed):
+    return tuple(RateLimitedModel(model, limiter) for model in walkthrough_models(seed, latency=0.01))
+
+
+def test_run_episodes_async():
+    episodes = [Episode('./adventures/sample.json', limited_walkthrough_models, seed) for seed in range(20)]
+
+    async def run():
+        return [result async for result in run_episodes_async(episodes, concurrency=20)]
+
+    results = asyncio.run(run())
+    assert len(results) == 20
+    assert all(result.won and result.error is None for result in results)
+    # the episodes' model calls overlapped rather than running one after another
+    assert max(result.seconds for result in results) < 20 * len(WALKTHROUGH) * 3 * 0.01
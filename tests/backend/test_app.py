@@ -0,0 +1,158 @@
+# tests/backend/test_app.py
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from backend import app as backend
+
+WALKTHROUGH = ['n', 'take box', 'open box', 'take key', 'w', 'use key on door', 'n']
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(backend.app) as client:
+        yield client
+
+def new_session(client):
+    return client.post('/sessions').json()['session_id']
+
+def expected_responses(commands):
+    return backend.template.fork().run_commands(commands)
+
+def test_run_command_in_order(client):
+    session_id = new_session(client)
+    responses = [
+        client.get('/run_command', params={'command': command, 'session_id': session_id}).json()
+        for command in WALKTHROUGH
+    ]
+    assert responses == expected_responses(WALKTHROUGH)
+
+def test_run_command_unknown_session(client):
+    response = client.get('/run_command', params={'command': 'look', 'session_id': 'nobody'})
+    assert response.status_code == 404
+
+def test_run_command_concurrently(client):
+    session_ids = [new_session(client) for _ in range(8)]
+
+    def play(session_id):
+        return [
+            client.get('/run_command', params={'command': command, 'session_id': session_id}).json()
+            for command in WALKTHROUGH
+        ]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(play, session_ids))
+    assert results == [expected_responses(WALKTHROUGH)] * len(session_ids)
+
+    # commands sent at once to the same session take turns, so only one of them gets the box
+    shared = new_session(client)
+    client.get('/run_command', params={'command': 'n', 'session_id': shared})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(
+            lambda command: client.get('/run_command', params={'command': command, 'session_id': shared}).json(),
+            ['take box'] * 8,
+        ))
+    assert responses.count('You took the Box') == 1
+    assert backend.sessions.get(shared).adventure.game_state.inventory == ['box']
+
+def test_websocket_in_order(client):
+    session_id = new_session(client)
+    with client.websocket_connect(f'/ws/{session_id}') as websocket:
+        responses = []
+        for command in WALKTHROUGH:
+            websocket.send_text(command)
+            responses.append(websocket.receive_text())
+    assert responses == expected_responses(WALKTHROUGH)
+
+def test_websocket_unknown_session(client):
+    with pytest.raises(WebSocketDisconnect) as disconnect:
+        with client.websocket_connect('/ws/nobody') as websocket:
+            websocket.receive_text()
+    assert disconnect.value.code == 4404
+
+def test_websocket_session_deleted(client):
+    session_id = new_session(client)
+    with client.websocket_connect(f'/ws/{session_id}') as websocket:
+        websocket.send_text('look')
+        websocket.receive_text()
+        client.delete(f'/sessions/{session_id}')
+        websocket.send_text('look')
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            websocket.receive_text()
+    assert disconnect.value.code == 4404
+
+def test_websocket_survives_errors(client, monkeypatch):
+    session_id = new_session(client)
+    adventure = backend.sessions.get(session_id).adventure
+    run_command = adventure.run_command
+
+    def failing(command):
+        if command == 'xyzzy':
+            raise RuntimeError('boom')
+        return run_command(command)
+
+    monkeypatch.setattr(adventure, 'run_command', failing)
+    with client.websocket_connect(f'/ws/{session_id}') as websocket:
+        websocket.send_text('xyzzy')
+        assert websocket.receive_text() == 'Error: boom'
+        websocket.send_text('n')
+        assert websocket.receive_text() == expected_responses(['n'])[0]
+
+def test_batch_in_order_across_sessions(client):
+    first, second = new_session(client), new_session(client)
+    commands = [{'session_id': session_id, 'command': command} for command in WALKTHROUGH for session_id in (first, second)]
+    results = client.post('/batch', json=commands).json()
+
+    assert [(result['session_id'], result['command']) for result in results] == [
+        (item['session_id'], item['command']) for item in commands
+    ]
+    for session_id in (first, second):
+        responses = [result['response'] for result in results if result['session_id'] == session_id]
+        assert responses == expected_responses(WALKTHROUGH)
+    assert all(result['error'] is None for result in results)
+
+def test_batch_unknown_session(client):
+    session_id = new_session(client)
+    results = client.post('/batch', json=[
+        {'session_id': session_id, 'command': 'n'},
+        {'session_id': 'nobody', 'command': 'n'},
+    ]).json()
+
+    # the known session's command still runs, and says so
+    assert results[0]['response'] == expected_responses(['n'])[0]
+    assert results[1]['response'] is None
+    assert results[1]['error'] == 'No session nobody'
+    assert backend.sessions.get(session_id).adventure.current_state.id == 'dr2'
+
+def test_batch_engine_error(client, monkeypatch):
+    failing_id, other_id = new_session(client), new_session(client)
+    adventure = backend.sessions.get(failing_id).adventure
+    run_commands = adventure.run_commands
+
+    def failing(commands, **kwargs):
+        if commands == ['xyzzy']:
+            raise RuntimeError('boom')
+        return run_commands(commands, **kwargs)
+
+    monkeypatch.setattr(adventure, 'run_commands', failing)
+    results = client.post('/batch', json=[
+        {'session_id': failing_id, 'command': 'n'},
+        {'session_id': other_id, 'command': 'n'},
+        {'session_id': failing_id, 'command': 'xyzzy'},
+        {'session_id': failing_id, 'command': 'take box'},
+    ]).json()
+
+    assert [result['error'] is None for result in results] == [True, True, False, False]
+    assert results[2]['error'] == 'Error: boom'
+    assert results[3]['error'].startswith('Not run')
+    # what was applied is exactly what has a response
+    assert adventure.current_state.id == 'dr2'
+    assert adventure.game_state.inventory == []
+    assert backend.sessions.get(other_id).adventure.current_state.id == 'dr2'
+
+def test_invalid_session_ids(client):
+    assert client.get('/run_command', params={'command': 'look', 'session_id': '../x'}).status_code == 404
+    assert client.delete('/sessions/..%2Fx').status_code == 404
+    results = client.post('/batch', json=[{'session_id': '../x', 'command': 'look'}]).json()
+    assert results[0]['error'] == 'No session ../x'
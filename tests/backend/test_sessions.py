@@ -0,0 +1,114 @@
+# tests/backend/test_sessions.py
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from game.engine import TextAdventure
+from backend.sessions import SessionStore
+
+@pytest.fixture(scope='module')
+def template():
+    return TextAdventure(config='./adventures/sample.json')
+
+def test_sessions_are_independent(template):
+    sessions = SessionStore(template)
+    first, second = sessions.create(), sessions.create()
+    first.adventure.run_command('n')
+    assert first.adventure.current_state.id == 'dr2'
+    assert second.adventure.current_state.id == 'dr1'
+    assert template.current_state.id == 'dr1'
+
+def test_sessions_delete(template):
+    sessions = SessionStore(template)
+    session = sessions.create()
+    assert sessions.get(session.id) is session
+    assert sessions.delete(session.id)
+    assert sessions.get(session.id) is None
+    assert not sessions.delete(session.id)
+
+def test_sessions_evict_least_recently_used(template):
+    sessions = SessionStore(template, max_sessions=2)
+    first, second = sessions.create('first'), sessions.create('second')
+    sessions.get('first')
+    sessions.create('third')
+    assert len(sessions) == 2
+    assert 'second' not in sessions
+    assert 'first' in sessions
+
+def test_sessions_busy_sessions_not_evicted(template):
+    sessions = SessionStore(template, max_sessions=1)
+    first = sessions.create('first')
+    with first.lock:
+        sessions.create('second')
+        assert 'first' in sessions
+
+def test_sessions_memory_cap(template):
+    # tracemalloc measures a fork slightly differently from one run to the next, so allow some slack
+    sessions = SessionStore(template, max_memory_mb=sessions_mb(template, 3))
+    assert 2 <= sessions.max_sessions <= 4
+    assert SessionStore(template, max_memory_mb=0).max_sessions == 1
+
+def sessions_mb(template, count):
+    return SessionStore(template).session_bytes * count / (1024 * 1024)
+
+def test_sessions_restored_from_journal(template, tmp_path):
+    sessions = SessionStore(template, max_sessions=1, journal_dir=str(tmp_path))
+    first = sessions.create('first')
+    first.adventure.run_commands(['n', 'take box'])
+    sessions.create('second')
+    assert 'first' not in sessions
+
+    restored = sessions.get('first')
+    assert restored.adventure.current_state.id == 'dr2'
+    assert restored.adventure.game_state.inventory == ['box']
+    assert sessions.delete('first')
+    assert sessions.get('first') is None
+
+def test_sessions_parked_when_evicted(template):
+    sessions = SessionStore(template, max_sessions=1)
+    first = sessions.create('first')
+    first.adventure.run_commands(['n', 'take box', 'open box'])
+    sessions.create('second')
+    assert 'first' not in sessions
+
+    loaded = sessions.get('first')
+    assert loaded.adventure.current_state.id == 'dr2'
+    assert loaded.adventure.game_state.inventory == ['box']
+    assert loaded.adventure.run_command('take key') == 'You took the Key'
+
+def test_sessions_reject_invalid_ids(template, tmp_path):
+    journal_dir = tmp_path / 'journals'
+    outside = tmp_path / 'outside.journal'
+    outside.write_bytes(b'not a journal')
+    sessions = SessionStore(template, journal_dir=str(journal_dir))
+
+    for session_id in ['../outside', '..', 'a/b', '', 'x' * 65]:
+        assert sessions.get(session_id) is None
+        assert not sessions.delete(session_id)
+        with pytest.raises(ValueError):
+            sessions.create(session_id)
+    # nothing outside the journal directory was read or deleted
+    assert outside.read_bytes() == b'not a journal'
+    assert sessions.create('Valid_id-1').id == 'Valid_id-1'
+
+def test_sessions_pinned_while_used(template):
+    sessions = SessionStore(template, max_sessions=1)
+    sessions.create('first')
+    with sessions.use('first') as first:
+        # a session in use isn't parked, even before it runs anything
+        sessions.create('second')
+        assert 'first' in sessions
+        first.adventure.run_command('n')
+    # once it is no longer used it can be, and nothing it ran is lost
+    assert 'first' not in sessions
+    assert sessions.get('first').adventure.current_state.id == 'dr2'
+
+    with sessions.use('nobody') as session:
+        assert session is None
+    with sessions.use('third', create=True) as third:
+        assert sessions.get('third') is third
+
+def test_sessions_get_or_create_once(template):
+    sessions = SessionStore(template)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        created = list(pool.map(lambda _: sessions.get_or_create('shared'), range(8)))
+    assert all(session is created[0] for session in created)
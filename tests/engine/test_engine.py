@@ -1,3 +1,4 @@
+import json
 import pytest
 from unittest.mock import MagicMock
 from game.models import GameState, HandleActionResponse
@@ -214,4 +215,128 @@ def run_command_quit_game(text_adventure, mock_tile):
     command = 'quit'
     mock_tile.handle_action.return_value.events = {'quit_game': True}
     response = text_adventure.run_command(command)
-    assert response == 'You have won the game!'
\ No newline at end of file
+    assert response == 'You have won the game!'
+
+
+def test_run_commands():
+    commands = ['look', 'n', 'take box', 'look box', 'inventory', 'xyzzy']
+    expected = TextAdventure(config='./adventures/sample.json')
+    expected_responses = [expected.run_command(command) for command in commands]
+
+    batched = TextAdventure(config='./adventures/sample.json')
+    assert batched.run_commands(commands) == expected_responses
+
+    timed = TextAdventure(config='./adventures/sample.json').run_commands(commands, timed=True)
+    assert [response for response, _ in timed] == expected_responses
+    assert all(seconds >= 0 for _, seconds in timed)
+
+
+def test_run_commands_stop_early():
+    game = TextAdventure(config='./adventures/sample.json')
+    # stops after moving
+    assert len(game.run_commands(['look', 'n', 'take box'], stop_early=True)) == 2
+    # stops after failing
+    assert game.run_commands(['take box', 'n', 'open box'], stop_early=True) == ['You took the Box', "You can't go that way."]
+    assert game.game_state.inventory == ['box']
+
+
+def test_succeeded():
+    game = TextAdventure(config='./adventures/sample.json')
+    for command, succeeded in [('n', True), ('n', False), ('xyzzy', False), ('take box', True), ('inventory', True), ('take box', False)]:
+        game.run_command(command)
+        assert game.succeeded is succeeded, command
+
+
+def test_commands_missing_objects():
+    game = TextAdventure(config='./adventures/sample.json')
+    for command in ('open', 'take', 'drop', 'use', 'put', 'light'):
+        assert game.run_command(command) == f'What do you want to {command}?'
+        assert game.succeeded is False
+    # acting on a fixture inside another fixture fails like anything else, rather than crashing
+    assert game.run_command('open rune') == "You can't do that here."
+    game.run_commands(['n', 'take box'])
+    assert game.run_command('use box') == 'What do you want to use the Box on?'
+    assert game.run_command('look') == 'Ye find yeself a little farther into yon dungeon.  Exits are WEST, and SOUTH.'
+
+
+def test_available_commands():
+    game = TextAdventure(config='./adventures/sample.json')
+    assert game.available_commands() == {'help', 'inventory', 'look', 'look flask', 'look marking', 'look rune', 'n'}
+    # nothing changed, so nothing is enumerated again
+    game.run_command('look')
+    assert game.available_commands() is game.available_commands()
+
+    for command in ['n', 'take box', 'open box', 'take key', 'w', 'drop box', 'e', 'w', 'use key on door', 'n']:
+        game.run_command(command)
+        commands = game.available_commands()
+        # keeping the commands up to date gives the same as enumerating them afresh, as a fork does
+        assert game.fork().available_commands() == commands, command
+        # every command listed does something
+        for available in commands:
+            fork = game.fork()
+            fork.run_command(available)
+            assert fork.succeeded, (command, available)
+
+    assert 'take golden flask' in commands
+    assert 's' not in commands
+
+
+def test_available_commands_drop_fired_interactions():
+    with open('./adventures/sample.json') as f:
+        config = json.load(f)
+    config['game_state']['interactions']['open__box']['is_repeatable'] = False
+    game = TextAdventure(config=config)
+    game.run_commands(['n', 'take box'])
+    assert {'open box', 'take box'} & game.available_commands() == {'open box'}
+
+    game.run_command('open box')
+    commands = game.available_commands()
+    assert 'open box' not in commands
+    assert {'close box', 'take key'} <= commands
+
+
+def test_fork():
+    original = TextAdventure(config='./adventures/sample.json')
+    original.run_commands(['n', 'take box', 'open box'])
+
+    fork = original.fork()
+    assert fork.current_state is not original.current_state
+    assert fork.current_state.id == 'dr2'
+    assert fork.game_state.inventory == ['box']
+    # references to other artifacts point into the fork
+    assert fork.current_state.exits[3] is fork.game_state.artifacts['dr3']
+    assert fork.game_state.artifacts['key'].container is fork.game_state.artifacts['box']
+    assert fork.game_state.artifacts['dr1'].name == original.game_state.artifacts['dr1'].name
+
+    assert fork.run_commands(['take key', 'w', 'use key on door', 'n']) == [
+        'You took the Key',
+        'Ye find yeself in yet another room To the NORTH there is a closed DOOR. Exits are EAST, and NORTH.',
+        'You unlock the door with the key.',
+        "Ye find yeself in the treasure room. There is a PLACQUE on the wall. Ye see a PEDASTEL. I could tell you the exits, but you don't really want to go backwards do you? There's nothing for you there. Oh, fine, whatever. Exits are SOUTH.",
+    ]
+
+    # the original is untouched
+    assert original.current_state.id == 'dr2'
+    assert original.game_state.inventory == ['box']
+    assert not original.game_state.events.get('open_ze_door')
+    assert not original.game_state.artifacts['tr'].is_accessible
+    assert original.run_command('take key') == 'You took the Key'
+
+
+def test_compiled_adventure(tmp_path):
+    path = tmp_path / 'sample.json'
+    path.write_text(open('./adventures/sample.json').read())
+    compiled = TextAdventure.compile(str(path))
+    assert compiled == str(tmp_path / 'sample.compiled')
+
+    from game import compiler
+    assert compiler.read_compiled(compiled) is not None
+    adventure = TextAdventure(config=str(path))
+    assert adventure.current_state.id == 'dr1'
+    assert adventure.current_state.exits[0] is adventure.game_state.artifacts['dr2']
+    assert adventure.run_commands(['n', 'take box', 'inventory']) == ['Ye find yeself a little farther into yon dungeon. Ye see a BOX. Exits are WEST, and SOUTH.', 'You took the Box', 'You have:\nBox\n']
+
+    # the compiled adventure is ignored once the JSON changes
+    path.write_text(open('./adventures/sample.json').read().replace('"dr1"', '"dr1" ', 1))
+    assert compiler.read_compiled(compiled, compiler.source_digest(path.read_bytes())) is None
+    assert TextAdventure(config=str(path)).current_state.id == 'dr1'
@@ -0,0 +1,71 @@
+import pytest
+from game.engine import TextAdventure
+from game.journal import CommandJournal
+
+template = TextAdventure(config='./adventures/sample.json')
+
+commands = ['n', 'take box', 'open box', 'take key', 'w', 'use key on door']
+
+def test_restore_from_journal(tmp_path):
+    game = template.fork()
+    game.attach_journal(CommandJournal(str(tmp_path), 'game', snapshot_interval=4))
+    responses = game.run_commands(commands)
+    game.journal.close()
+
+    journal = CommandJournal(str(tmp_path), 'game', snapshot_interval=4)
+    snapshot, entries = journal.read()
+    # the first four commands are in the snapshot, only the rest are replayed
+    assert snapshot.seq == 4
+    assert [entry.command for entry in entries] == ['w', 'use key on door']
+    assert [entry.response for entry in entries] == responses[4:]
+    assert entries[1].delta['events'] == {'open_ze_door': True}
+
+    restored = template.restore(journal)
+    assert restored.current_state.id == game.current_state.id
+    assert restored.game_state.inventory == game.game_state.inventory
+    assert restored.game_state.events == game.game_state.events
+    assert restored.run_command('n') == game.fork().run_command('n')
+    restored.journal.close()
+    assert CommandJournal(str(tmp_path), 'game').read()[1][-1].seq == 7
+
+def test_truncated_journal(tmp_path):
+    game = template.fork()
+    game.attach_journal(CommandJournal(str(tmp_path), 'game'))
+    game.run_commands(commands[:3])
+    game.journal.close()
+
+    # a crash part way through writing an entry loses only that entry
+    journal = CommandJournal(str(tmp_path), 'game')
+    with open(journal.journal_path, 'rb+') as f:
+        f.truncate(f.seek(0, 2) - 5)
+    snapshot, entries = journal.read()
+    assert snapshot is None
+    assert [entry.command for entry in entries] == commands[:2]
+
+    restored = template.restore(journal)
+    assert restored.game_state.inventory == ['box']
+    assert not restored.game_state.artifacts['box'].is_open
+
+def test_replay_checked_against_deltas(tmp_path, monkeypatch):
+    game = template.fork()
+    game.attach_journal(CommandJournal(str(tmp_path), 'game'))
+    game.run_commands(commands)
+    game.journal.close()
+
+    warnings = []
+    monkeypatch.setattr('game.engine.logger.warning', warnings.append)
+    template.restore(CommandJournal(str(tmp_path), 'game')).journal.close()
+    assert warnings == []
+
+    # an entry whose changes the replay doesn't reproduce is reported
+    _, entries = CommandJournal(str(tmp_path), 'game').read()
+    replayed = template.fork()
+    replayed.run_commands(commands[:2])
+    assert entries[1].differences(replayed) == []
+    wrong = entries[1]._replace(delta={'events': {'open_ze_door': True}, 'inventory': [], 'area': 'dr1'})
+    assert wrong.differences(replayed) == ['event open_ze_door', 'inventory', 'area']
+
+def test_journal_stays_in_its_directory(tmp_path):
+    for session_id in ['../game', '..', 'a/b', '']:
+        with pytest.raises(ValueError):
+            CommandJournal(str(tmp_path), session_id)
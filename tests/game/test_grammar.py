@@ -0,0 +1,35 @@
+# tests/game/test_grammar.py
+import pytest
+from game.grammar import CommandGrammar, tokenize
+
+@pytest.fixture
+def grammar():
+    return CommandGrammar(['Key', 'Door', 'Golden Flask', 'Box of Rocks', 'Troll'])
+
+def test_tokenize():
+    assert tokenize('Take the KEY.') == ['take', 'the', 'key']
+
+@pytest.mark.parametrize('command, expected', [
+    ('look', ('look', '', '')),
+    ('take Golden Flask', ('take', 'golden flask', '')),
+    ('go s', ('go', 's', '')),
+    ('use key on door', ('use', 'key', 'door')),
+    ('look box of rocks', ('look', 'box of rocks', '')),
+    ('use key with box of rocks', ('use', 'key', 'box of rocks')),
+    ('take lamp', ('take', 'lamp', '')),
+])
+def test_grammar_parse(grammar, command, expected):
+    assert grammar.parse(command) == expected
+
+@pytest.mark.parametrize('command', [
+    'use troll key',  # double object construction
+    'turn on key',  # nothing before the preposition
+    'put key in box on door',  # more than one way to split it
+    'xyzzy',  # not a verb
+])
+def test_grammar_ambiguous(grammar, command):
+    assert grammar.parse(command) is None
+
+def test_grammar_best_effort(grammar):
+    assert grammar.parse('use troll key', best_effort=True) == ('use', 'key', 'troll')
+    assert grammar.parse('put key in box on door', best_effort=True) == ('put', 'key', 'box on door')
@@ -44,4 +44,30 @@ def test_obs_properties_initialization():
 
 def test_tile_properties_initialization():
     tile_properties = AreaProperties()
-    assert tile_properties.is_accessible is True
\ No newline at end of file
+    assert tile_properties.is_accessible is True
+
+
+def test_game_state_trigger_index():
+    from game.core.item import Item
+    key = Item.model_validate({
+        'id': 'key',
+        'name': 'Key',
+        'description_': {'start': 'A key.', 'triggers': {'polish__True': {'start': 'A shiny key.'}}},
+        'properties': {'is_visible': False},
+        'triggers': {'reveal__True': {'is_visible': True}},
+    })
+    rock = Item.model_validate({'id': 'rock', 'name': 'Rock', 'description_': {'start': 'A rock.'}})
+    game_state = GameState(artifacts={'key': key, 'rock': rock})
+    game_state.index_triggers()
+
+    game_state.event_log = {'reveal': True}
+    assert key.is_visible
+    assert game_state.trigger_applications == 1
+
+    # unchanged events and events nobody listens for are not dispatched
+    game_state.event_log = {'reveal': True, 'unheard': True}
+    assert game_state.trigger_applications == 1
+
+    game_state.event_log = {'polish': True}
+    assert key.description_.start == 'A shiny key.'
+    assert game_state.trigger_applications == 2
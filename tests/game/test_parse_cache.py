@@ -0,0 +1,91 @@
+# tests/game/test_parse_cache.py
+from game.parse_cache import ParseCache, normalize_command
+
+def test_normalize_command():
+    assert normalize_command('  Take   Golden Flask ') == 'take golden flask'
+
+def test_parse_cache_hits_and_misses():
+    cache = ParseCache()
+    assert cache.get('take key') is None
+    cache.put('take key', ('take', 'key', ''))
+    assert cache.get('take key') == ('take', 'key', '')
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 1
+
+def test_parse_cache_lru_eviction():
+    cache = ParseCache(maxsize=2)
+    cache.put('look', ('look', '', ''))
+    cache.put('n', ('n', '', ''))
+    cache.get('look')
+    cache.put('s', ('s', '', ''))
+    assert len(cache) == 2
+    assert cache.get('n') is None
+    assert cache.get('look') == ('look', '', '')
+
+def test_parse_cache_database(tmp_path):
+    path = str(tmp_path / 'parses.db')
+    cache = ParseCache(path=path)
+    cache.put('use key on door', ('use', 'key', 'door'))
+    cache.close()
+
+    cache = ParseCache(path=path)
+    assert cache.get('use key on door') == ('use', 'key', 'door')
+    assert cache.disk_hits == 1
+    # it is in memory now
+    assert cache.get('use key on door') == ('use', 'key', 'door')
+    assert cache.disk_hits == 1
+    cache.close()
+
+class Token:
+    def __init__(self, i, text):
+        self.i, self.text, self.pos_, self.dep_ = i, text, 'NOUN', ''
+
+class RecordingNLP:
+    """ Stands in for the spaCy pipeline, recording the texts it is given. """
+
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, text):
+        self.texts.append(text)
+        return [Token(i, word) for i, word in enumerate(text.split())]
+
+    def pipe(self, texts, batch_size=None):
+        return [self(text) for text in texts]
+
+def test_spacy_gets_commands_as_typed(monkeypatch):
+    from game import parser
+    nlp = RecordingNLP()
+    monkeypatch.setattr(parser, 'get_nlp', lambda: nlp)
+    monkeypatch.setattr(parser, 'parse_cache', ParseCache())
+
+    assert parser.parse_command('Take  Golden Flask') == ('Take', 'Golden Flask', '')
+    # the normalized command is only the cache key
+    assert parser.parse_command('take golden flask') == ('Take', 'Golden Flask', '')
+    assert parser.parse_commands(['Open The Box', 'open the box', 'Look']) == [
+        ('Open', 'The Box', ''), ('Open', 'The Box', ''), ('Look', '', ''),
+    ]
+    assert nlp.texts == ['Take  Golden Flask', 'Open The Box', 'Look']
+
+def test_spacy_loaded_once_across_threads(monkeypatch):
+    import sys
+    import threading
+    import time
+    import types
+    from game import parser
+
+    loads = []
+
+    def load(exclude=None):
+        loads.append(exclude)
+        time.sleep(0.05)
+        return RecordingNLP()
+
+    monkeypatch.setitem(sys.modules, 'en_core_web_sm', types.SimpleNamespace(load=load))
+    monkeypatch.setattr(parser, '_nlp', None)
+    threads = [threading.Thread(target=parser.get_nlp) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from game.engine import TextAdventure
+
+template = TextAdventure(config='./adventures/sample.json')
+
+def test_save_and_load():
+    game = template.fork()
+    game.run_commands(['look flask', 'look marking', 'look rune', 'n', 'take box', 'open box', 'take key', 'w', 'use key on door'])
+
+    save = template.save(game)
+    assert len(save) < 300
+    loaded = template.load(save)
+
+    assert loaded.current_state.id == 'dr3'
+    assert [tile.id for tile in loaded.game_state.visited_tiles] == [tile.id for tile in game.game_state.visited_tiles]
+    assert loaded.game_state.inventory == ['box', 'key']
+    assert loaded.game_state.events == game.game_state.events
+    for artifact_id, artifact in game.game_state.artifacts.items():
+        other = loaded.game_state.artifacts[artifact_id]
+        assert other.properties == artifact.properties
+        assert other.items == artifact.items and other.fixtures == artifact.fixtures
+        assert other.description_.start == artifact.description_.start
+        assert getattr(other.container, 'id', None) == getattr(artifact.container, 'id', None)
+        assert getattr(other, 'interactions', None) == getattr(artifact, 'interactions', None)
+
+    assert loaded.run_command('n') == game.fork().run_command('n')
+    # loading doesn't touch the adventure
+    assert template.current_state.id == 'dr1'
+    assert template.save(template.fork()) != save
+
+def test_load_rejects_other_adventures():
+    with pytest.raises(ValueError):
+        template.load(b'not a save')
+    save = bytearray(template.save(template.fork()))
+    save[5] ^= 1
+    with pytest.raises(ValueError):
+        template.load(bytes(save))
+
+
+def test_save_keeps_fields_set_by_triggers():
+    with open('./adventures/sample.json') as f:
+        config = json.load(f)
+    box = next(artifact for artifact in config['artifacts'] if artifact['id'] == 'box')
+    box['triggers'] = {'make_key_accessible__True': {
+        'container_description': 'Ye see an open BOX.',
+        'display_order': ['key'],
+    }}
+    adventure = TextAdventure(config=config)
+    game = adventure.fork()
+    game.run_commands(['n', 'open box'])
+    assert game.game_state.artifacts['box'].container_description == 'Ye see an open BOX.'
+
+    loaded = adventure.load(adventure.save(game))
+    box = loaded.game_state.artifacts['box']
+    assert box.container_description == 'Ye see an open BOX.'
+    assert box.display_order == ['key']
+    assert loaded.run_command('look') == game.run_command('look')
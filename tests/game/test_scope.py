@@ -0,0 +1,108 @@
+# tests/game/test_scope.py
+import pytest
+from game.models import GameState
+from game.core.area import Area
+from game.core.fixture import Fixture
+from game.core.item import Item
+from game.scope import ScopeIndex
+
+@pytest.fixture
+def game_state():
+    artifacts = [
+        Area.model_validate({
+            'id': 'hall',
+            'name': 'Hall',
+            'description_': {'start': 'A hall.'},
+            'fixtures_': ['table'],
+            'items_': ['bag'],
+        }),
+        Area.model_validate({
+            'id': 'cellar',
+            'name': 'Cellar',
+            'description_': {'start': 'A cellar.'},
+            'items_': ['coin'],
+        }),
+        Fixture.model_validate({
+            'id': 'table',
+            'name': 'Table',
+            'description_': {'start': 'A table.'},
+            'fixtures_': ['drawer'],
+        }),
+        Fixture.model_validate({
+            'id': 'drawer',
+            'name': 'Drawer',
+            'description_': {'start': 'A drawer.'},
+            'items_': ['hidden_coin'],
+        }),
+        Item.model_validate({
+            'id': 'hidden_coin',
+            'name': 'Coin',
+            'description_': {'start': 'A coin.'},
+            'properties': {'is_visible': False},
+        }),
+        Item.model_validate({
+            'id': 'coin',
+            'name': 'Coin',
+            'description_': {'start': 'A coin.'},
+        }),
+        Item.model_validate({
+            'id': 'bag',
+            'name': 'Bag',
+            'description_': {'start': 'A bag.'},
+        }),
+    ]
+    game_state = GameState()
+    game_state.artifacts = {artifact.id: artifact for artifact in artifacts}
+    for artifact in artifacts:
+        artifact._assign_container(game_state)
+    return game_state
+
+def test_scope_nested_resolution(game_state):
+    scope = ScopeIndex(game_state)
+    hall = game_state.artifacts['hall']
+    assert scope.resolve('DRAWER', hall).id == 'drawer'
+    assert scope.resolve('drawer', game_state.artifacts['cellar']) is None
+    # the area itself is not in scope, only what is in it
+    assert scope.resolve('hall', hall) is None
+
+def test_scope_respects_visibility(game_state):
+    scope = ScopeIndex(game_state)
+    hall = game_state.artifacts['hall']
+    assert scope.resolve('coin', hall) is None
+    game_state.artifacts['hidden_coin'].is_visible = True
+    assert scope.resolve('coin', hall).id == 'hidden_coin'
+    assert scope.resolve('coin', game_state.artifacts['cellar']).id == 'coin'
+
+def test_scope_follows_moves(game_state):
+    scope = ScopeIndex(game_state)
+    hall = game_state.artifacts['hall']
+    cellar = game_state.artifacts['cellar']
+    bag = game_state.artifacts['bag']
+
+    # take the bag
+    hall.items = []
+    game_state.inventory.append('bag')
+    assert bag.container is None
+    assert scope.resolve('bag', cellar) is bag
+
+    # put the coin in it
+    cellar.items = []
+    bag.items = ['coin']
+    assert scope.resolve('coin', hall).id == 'coin'
+
+    # and drop the bag in the cellar
+    game_state.inventory.remove('bag')
+    cellar.items = ['bag']
+    assert scope.resolve('coin', hall) is None
+    assert scope.resolve('coin', cellar).container is bag
+
+def test_scope_lists_what_is_in_scope(game_state):
+    scope = ScopeIndex(game_state)
+    hall = game_state.artifacts['hall']
+    assert [artifact.id for artifact in scope.in_scope(hall)] == ['bag', 'table', 'drawer']
+    game_state.artifacts['hidden_coin'].is_visible = True
+    game_state.inventory.append('coin')
+    game_state.artifacts['cellar'].items = []
+    assert [artifact.id for artifact in scope.in_scope(hall)] == ['coin', 'bag', 'table', 'drawer', 'hidden_coin']
+    # everything listed can be resolved
+    assert all(scope.resolve(artifact.name, hall) is not None for artifact in scope.in_scope(hall))
@@ -0,0 +1,71 @@
+# tests/game/test_state_events.py
+import pytest
+from game.models import GameState
+from game.core.fixture import Fixture
+from game.core.item import Item
+from game.state_events import StateEventEngine
+
+@pytest.fixture
+def game_state():
+    artifacts = [
+        Fixture.model_validate({
+            'id': 'chest',
+            'name': 'Chest',
+            'description_': {'start': 'It is a chest.'},
+            'items_': ['coin'],
+            'properties': {'is_openable': True},
+        }),
+        Fixture.model_validate({
+            'id': 'lamp',
+            'name': 'Lamp',
+            'description_': {'start': 'It is a lamp.'},
+            'properties': {'is_flammable': True},
+            'triggers': {'chest_ready__True': {'is_lit': True}},
+        }),
+        Item.model_validate({
+            'id': 'coin',
+            'name': 'Coin',
+            'description_': {'start': 'It is a coin.'},
+        }),
+    ]
+    game_state = GameState(state_events={
+        'chest_ready': {'artifacts': {'chest': {'is_open': True}}, 'events': {}},
+        'chest_empty': {'artifacts': {'chest': {'items': []}}, 'events': {'chest_ready': True}},
+        'lamp_lit': {'artifacts': {'lamp': {'is_lit': True}}, 'events': {}},
+    })
+    game_state.artifacts = {artifact.id: artifact for artifact in artifacts}
+    return game_state
+
+def test_state_event_index(game_state):
+    engine = StateEventEngine(game_state)
+    assert engine.property_index[('chest', 'is_open')] == {'chest_ready'}
+    assert engine.property_index[('chest', 'items')] == {'chest_empty'}
+    assert engine.event_index['chest_ready'] == {'chest_empty'}
+    assert engine.dirty == {'chest_ready', 'chest_empty', 'lamp_lit'}
+
+def test_state_event_initial_evaluation(game_state):
+    engine = StateEventEngine(game_state)
+    engine.evaluate()
+    assert game_state.events == {'chest_ready': False, 'chest_empty': False, 'lamp_lit': False}
+    assert engine.dirty == set()
+
+def test_state_event_only_dirty_events_evaluated(game_state):
+    engine = StateEventEngine(game_state)
+    engine.evaluate()
+    game_state.artifacts['coin'].is_visible = False
+    assert engine.dirty == set()
+    game_state.artifacts['chest'].is_open = True
+    assert engine.dirty == {'chest_ready'}
+
+def test_state_event_propagation(game_state):
+    engine = StateEventEngine(game_state)
+    engine.evaluate()
+    chest = game_state.artifacts['chest']
+    chest.is_open = True
+    chest.items = []
+    engine.evaluate()
+    # chest_ready dispatches the lamp trigger, which in turn satisfies lamp_lit
+    assert game_state.events == {'chest_ready': True, 'chest_empty': True, 'lamp_lit': True}
+    chest.is_open = False
+    engine.evaluate()
+    assert game_state.events == {'chest_ready': False, 'chest_empty': False, 'lamp_lit': True}
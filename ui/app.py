@@ -51,6 +51,11 @@ def initialize_agent():
 # Initialize agent and game state
 initialize_agent()
 
+@st.cache_resource
+def backend_session() -> requests.Session:
+    """A single HTTP session for talking to the backend, so commands reuse its connection."""
+    return requests.Session()
+
 # Configure page
 st.set_page_config(
     page_title="Text Adventure",
@@ -161,7 +166,7 @@ with col1:
             
             try:
                 # Make API request
-                response = requests.get(
+                response = backend_session().get(
                     f"{BACKEND_URL}{RUN_COMMAND}", 
                     params={"command": user_command},
                     timeout=10